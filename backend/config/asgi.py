@@ -14,3 +14,8 @@ from django.core.asgi import get_asgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'config.settings')
 
 application = get_asgi_application()
+
+# Refuse to start several workers on a per-process cache (emr/checks.py)
+from emr.checks import require_shared_cache  # noqa: E402
+
+require_shared_cache()
@@ -0,0 +1,240 @@
+"""
+Per-request timing: query count and time, view time and response rendering
+time, reported in a Server-Timing header, logged for slow requests and
+summed per route for /api/metrics/.
+
+Costs one perf_counter() pair per query and a few per request, so it is
+meant to stay on in production. Metrics are kept per process; each worker
+reports its own.
+"""
+import contextvars
+import json
+import logging
+import os
+import threading
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.utils import timezone
+from rest_framework.exceptions import PermissionDenied
+from rest_framework.permissions import IsAuthenticated
+from rest_framework.response import Response
+from rest_framework.views import APIView
+
+slow_log = logging.getLogger('emr.slow_requests')
+
+# Upper bounds (ms) of the per-route latency histogram buckets
+BUCKETS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+
+# Longest SQL kept for the slow log
+MAX_SQL_LENGTH = 2000
+
+# The QueryTimer of the request being handled
+_timer = contextvars.ContextVar('query_timer', default=None)
+
+
+class QueryTimer:
+    """execute_wrapper that counts queries and keeps the slowest one."""
+
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+        self.worst = (0.0, None)
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            elapsed = time.perf_counter() - start
+            self.count += 1
+            self.seconds += elapsed
+            if elapsed > self.worst[0]:
+                self.worst = (elapsed, sql)
+
+
+class RouteMetrics:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.since = timezone.now()
+        self.routes = {}
+
+    def record(self, route, status, total_ms, db_ms, queries):
+        with self.lock:
+            stats = self.routes.get(route)
+            if stats is None:
+                stats = self.routes[route] = {
+                    'count': 0, 'errors': 0, 'totalMs': 0.0, 'dbMs': 0.0, 'queries': 0, 'maxMs': 0.0,
+                    'buckets': [0] * (len(BUCKETS) + 1),
+                }
+            stats['count'] += 1
+            stats['errors'] += status >= 500
+            stats['totalMs'] += total_ms
+            stats['dbMs'] += db_ms
+            stats['queries'] += queries
+            stats['maxMs'] = max(stats['maxMs'], total_ms)
+            stats['buckets'][_bucket(total_ms)] += 1
+
+    def snapshot(self):
+        with self.lock:
+            routes = {route: dict(stats, buckets=list(stats['buckets'])) for route, stats in self.routes.items()}
+        labels = [f'<={bound}' for bound in BUCKETS] + [f'>{BUCKETS[-1]}']
+        for stats in routes.values():
+            stats['meanMs'] = round(stats['totalMs'] / stats['count'], 2)
+            stats['totalMs'] = round(stats['totalMs'], 2)
+            stats['dbMs'] = round(stats['dbMs'], 2)
+            stats['maxMs'] = round(stats['maxMs'], 2)
+            stats['buckets'] = dict(zip(labels, stats['buckets']))
+        return {'pid': os.getpid(), 'since': self.since.isoformat(), 'routes': routes}
+
+    def reset(self):
+        with self.lock:
+            self.routes = {}
+            self.since = timezone.now()
+
+
+def _bucket(ms):
+    for i, bound in enumerate(BUCKETS):
+        if ms <= bound:
+            return i
+    return len(BUCKETS)
+
+
+metrics = RouteMetrics()
+
+
+def _route(request):
+    match = getattr(request, 'resolver_match', None)
+    if match is None:
+        return 'unresolved'
+    # DRF router routes are regexes: '^patients/(?P<pk>[^/.]+)/$'
+    return f"{request.method} /{match.route.replace('^', '').replace('$', '')}"
+
+
+def _time_query(execute, sql, params, many, context):
+    timer = _timer.get()
+    if timer is None:
+        return execute(sql, params, many, context)
+    return timer(execute, sql, params, many, context)
+
+
+def install_query_timer(sender, connection, **kwargs):
+    """
+    connection_created receiver (connected in emr/apps.py) that wraps every
+    connection for good. The timer itself comes from a context variable, so
+    queries are counted in whichever thread runs them, including the
+    executor threads behind the async ORM.
+    """
+    if _time_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_time_query)
+
+
+class RequestTimingMiddleware:
+    """
+    Put first in MIDDLEWARE so `total` covers the whole stack. `view` runs
+    from the view being called until it returns; `serialize` is the
+    rendering of a DRF/template response that follows.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+            # Under ASGI Django would run the sync hooks in a thread; they
+            # only read the clock
+            self.process_view = self.aprocess_view
+            self.process_template_response = self.aprocess_template_response
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        if not getattr(settings, 'REQUEST_TIMING', True):
+            return self.get_response(request)
+
+        timer = QueryTimer()
+        start = time.perf_counter()
+        request._timing = {'view_start': None, 'view_end': None}
+        token = _timer.set(timer)
+        try:
+            response = self.get_response(request)
+        finally:
+            _timer.reset(token)
+        return self.finish(request, response, timer, start)
+
+    async def __acall__(self, request):
+        if not getattr(settings, 'REQUEST_TIMING', True):
+            return await self.get_response(request)
+
+        timer = QueryTimer()
+        start = time.perf_counter()
+        request._timing = {'view_start': None, 'view_end': None}
+        token = _timer.set(timer)
+        try:
+            response = await self.get_response(request)
+        finally:
+            _timer.reset(token)
+        return self.finish(request, response, timer, start)
+
+    def finish(self, request, response, timer, start):
+        end = time.perf_counter()
+        timing = request._timing
+        total_ms = (end - start) * 1000
+        db_ms = timer.seconds * 1000
+        view_start = timing['view_start'] or start
+        view_end = timing['view_end'] or end
+        view_ms = (view_end - view_start) * 1000
+        serialize_ms = (end - view_end) * 1000
+
+        response['Server-Timing'] = ', '.join([
+            f'db;dur={db_ms:.1f};desc="{timer.count} queries"',
+            f'view;dur={view_ms:.1f}',
+            f'serialize;dur={serialize_ms:.1f}',
+            f'total;dur={total_ms:.1f}',
+        ])
+
+        route = _route(request)
+        metrics.record(route, response.status_code, total_ms, db_ms, timer.count)
+        if total_ms >= getattr(settings, 'SLOW_REQUEST_MS', 500):
+            worst_seconds, worst_sql = timer.worst
+            slow_log.warning(json.dumps({
+                'route': route,
+                'path': request.get_full_path(),
+                'status': response.status_code,
+                'totalMs': round(total_ms, 1),
+                'viewMs': round(view_ms, 1),
+                'serializeMs': round(serialize_ms, 1),
+                'dbMs': round(db_ms, 1),
+                'queries': timer.count,
+                'worstSqlMs': round(worst_seconds * 1000, 1),
+                'worstSql': worst_sql[:MAX_SQL_LENGTH] if worst_sql else None,
+            }))
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        if hasattr(request, '_timing'):
+            request._timing['view_start'] = time.perf_counter()
+
+    def process_template_response(self, request, response):
+        # Called after the view returns and just before the response renders
+        if hasattr(request, '_timing'):
+            request._timing['view_end'] = time.perf_counter()
+        return response
+
+    async def aprocess_view(self, request, view_func, view_args, view_kwargs):
+        return RequestTimingMiddleware.process_view(self, request, view_func, view_args, view_kwargs)
+
+    async def aprocess_template_response(self, request, response):
+        return RequestTimingMiddleware.process_template_response(self, request, response)
+
+
+class MetricsView(APIView):
+    """Cumulative per-route request counts and latency histograms for this process."""
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request):
+        if request.user.role != 'admin' and not request.user.is_superuser:
+            raise PermissionDenied("Only admins can view metrics.")
+        return Response(metrics.snapshot())
@@ -0,0 +1,126 @@
+"""
+Primary/replica database routing.
+
+Every query goes to `default` unless REPLICA_DATABASE names a configured
+database and the view opted in with use_replica() (see ReplicaReadMixin in
+emr/views.py). Two rules keep users from reading stale data after a write:
+
+- once a request writes, its remaining reads go to the primary;
+- after a write, the user's replica reads go to the primary for the next
+  REPLICA_PIN_SECONDS, which should cover the replica's lag.
+"""
+import contextvars
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS
+
+_state = contextvars.ContextVar('db_routing', default=None)
+
+
+class RoutingState:
+    def __init__(self):
+        self.replica = False # Reads may use the replica
+        self.wrote = False
+
+
+def replica_alias():
+    return getattr(settings, 'REPLICA_DATABASE', None)
+
+
+def _pin_key(user_id):
+    return f'emr:replica-pin:{user_id}'
+
+
+def pin_user(user_id):
+    seconds = getattr(settings, 'REPLICA_PIN_SECONDS', 5)
+    if seconds > 0:
+        cache.set(_pin_key(user_id), True, seconds)
+
+
+def user_pinned(user_id):
+    return bool(cache.get(_pin_key(user_id)))
+
+
+def read_alias():
+    """The database this request's replica-eligible reads should use right now."""
+    state = _state.get()
+    alias = replica_alias()
+    if alias and state is not None and state.replica and not state.wrote:
+        return alias
+    return DEFAULT_DB_ALIAS
+
+
+def use_replica(user_id=None):
+    """
+    Let the rest of the current request read from the replica, unless the
+    user wrote recently. No-op outside ReplicaPinningMiddleware.
+    """
+    state = _state.get()
+    if state is not None and replica_alias():
+        state.replica = user_id is None or not user_pinned(user_id)
+
+
+class PrimaryReplicaRouter:
+    def db_for_read(self, model, **hints):
+        alias = read_alias()
+        return alias if alias != DEFAULT_DB_ALIAS else None
+
+    def db_for_write(self, model, **hints):
+        state = _state.get()
+        if state is not None:
+            state.wrote = True
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Both databases hold the same data
+        return True
+
+
+class ReplicaPinningMiddleware:
+    """
+    Tracks writes per request for the router and pins the user to the
+    primary after one. Must come after authentication; DRF copies the user
+    it authenticates onto the Django request, so JWT users are seen here
+    once the view has run.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        state = RoutingState()
+        token = _state.set(state)
+        try:
+            response = self.get_response(request)
+        finally:
+            _state.reset(token)
+        self.pin_writer(request, state)
+        return response
+
+    async def __acall__(self, request):
+        # The state object is shared with the threads that run the ORM, so
+        # their writes are seen here
+        state = RoutingState()
+        token = _state.set(state)
+        try:
+            response = await self.get_response(request)
+        finally:
+            _state.reset(token)
+        if state.wrote:
+            # request.user may still be a lazy session lookup
+            await sync_to_async(self.pin_writer)(request, state)
+        return response
+
+    def pin_writer(self, request, state):
+        user = getattr(request, 'user', None)
+        if state.wrote and replica_alias() and user is not None and user.is_authenticated:
+            pin_user(user.pk)
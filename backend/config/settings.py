@@ -50,12 +50,14 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'config.instrumentation.RequestTimingMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'config.routers.ReplicaPinningMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -83,13 +85,93 @@ WSGI_APPLICATION = 'config.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/6.0/ref/settings/#databases
 
-DATABASES = {
+# SQLite by default; set POSTGRES_DB (and POSTGRES_USER, POSTGRES_PASSWORD,
+# POSTGRES_HOST, POSTGRES_PORT) to use Postgres, which needs psycopg[pool]. A read replica for the
+# dashboard, reports and exports is added with DB_REPLICA_NAME (a second
+# SQLite file, refreshed by `manage.py sync_replica`) or
+# POSTGRES_REPLICA_HOST. See config/routers.py.
+DB_CONN_MAX_AGE = int(os.environ.get('DB_CONN_MAX_AGE', 60))
+
+if os.environ.get('POSTGRES_DB'):
+    def _postgres(host, port):
+        return {
+            'ENGINE': 'django.db.backends.postgresql',
+            'NAME': os.environ['POSTGRES_DB'],
+            'USER': os.environ.get('POSTGRES_USER', ''),
+            'PASSWORD': os.environ.get('POSTGRES_PASSWORD', ''),
+            'HOST': host,
+            'PORT': port,
+            # psycopg 3 connection pool, shared by the threads of a worker.
+            # Pooling replaces persistent connections (CONN_MAX_AGE must be 0).
+            'OPTIONS': {'pool': {
+                'min_size': int(os.environ.get('DB_POOL_MIN_SIZE', 2)),
+                'max_size': int(os.environ.get('DB_POOL_MAX_SIZE', 10)),
+                'timeout': int(os.environ.get('DB_POOL_TIMEOUT', 10)),
+            }},
+            'CONN_MAX_AGE': 0,
+        }
+
+    DATABASES = {'default': _postgres(os.environ.get('POSTGRES_HOST', ''), os.environ.get('POSTGRES_PORT', ''))}
+    if os.environ.get('POSTGRES_REPLICA_HOST'):
+        DATABASES['replica'] = _postgres(
+            os.environ['POSTGRES_REPLICA_HOST'], os.environ.get('POSTGRES_REPLICA_PORT', os.environ.get('POSTGRES_PORT', ''))
+        )
+        # A streaming replica has no test database of its own
+        DATABASES['replica']['TEST'] = {'MIRROR': 'default'}
+else:
+    def _sqlite(name, test_name):
+        return {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': name,
+            'OPTIONS': {
+                # Take the write lock at BEGIN so concurrent transactions wait on
+                # the busy timeout instead of failing to upgrade a read lock.
+                'transaction_mode': 'IMMEDIATE',
+                'timeout': 20, # Busy timeout, in seconds
+                # WAL lets readers run alongside the writer; NORMAL sync is
+                # durable across application crashes in WAL mode.
+                'init_command': 'PRAGMA journal_mode=WAL; PRAGMA synchronous=NORMAL;',
+            },
+            'CONN_MAX_AGE': DB_CONN_MAX_AGE,
+            'CONN_HEALTH_CHECKS': True,
+            # A file (not the shared in-memory default) so tests that write from
+            # several threads see normal locking.
+            'TEST': {'NAME': test_name},
+        }
+
+    DATABASES = {'default': _sqlite(BASE_DIR / 'db.sqlite3', BASE_DIR / 'test_db.sqlite3')}
+    if os.environ.get('DB_REPLICA_NAME'):
+        DATABASES['replica'] = _sqlite(BASE_DIR / os.environ['DB_REPLICA_NAME'], BASE_DIR / 'test_replica.sqlite3')
+
+DATABASE_ROUTERS = ['config.routers.PrimaryReplicaRouter']
+REPLICA_DATABASE = 'replica' if 'replica' in DATABASES else None
+
+# After a write, a user's replica reads go to the primary for this long
+# (seconds), so they see their own changes despite replication lag.
+REPLICA_PIN_SECONDS = int(os.environ.get('REPLICA_PIN_SECONDS', 5))
+
+
+# Cache
+# The treatment catalog version (emr/catalog.py) and the auth user cache
+# (emr/authentication.py) live here. Local memory is fine for a single
+# process; deployments running several workers must point
+# CACHE_BACKEND/CACHE_LOCATION at a shared cache (Redis, memcached, or the
+# file based cache on a single host) so writes are seen by every worker.
+# WEB_CONCURRENCY, which gunicorn and uvicorn read as their worker count,
+# is checked against it at startup (emr/checks.py).
+WEB_CONCURRENCY = int(os.environ.get('WEB_CONCURRENCY', 1))
+
+CACHES = {
     'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
+        'BACKEND': os.environ.get('CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': os.environ.get('CACHE_LOCATION', ''),
     }
 }
 
+# Upper bound (seconds) on how long a worker serves its catalog copy without
+# reloading, even when no invalidation reached it.
+TREATMENT_CATALOG_MAX_AGE = int(os.environ.get('TREATMENT_CATALOG_MAX_AGE', 300))
+
 
 # Password validation
 # https://docs.djangoproject.com/en/6.0/ref/settings/#auth-password-validators
@@ -131,6 +213,13 @@ STATIC_URL = 'static/'
 MEDIA_URL = '/media/'
 MEDIA_ROOT = BASE_DIR / 'media'
 
+# Resumable attachment uploads (emr/uploads.py). Partial files are kept here,
+# outside MEDIA_ROOT so they are never served, until finalized. Keep it on the
+# same filesystem as MEDIA_ROOT so finished files are moved, not copied.
+UPLOAD_TEMP_DIR = Path(os.environ.get('UPLOAD_TEMP_DIR', BASE_DIR / 'upload_tmp'))
+UPLOAD_MAX_SIZE = int(os.environ.get('UPLOAD_MAX_SIZE', 500 * 1024 * 1024))
+UPLOAD_CHUNK_MAX_SIZE = int(os.environ.get('UPLOAD_CHUNK_MAX_SIZE', 8 * 1024 * 1024))
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/6.0/ref/settings/#default-auto-field
 
@@ -142,18 +231,77 @@ AUTH_USER_MODEL = 'emr.User'
 # REST Framework
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        'emr.authentication.CachedJWTAuthentication',
     ),
     'DEFAULT_PERMISSION_CLASSES': (
         'rest_framework.permissions.IsAuthenticated',
     ),
+    # orjson when installed, with output identical to DRF's JSONRenderer
+    'DEFAULT_RENDERER_CLASSES': (
+        'emr.renderers.FastJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ),
 }
 
+# List endpoints render from values() rows instead of model instances when
+# the requested fields allow it (emr/fastpath.py). Off falls back to the
+# serializers, which produce the same output.
+API_VALUES_READ_PATH = os.environ.get('API_VALUES_READ_PATH', '1') == '1'
+
+# Default page size for the keyset paginated list endpoints (see emr/pagination.py).
+# Clients can ask for a different size with ?pageSize=, capped at 200.
+API_PAGE_SIZE = int(os.environ.get('API_PAGE_SIZE', 50))
+
+# Bill numbers reserved per database round-trip (see emr/sequences.py).
+# 1 keeps the per-year sequence gap free; larger blocks cut contention on the
+# counter row at the cost of gaps when a worker exits with unused numbers.
+BILL_NUMBER_BLOCK_SIZE = int(os.environ.get('BILL_NUMBER_BLOCK_SIZE', 1))
+
+# Background jobs (emr/jobs.py), run by `manage.py runworkers`.
+# JOBS_RUN_INLINE runs each job in the web process after commit instead,
+# for development without a worker.
+JOBS_RUN_INLINE = os.environ.get('JOBS_RUN_INLINE', '') == '1'
+JOBS_LEASE_SECONDS = 600 # A running job is re-queued if its worker is silent this long
+JOBS_RETRY_BASE_SECONDS = 10
+# Done and failed jobs are deleted by runworkers this many days after they finish
+JOBS_KEEP_FINISHED_DAYS = int(os.environ.get('JOBS_KEEP_FINISHED_DAYS', 7))
+
 # JWT Settings
 SIMPLE_JWT = {
     'ACCESS_TOKEN_LIFETIME': timedelta(days=1), # Long lifetime for dev
     'REFRESH_TOKEN_LIFETIME': timedelta(days=7),
 }
 
+# Seconds an authenticated user is served from the cache (emr/authentication.py)
+AUTH_USER_CACHE_SECONDS = int(os.environ.get('AUTH_USER_CACHE_SECONDS', 300))
+
+# Seconds a patient timeline payload is kept (emr/timeline.py). Writes change
+# its cache key, so this only bounds how long unused payloads linger.
+PATIENT_TIMELINE_CACHE_SECONDS = int(os.environ.get('PATIENT_TIMELINE_CACHE_SECONDS', 300))
+
 # CORS Settings
 CORS_ALLOW_ALL_ORIGINS = True # For development
+
+# Bulk imports (emr/importer.py). Rows are validated and inserted this many
+# at a time, each batch in its own transaction.
+IMPORT_BATCH_SIZE = int(os.environ.get('IMPORT_BATCH_SIZE', 500))
+
+# Request timing (config/instrumentation.py): Server-Timing header on every
+# response, per-route totals at /api/metrics/, and a JSON line on the
+# emr.slow_requests logger for requests slower than SLOW_REQUEST_MS.
+REQUEST_TIMING = os.environ.get('REQUEST_TIMING', '1') == '1'
+SLOW_REQUEST_MS = int(os.environ.get('SLOW_REQUEST_MS', 500))
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'formatters': {
+        'message': {'format': '%(message)s'},
+    },
+    'handlers': {
+        'slow_requests': {'class': 'logging.StreamHandler', 'formatter': 'message'},
+    },
+    'loggers': {
+        'emr.slow_requests': {'handlers': ['slow_requests'], 'level': 'WARNING', 'propagate': False},
+    },
+}
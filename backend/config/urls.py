@@ -4,12 +4,15 @@ from django.conf import settings
 from django.conf.urls.static import static
 from django.http import HttpResponse
 
+from .instrumentation import MetricsView
+
 def home(request):
     return HttpResponse("<h1>Backend Service is Running Successfully!</h1><p>Go to <a href='/admin/'>/admin/</a> or use API endpoints at /api/</p>")
 
 urlpatterns = [
     path('', home),
     path('admin/', admin.site.urls),
+    path('api/metrics/', MetricsView.as_view()),
     path('api/', include('emr.urls')),
 ]
 
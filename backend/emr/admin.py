@@ -1,6 +1,6 @@
 from django.contrib import admin
 from django.contrib.auth.admin import UserAdmin
-from .models import User, Patient, Visit, VisitAttachment, Treatment
+from .models import User, Patient, Visit, VisitAttachment, Treatment, Job
 
 # Register the custom User model
 admin.site.register(User, UserAdmin)
@@ -24,3 +24,9 @@ class VisitAttachmentAdmin(admin.ModelAdmin):
 @admin.register(Treatment)
 class TreatmentAdmin(admin.ModelAdmin):
     list_display = ('title', 'description')
+
+@admin.register(Job)
+class JobAdmin(admin.ModelAdmin):
+    list_display = ('name', 'status', 'attempts', 'run_at', 'locked_by', 'finished_at')
+    list_filter = ('status', 'name')
+    readonly_fields = ('last_error',)
@@ -3,3 +3,11 @@ from django.apps import AppConfig
 
 class EmrConfig(AppConfig):
     name = 'emr'
+
+    def ready(self):
+        from django.db.backends.signals import connection_created
+        from config import instrumentation
+        from . import checks, signals  # noqa: F401
+
+        # Before any connection is opened, so every one of them is timed
+        connection_created.connect(instrumentation.install_query_timer, dispatch_uid='emr.query_timer')
@@ -0,0 +1,116 @@
+"""
+Async variants of the hottest read endpoints, for ASGI deployments
+(`uvicorn config.asgi:application`), under /api/async/.
+
+DRF views are sync, so under ASGI every request to one of them is handed to
+a worker thread. These are plain Django async views. They authenticate the
+same way (CachedJWTAuthentication), read through the async ORM, issue
+independent queries together with asyncio.gather, and render with the same
+serializers and renderer, so their bodies match the sync endpoints':
+
+    /api/async/dashboard/stats/             /api/dashboard/stats/
+    /api/async/patients/search/?search=     /api/patients/?search=
+    /api/async/patients/<id>/visits/        /api/visits/?patientId=<id>, unpaged
+
+Django's async ORM still runs each query on the request's thread-sensitive
+executor, one at a time. gather() saves the hops between the event loop and
+that thread, not database time.
+"""
+import asyncio
+import functools
+
+from asgiref.sync import sync_to_async
+from django.http import HttpResponse
+from django.utils import timezone
+from rest_framework import exceptions
+from rest_framework.request import Request
+
+from config import routers
+from .authentication import CachedJWTAuthentication
+from .models import DailyStats, Visit
+from .pagination import PatientPagination
+from .renderers import FastJSONRenderer
+from .search import asearch_patients
+from .serializers import PatientSerializer, VisitSerializer
+from .sparse import sparse_options
+from .views import prefetch_for_visits
+from . import dashboard
+
+_authentication = CachedJWTAuthentication()
+_renderer = FastJSONRenderer()
+
+
+def respond(data, status=200):
+    return HttpResponse(_renderer.render(data), status=status, content_type=_renderer.media_type)
+
+
+def _authenticate(request):
+    # Sync: a cache miss loads the user from the database
+    result = _authentication.authenticate(request)
+    if result is None:
+        raise exceptions.NotAuthenticated()
+    request.user, request.auth = result
+    routers.use_replica(request.user.pk)
+
+
+def _error(exc):
+    # As DRF's exception handler renders it
+    data = exc.detail if isinstance(exc.detail, (list, dict)) else {'detail': exc.detail}
+    response = respond(data, status=exc.status_code)
+    if isinstance(exc, (exceptions.NotAuthenticated, exceptions.AuthenticationFailed)):
+        response['WWW-Authenticate'] = _authentication.authenticate_header(None)
+    return response
+
+
+def api_view(view):
+    """GET-only, JWT authenticated async view returning a response from respond()."""
+    @functools.wraps(view)
+    async def wrapper(request, *args, **kwargs):
+        if request.method != 'GET':
+            response = _error(exceptions.MethodNotAllowed(request.method))
+            response['Allow'] = 'GET'
+            return response
+        try:
+            await sync_to_async(_authenticate)(request)
+            return await view(request, *args, **kwargs)
+        except exceptions.APIException as exc:
+            return _error(exc)
+    return wrapper
+
+
+@api_view
+async def dashboard_stats(request):
+    today = timezone.localdate()
+    try:
+        days = dashboard.parse_days(request.GET.get('days', 7))
+    except ValueError:
+        return respond({'error': 'Invalid days'}, status=400)
+
+    async def window():
+        return [row async for row in dashboard.window_query(today, days)]
+
+    totals, rows = await asyncio.gather(
+        DailyStats.objects.aaggregate(**dashboard.totals_query()), window()
+    )
+    return respond(dashboard.payload(today, days, totals, rows))
+
+
+@api_view
+async def patient_search(request):
+    limit = PatientPagination().get_page_size(Request(request))
+    patients = await asearch_patients(request.GET.get('search', ''), limit=limit)
+    serializer = PatientSerializer(patients, many=True, context={'request': request}, **sparse_options(request.GET, compact=True))
+    return respond({'next': None, 'previous': None, 'results': serializer.data})
+
+
+@api_view
+async def patient_visits(request, pk):
+    options = sparse_options(request.GET, compact=True)
+    columns = VisitSerializer(**options)
+    queryset = Visit.objects.filter(patient_id=pk).order_by('-date', '-id').only(*columns.model_columns())
+    visits = [visit async for visit in prefetch_for_visits(queryset, columns.fields)]
+
+    # Treatment details come from the catalog, which may have to reload
+    serializer = VisitSerializer(visits, many=True, context={'request': request}, **options)
+    data = await sync_to_async(lambda: serializer.data)()
+    return respond({'next': None, 'previous': None, 'results': data})
@@ -0,0 +1,57 @@
+"""
+JWT authentication that resolves the user from the cache.
+
+simplejwt's JWTAuthentication loads the user row on every request. Here the
+user's columns (all but the password hash) are cached per user id for
+AUTH_USER_CACHE_SECONDS and the instance is rebuilt from them, so an
+authenticated request costs no query. Saving or deleting a User drops the
+entry (emr/signals.py); writes that skip signals, like QuerySet.update(),
+are picked up when it expires. Like the catalog version, the entry is only
+dropped for every worker if the cache is shared (emr/checks.py).
+
+Tokens carry the user's token_version (VERSION_CLAIM), which a password
+change (User.change_password) bumps, so tokens issued before it are refused.
+"""
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken
+from rest_framework_simplejwt.settings import api_settings
+
+from .models import User
+
+VERSION_CLAIM = 'ver'
+
+# In concrete field order, as Model.from_db expects; the password is left
+# deferred and loaded only if something reads it
+CACHED_FIELDS = [field.attname for field in User._meta.concrete_fields if field.attname != 'password']
+
+
+def cache_key(user_id):
+    return f'emr:auth-user:{user_id}'
+
+
+def forget(user_id):
+    cache.delete(cache_key(user_id))
+
+
+class CachedJWTAuthentication(JWTAuthentication):
+    def get_user(self, validated_token):
+        try:
+            user_id = validated_token[api_settings.USER_ID_CLAIM]
+        except KeyError:
+            raise InvalidToken("Token contained no recognizable user identification")
+
+        values = cache.get(cache_key(user_id))
+        if values is None:
+            # Missing and inactive users are refused here and never cached
+            user = super().get_user(validated_token)
+            cache.set(cache_key(user_id), [getattr(user, name) for name in CACHED_FIELDS],
+                      getattr(settings, 'AUTH_USER_CACHE_SECONDS', 300))
+        else:
+            user = User.from_db(DEFAULT_DB_ALIAS, CACHED_FIELDS, values)
+
+        if validated_token.get(VERSION_CLAIM, 0) != user.token_version:
+            raise AuthenticationFailed("The user's password has been changed.", code='password_changed')
+        return user
@@ -0,0 +1,147 @@
+"""
+Several writes applied in one request and one transaction (POST /api/batch/),
+so a reception checkout is a single round-trip:
+
+    {"operations": [
+        {"op": "create_patient", "data": {"name": "...", "regNo": "...", ...}},
+        {"op": "create_visit", "data": {"patientId": "$0.id", "date": "...", ...}},
+        {"op": "update_visit", "id": "$1.id", "data": {"visit_treatments": [...], "totalAmount": "3000"}},
+        {"op": "add_payment", "id": "$1.id", "data": {"amount": "1000", "mode": "upi"}},
+        {"op": "get_visit", "id": "$1.id"}
+    ]}
+
+Operations run in order through the same serializers and billing code as
+their single endpoints. A string "$N.field" (or "$N.field.sub") anywhere in
+an operation's `id` or `data` is replaced with that value from the result of
+operation N. The first operation that fails rolls back the whole batch.
+Receipts are queued once per bill touched, after the last operation.
+"""
+import re
+from decimal import InvalidOperation
+
+from django.core.exceptions import ObjectDoesNotExist, ValidationError
+from django.db import IntegrityError, transaction
+from rest_framework import serializers
+
+from .billing import parse_amount, record_payment
+from .models import Visit
+from .serializers import PatientSerializer, VisitSerializer
+from . import receipts
+
+MAX_OPERATIONS = 50
+
+REFERENCE_RE = re.compile(r'\$(\d+)((?:\.\w+)+)')
+
+
+class BatchError(Exception):
+    def __init__(self, message, index=None, op=None, status=400, details=None):
+        super().__init__(message)
+        self.index = index
+        self.op = op
+        self.status = status
+        self.details = details
+
+    def as_dict(self):
+        return {'error': str(self), 'index': self.index, 'op': self.op, 'details': self.details}
+
+
+class Batch:
+    OPERATIONS = ('create_patient', 'create_visit', 'update_visit', 'add_payment', 'get_visit')
+
+    def __init__(self, request):
+        self.request = request
+        self.context = {'request': request}
+        self.results = []
+        self.bills = {} # Bills whose receipt needs rendering, by id
+
+    def run(self, operations):
+        if not isinstance(operations, list) or not operations:
+            raise BatchError("operations must be a non-empty list")
+        if len(operations) > MAX_OPERATIONS:
+            raise BatchError(f"A batch may have at most {MAX_OPERATIONS} operations")
+        with transaction.atomic():
+            for index, operation in enumerate(operations):
+                self.results.append(self.apply(index, operation))
+            for bill in self.bills.values():
+                receipts.schedule(bill)
+        return self.results
+
+    def apply(self, index, operation):
+        name = operation.get('op') if isinstance(operation, dict) else None
+        if name not in self.OPERATIONS:
+            raise BatchError(f"op must be one of {', '.join(self.OPERATIONS)}", index, name)
+        try:
+            pk = self.resolve(operation.get('id'))
+            data = self.resolve(operation.get('data') or {})
+        except LookupError as e:
+            raise BatchError(str(e), index, name)
+        if not isinstance(data, dict):
+            raise BatchError("data must be an object", index, name)
+
+        try:
+            status, result = getattr(self, name)(pk, data)
+        except serializers.ValidationError as e:
+            raise BatchError(f"Operation {index} ({name}) is invalid", index, name, details=e.detail)
+        except ValidationError as e:
+            # From a model field, below the serializers
+            raise BatchError(f"Operation {index} ({name}) is invalid", index, name, details=e.messages)
+        except ObjectDoesNotExist:
+            raise BatchError(f"Operation {index} ({name}): not found", index, name, status=404)
+        except IntegrityError as e:
+            # A concurrent write got there first (a regNo, say); the batch rolls back
+            raise BatchError(f"Operation {index} ({name}) conflicts with existing data: {e}", index, name)
+        except (TypeError, ValueError, InvalidOperation) as e:
+            # A malformed id or amount
+            raise BatchError(f"Operation {index} ({name}): {e}", index, name)
+        return {'op': name, 'status': status, 'data': result}
+
+    def resolve(self, value):
+        """`value` with every "$N.path" string replaced by what it refers to."""
+        if isinstance(value, dict):
+            return {key: self.resolve(item) for key, item in value.items()}
+        if isinstance(value, list):
+            return [self.resolve(item) for item in value]
+        if not isinstance(value, str):
+            return value
+        match = REFERENCE_RE.fullmatch(value)
+        if match is None:
+            return value
+        position = int(match.group(1))
+        if position >= len(self.results):
+            raise LookupError(f"{value} refers to an operation that has not run yet")
+        resolved = self.results[position]['data']
+        for key in match.group(2)[1:].split('.'):
+            if not isinstance(resolved, dict) or key not in resolved:
+                raise LookupError(f"{value} does not exist in the result of operation {position}")
+            resolved = resolved[key]
+        return resolved
+
+    def _save(self, serializer):
+        serializer.is_valid(raise_exception=True)
+        return serializer.save()
+
+    def create_patient(self, pk, data):
+        serializer = PatientSerializer(data=data, context=self.context)
+        self._save(serializer)
+        return 201, serializer.data
+
+    def create_visit(self, pk, data):
+        serializer = VisitSerializer(data=data, context=self.context)
+        self._save(serializer)
+        return 201, serializer.data
+
+    def update_visit(self, pk, data):
+        serializer = VisitSerializer(Visit.objects.get(pk=pk), data=data, partial=True, context=self.context)
+        visit = self._save(serializer)
+        if hasattr(visit, 'bill'):
+            self.bills[visit.bill.pk] = visit.bill
+        return 200, serializer.data
+
+    def add_payment(self, pk, data):
+        visit = Visit.objects.select_related('bill').get(pk=pk)
+        payment = record_payment(visit, parse_amount(data.get('amount')), data.get('mode', 'cash'), self.request.user)
+        self.bills[visit.bill.pk] = visit.bill
+        return 200, {'status': 'success', 'payment_id': payment.id}
+
+    def get_visit(self, pk, data):
+        return 200, VisitSerializer(Visit.objects.get(pk=pk), context=self.context).data
@@ -0,0 +1,314 @@
+"""
+HTTP benchmark for the main API endpoints, run against a live server with
+concurrent clients (see `manage.py benchmark`).
+
+Each scenario sends a fixed number of requests from a pool of threads, each
+with its own keep-alive connection, and records latency percentiles,
+throughput, errors and the query count reported in the Server-Timing header
+(config/instrumentation.py). Results are plain dicts so they can be saved as
+JSON and compared between runs.
+
+Server starts a local WSGI or ASGI server to run them against (see
+`manage.py benchmark_servers`).
+"""
+import http.client
+import importlib.util
+import json
+import platform
+import random
+import re
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlencode, urlsplit
+
+from django.utils import timezone
+
+SCENARIOS = (
+    'login', 'search', 'visits', 'patient_visits', 'add_payment', 'dashboard',
+    # The same reads through the async views (emr/async_views.py)
+    'async_search', 'async_patient_visits', 'async_dashboard',
+)
+
+# Read-only scenarios with both a sync and an async endpoint
+ASYNC_PAIRS = (('search', 'async_search'), ('patient_visits', 'async_patient_visits'), ('dashboard', 'async_dashboard'))
+
+# Metrics compared between runs; all are "lower is better"
+COMPARED = ('p50Ms', 'p95Ms', 'p99Ms', 'meanQueries')
+
+QUERIES_RE = re.compile(r'db;[^,]*desc="(\d+) queries"')
+
+
+class BenchmarkError(Exception):
+    pass
+
+
+def percentile(values, pct):
+    """Nearest-rank percentile of a sorted list."""
+    if not values:
+        return None
+    rank = max(1, -(-len(values) * pct // 100))
+    return values[int(rank) - 1]
+
+
+class Client:
+    """One keep-alive connection to the server; not shared between threads."""
+
+    def __init__(self, base_url, token=None, timeout=30):
+        url = urlsplit(base_url)
+        connection_class = http.client.HTTPSConnection if url.scheme == 'https' else http.client.HTTPConnection
+        self.connection = connection_class(url.hostname, url.port, timeout=timeout)
+        self.prefix = url.path.rstrip('/')
+        self.token = token
+
+    def request(self, method, path, data=None):
+        """Returns (status, body bytes, query count or None)."""
+        headers = {'Accept': 'application/json'}
+        body = None
+        if data is not None:
+            body = json.dumps(data)
+            headers['Content-Type'] = 'application/json'
+        if self.token:
+            headers['Authorization'] = f'Bearer {self.token}'
+        try:
+            self.connection.request(method, self.prefix + path, body=body, headers=headers)
+            response = self.connection.getresponse()
+            content = response.read()
+        except (OSError, http.client.HTTPException):
+            # Reconnect on the next request
+            self.connection.close()
+            raise
+        match = QUERIES_RE.search(response.getheader('Server-Timing') or '')
+        return response.status, content, int(match.group(1)) if match else None
+
+    def close(self):
+        self.connection.close()
+
+
+class Benchmark:
+    def __init__(self, base_url, email, password, concurrency=8, requests=200, seed=0):
+        self.base_url = base_url
+        self.email = email
+        self.password = password
+        self.concurrency = concurrency
+        self.requests = requests
+        self.rng = random.Random(seed)
+        self.local = threading.local()
+
+    def login(self):
+        status, content, _ = Client(self.base_url).request(
+            'POST', '/api/auth/login/', {'email': self.email, 'password': self.password}
+        )
+        if status != 200:
+            raise BenchmarkError(f"Login as {self.email} failed with HTTP {status}")
+        return json.loads(content)['access']
+
+    def prepare(self):
+        """Log in and sample the search terms and visit ids the scenarios use."""
+        self.token = self.login()
+        client = Client(self.base_url, self.token)
+        _, content, _ = client.request('GET', '/api/patients/?' + urlencode({'fields': 'name,regNo', 'pageSize': 200}))
+        patients = json.loads(content)['results']
+        _, content, _ = client.request('GET', '/api/visits/?' + urlencode({'fields': 'id,patientId', 'pageSize': 200}))
+        visits = json.loads(content)['results']
+        self.visit_ids = [visit['id'] for visit in visits]
+        self.patient_ids = sorted({visit['patientId'] for visit in visits})
+        client.close()
+        if not patients or not self.visit_ids:
+            raise BenchmarkError("The database has no patients or visits; run `manage.py seed_synthetic` first")
+        # A mix of name prefixes, full names and registration numbers
+        self.search_terms = [p['name'].split()[0][:3] for p in patients] + [p['name'] for p in patients] + \
+                            [p['regNo'] for p in patients]
+
+    def client(self):
+        client = getattr(self.local, 'client', None)
+        if client is None:
+            client = self.local.client = Client(self.base_url, self.token)
+        return client
+
+    def call(self, scenario):
+        client = self.client()
+        if scenario == 'login':
+            client.token = None
+            try:
+                return client.request('POST', '/api/auth/login/', {'email': self.email, 'password': self.password})
+            finally:
+                client.token = self.token
+        if scenario == 'search':
+            return client.request('GET', '/api/patients/?' + urlencode({'search': self.rng.choice(self.search_terms)}))
+        if scenario == 'async_search':
+            return client.request('GET', '/api/async/patients/search/?' + urlencode({'search': self.rng.choice(self.search_terms)}))
+        if scenario == 'visits':
+            return client.request('GET', '/api/visits/')
+        if scenario == 'patient_visits':
+            return client.request('GET', '/api/visits/?' + urlencode({'patientId': self.rng.choice(self.patient_ids)}))
+        if scenario == 'async_patient_visits':
+            return client.request('GET', f'/api/async/patients/{self.rng.choice(self.patient_ids)}/visits/')
+        if scenario == 'add_payment':
+            visit_id = self.rng.choice(self.visit_ids)
+            return client.request('POST', f'/api/visits/{visit_id}/add_payment/', {'amount': '1.00', 'mode': 'cash'})
+        if scenario == 'dashboard':
+            return client.request('GET', '/api/dashboard/stats/')
+        if scenario == 'async_dashboard':
+            return client.request('GET', '/api/async/dashboard/stats/')
+        raise BenchmarkError(f"Unknown scenario {scenario!r}")
+
+    def timed_call(self, scenario):
+        start = time.perf_counter()
+        try:
+            status, _, queries = self.call(scenario)
+        except (OSError, http.client.HTTPException):
+            status, queries = None, None
+        return (time.perf_counter() - start) * 1000, status, queries
+
+    def run_scenario(self, scenario):
+        with ThreadPoolExecutor(self.concurrency) as pool:
+            # Warm up each connection (and the server's caches) first
+            list(pool.map(lambda _: self.call(scenario), range(self.concurrency)))
+            start = time.perf_counter()
+            samples = list(pool.map(lambda _: self.timed_call(scenario), range(self.requests)))
+            elapsed = time.perf_counter() - start
+        return summarize(samples, elapsed)
+
+    def run(self, scenarios=SCENARIOS):
+        self.prepare()
+        results = {}
+        for scenario in scenarios:
+            self.local = threading.local()
+            results[scenario] = self.run_scenario(scenario)
+        return {
+            'startedAt': timezone.now().isoformat(),
+            'baseUrl': self.base_url,
+            'concurrency': self.concurrency,
+            'requests': self.requests,
+            'commit': _git_commit(),
+            'python': platform.python_version(),
+            'scenarios': results,
+        }
+
+
+def summarize(samples, elapsed):
+    latencies = sorted(ms for ms, _, _ in samples)
+    queries = [count for _, _, count in samples if count is not None]
+    errors = sum(1 for _, status, _ in samples if status is None or status >= 400)
+    return {
+        'requests': len(samples),
+        'errors': errors,
+        'throughput': round(len(samples) / elapsed, 1) if elapsed else None,
+        'meanMs': round(sum(latencies) / len(latencies), 2) if latencies else None,
+        'p50Ms': _round(percentile(latencies, 50)),
+        'p95Ms': _round(percentile(latencies, 95)),
+        'p99Ms': _round(percentile(latencies, 99)),
+        'maxMs': _round(latencies[-1] if latencies else None),
+        'meanQueries': round(sum(queries) / len(queries), 1) if queries else None,
+        'maxQueries': max(queries) if queries else None,
+    }
+
+
+def _round(value):
+    return round(value, 2) if value is not None else None
+
+
+def _git_commit():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, timeout=5, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def compare(baseline, current, tolerance=0.1):
+    """
+    Metrics that got worse than the baseline by more than `tolerance`
+    (a fraction), as (scenario, metric, before, after) tuples. Throughput
+    regresses when it drops by more than `tolerance`.
+    """
+    regressions = []
+    for scenario, after in current['scenarios'].items():
+        before = baseline.get('scenarios', {}).get(scenario)
+        if before is None:
+            continue
+        for metric in COMPARED:
+            old, new = before.get(metric), after.get(metric)
+            if old is not None and new is not None and new > old * (1 + tolerance):
+                regressions.append((scenario, metric, old, new))
+        old, new = before.get('throughput'), after.get('throughput')
+        if old and new is not None and new < old * (1 - tolerance):
+            regressions.append((scenario, 'throughput', old, new))
+    return regressions
+
+
+class Server:
+    """
+    A local server process for the project, started on enter and stopped on
+    exit. `kind` is 'wsgi' (gunicorn when installed, runserver otherwise)
+    or 'asgi' (uvicorn). Both run a single process so the numbers compare
+    one event loop with one pool of threads.
+    """
+
+    def __init__(self, kind, port, threads=8, cwd=None, startup_timeout=30):
+        self.kind = kind
+        self.port = port
+        self.threads = threads
+        self.cwd = cwd
+        self.startup_timeout = startup_timeout
+        self.process = None
+        self.log = None
+
+    @property
+    def url(self):
+        return f'http://127.0.0.1:{self.port}'
+
+    def command(self):
+        address = f'127.0.0.1:{self.port}'
+        if self.kind == 'asgi':
+            if importlib.util.find_spec('uvicorn') is None:
+                raise BenchmarkError("The ASGI benchmark needs uvicorn (pip install uvicorn)")
+            return [sys.executable, '-m', 'uvicorn', 'config.asgi:application', '--host', '127.0.0.1',
+                    '--port', str(self.port), '--log-level', 'warning', '--no-access-log']
+        if self.kind == 'wsgi':
+            if importlib.util.find_spec('gunicorn') is not None:
+                return [sys.executable, '-m', 'gunicorn', 'config.wsgi:application', '--bind', address,
+                        '--workers', '1', '--threads', str(self.threads), '--log-level', 'warning']
+            return [sys.executable, 'manage.py', 'runserver', address, '--noreload', '--skip-checks']
+        raise BenchmarkError(f"Unknown server kind {self.kind!r}")
+
+    def __enter__(self):
+        # A file rather than a pipe: runserver logs every request to stderr
+        self.log = tempfile.TemporaryFile()
+        self.process = subprocess.Popen(
+            self.command(), cwd=self.cwd, stdout=subprocess.DEVNULL, stderr=self.log
+        )
+        deadline = time.monotonic() + self.startup_timeout
+        while time.monotonic() < deadline:
+            if self.process.poll() is not None:
+                self.log.seek(0)
+                error = self.log.read().decode(errors='replace').strip()
+                raise BenchmarkError(f"The {self.kind} server exited on startup: {error[-2000:]}")
+            try:
+                socket.create_connection(('127.0.0.1', self.port), timeout=1).close()
+                return self
+            except OSError:
+                time.sleep(0.1)
+        self.stop()
+        raise BenchmarkError(f"The {self.kind} server did not start listening on port {self.port}")
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def stop(self):
+        if self.process is not None and self.process.poll() is None:
+            self.process.terminate()
+            try:
+                self.process.wait(10)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+                self.process.wait()
+        if self.log is not None:
+            self.log.close()
+            self.log = None
@@ -0,0 +1,88 @@
+from decimal import Decimal, InvalidOperation
+
+from django.db import transaction
+from django.utils import timezone
+
+from .models import Bill, Payment, Visit
+
+
+def bill_status(total_paid, grand_total):
+    if grand_total > 0 and total_paid >= grand_total:
+        return 'paid'
+    if total_paid > 0:
+        return 'partially_paid'
+    return 'unpaid'
+
+
+def parse_amount(value):
+    """A payment amount from request data, in rupees and paise. ValueError says what is wrong with it."""
+    if not value:
+        raise ValueError('Amount is required')
+    try:
+        amount = Decimal(str(value))
+    except InvalidOperation:
+        raise ValueError('Invalid amount')
+    if not amount.is_finite():
+        raise ValueError('Invalid amount')
+    field = Payment._meta.get_field('amount')
+    limit = 10 ** (field.max_digits - field.decimal_places)
+    if amount <= 0:
+        raise ValueError('Amount must be positive')
+    if amount >= limit:
+        raise ValueError('Amount is too large')
+    # To paise; rounding can still reach either bound
+    amount = amount.quantize(Decimal(1).scaleb(-field.decimal_places))
+    if not 0 < amount < limit:
+        raise ValueError('Amount is too large' if amount else 'Amount must be positive')
+    return amount
+
+
+def get_or_create_bill(visit):
+    if hasattr(visit, 'bill'):
+        return visit.bill
+    return Bill.objects.create(visit=visit, grand_total=visit.total_amount)
+
+
+def record_payment(visit, amount, mode, received_by):
+    """
+    Add a payment to the visit's bill and move the bill's stored totals and
+    status, under a lock on the bill row. Costs the same number of queries
+    however many payments the bill already has.
+    """
+    with transaction.atomic():
+        bill = get_or_create_bill(visit)
+        bill = Bill.objects.select_for_update().get(pk=bill.pk)
+        payment = Payment.objects.create(bill=bill, amount=amount, mode=mode, received_by=received_by)
+
+        # Summed here in Decimal and written as values: SQLite does
+        # arithmetic on decimal columns in floating point
+        _set_totals(bill, bill.grand_total, bill.total_paid + amount)
+
+        # Cache on Visit for backward compatibility
+        Visit.objects.filter(pk=visit.pk).update(amount_paid=bill.total_paid)
+        visit.amount_paid = bill.total_paid
+    visit.bill = bill
+    return payment
+
+
+def set_grand_total(bill, grand_total):
+    """Change a bill's total, recomputing balance and status against the stored paid amount."""
+    with transaction.atomic():
+        locked = Bill.objects.select_for_update().only('total_paid').get(pk=bill.pk)
+        _set_totals(bill, Decimal(str(grand_total)), locked.total_paid)
+
+
+def _set_totals(bill, grand_total, total_paid):
+    # The caller holds the lock on the bill row
+    bill.grand_total = grand_total
+    bill.total_paid = total_paid
+    bill.balance = grand_total - total_paid
+    bill.status = bill_status(total_paid, grand_total)
+    bill.updated_at = timezone.now()
+    Bill.objects.filter(pk=bill.pk).update(
+        grand_total=bill.grand_total,
+        total_paid=bill.total_paid,
+        balance=bill.balance,
+        status=bill.status,
+        updated_at=bill.updated_at,
+    )
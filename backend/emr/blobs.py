@@ -0,0 +1,111 @@
+import io
+import logging
+import os
+
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import transaction
+from django.db.models import F
+
+from .models import StoredFile, VisitAttachment
+from .storage import content_store, is_content_name
+
+logger = logging.getLogger(__name__)
+
+IMAGE_EXTENSIONS = {'.png', '.jpg', '.jpeg', '.gif', '.webp', '.bmp', '.tif', '.tiff'}
+
+# Longest edge in pixels for each derived image
+VARIANTS = {
+    'thumbnail': 256,
+    'preview': 1280,
+}
+
+
+def retain(names):
+    """Add one reference to each content-addressed file in `names`."""
+    for name in filter(is_content_name, names):
+        if StoredFile.objects.filter(name=name).update(ref_count=F('ref_count') + 1):
+            continue
+        _, created = StoredFile.objects.get_or_create(
+            name=name, defaults={'size': content_store.size(name), 'ref_count': 1}
+        )
+        if not created:
+            StoredFile.objects.filter(name=name).update(ref_count=F('ref_count') + 1)
+
+
+def release(names):
+    """Drop one reference; files nobody points to are deleted after commit."""
+    for name in filter(is_content_name, names):
+        StoredFile.objects.filter(name=name).update(ref_count=F('ref_count') - 1)
+        if StoredFile.objects.filter(name=name, ref_count__lte=0).delete()[0]:
+            transaction.on_commit(lambda name=name: _delete_files(name))
+
+
+def _delete_files(name):
+    # A new upload of the same content may have arrived since
+    if StoredFile.objects.filter(name=name).exists():
+        return
+    content_store.delete(name)
+    for variant in VARIANTS:
+        default_storage.delete(derived_name(name, variant))
+
+
+def attached(names):
+    """Bookkeeping for newly attached files: count the reference and queue preview rendering."""
+    from . import jobs
+    names = [name for name in names if name]
+    retain(names)
+    for name in filter(has_previews, names):
+        jobs.enqueue('render_previews', {'name': name})
+
+
+def has_previews(name):
+    return is_content_name(name) and os.path.splitext(name)[1] in IMAGE_EXTENSIONS
+
+
+def derived_name(name, variant):
+    digest = os.path.splitext(os.path.basename(name))[0]
+    return f'derived/{digest[:2]}/{digest}-{variant}.jpg'
+
+
+def ensure_previews(name):
+    """Render the derived images for `name` once; later calls are no-ops."""
+    if not has_previews(name):
+        return
+    missing = [v for v in VARIANTS if not default_storage.exists(derived_name(name, v))]
+    if not missing:
+        return
+    from PIL import Image, ImageOps
+    try:
+        with content_store.open(name, 'rb') as f:
+            image = ImageOps.exif_transpose(Image.open(f))
+            image = image.convert('RGB')
+    except (OSError, Image.DecompressionBombError):
+        logger.warning("Could not render previews for %s", name, exc_info=True)
+        return
+    for variant in missing:
+        copy = image.copy()
+        copy.thumbnail((VARIANTS[variant], VARIANTS[variant]))
+        buffer = io.BytesIO()
+        copy.save(buffer, 'JPEG', quality=80, optimize=True)
+        default_storage.save(derived_name(name, variant), ContentFile(buffer.getvalue()))
+
+    # The visits showing the file now render new URLs: move their versions
+    # so cached representations and ETags are not served without them
+    from .signals import touch_visit
+    touch_visit(VisitAttachment.objects.filter(file=name).values('visit_id'))
+
+
+def preview_urls(file, request=None):
+    """Original, thumbnail and preview URLs for a stored file; derived ones are None until rendered."""
+    def absolute(url):
+        return request.build_absolute_uri(url) if request else url
+
+    urls = {'url': absolute(file.url), 'thumbnail': None, 'preview': None}
+    if has_previews(file.name):
+        for variant in VARIANTS:
+            # None until the render_previews job has written it
+            name = derived_name(file.name, variant)
+            if default_storage.exists(name):
+                urls[variant] = absolute(default_storage.url(name))
+    return urls
@@ -0,0 +1,93 @@
+import threading
+import time
+import uuid
+from collections import namedtuple
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS
+
+from .models import Treatment
+
+VERSION_KEY = 'emr:treatment-catalog:version'
+
+Snapshot = namedtuple('Snapshot', ['version', 'loaded_at', 'by_id', 'data', 'data_by_id'])
+
+
+class TreatmentCatalog:
+    """
+    Process-local copy of the Treatment table.
+
+    The copy is tagged with a version token kept in the shared Django cache.
+    Any Treatment write replaces the token (see emr/signals.py), so every
+    worker reloads on its next read. Reads only cost a cache lookup; the
+    database is touched when the version changes or the copy is older than
+    TREATMENT_CATALOG_MAX_AGE seconds (a backstop for writes that skip
+    signals). Several workers need a shared cache; see emr/checks.py.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._snapshot = None
+
+    def _current_version(self):
+        version = cache.get(VERSION_KEY)
+        if version is None:
+            cache.add(VERSION_KEY, uuid.uuid4().hex, None)
+            version = cache.get(VERSION_KEY)
+        return version
+
+    def _is_fresh(self, snapshot, version):
+        max_age = getattr(settings, 'TREATMENT_CATALOG_MAX_AGE', 300)
+        return (
+            snapshot is not None and snapshot.version == version
+            and time.monotonic() - snapshot.loaded_at < max_age
+        )
+
+    def _load(self):
+        version = self._current_version()
+        snapshot = self._snapshot
+        if self._is_fresh(snapshot, version):
+            return snapshot
+        from .serializers import TreatmentSerializer
+        with self._lock:
+            snapshot = self._snapshot
+            if self._is_fresh(snapshot, version):
+                return snapshot
+            # From the primary: a lagging replica would be cached under the new version
+            treatments = list(Treatment.objects.using(DEFAULT_DB_ALIAS).order_by('id'))
+            data = TreatmentSerializer(treatments, many=True).data
+            # Swapped in as one object so readers never see a half-built copy
+            snapshot = self._snapshot = Snapshot(
+                version=version,
+                loaded_at=time.monotonic(),
+                by_id={t.pk: t for t in treatments},
+                data=data,
+                data_by_id={t.pk: row for t, row in zip(treatments, data)},
+            )
+        return snapshot
+
+    def version(self):
+        """Token that changes whenever any treatment does."""
+        return self._current_version()
+
+    def invalidate(self):
+        self._snapshot = None
+        cache.set(VERSION_KEY, uuid.uuid4().hex, None)
+
+    def get(self, pk):
+        return self._load().by_id.get(pk)
+
+    def in_bulk(self, pks):
+        by_id = self._load().by_id
+        return {pk: by_id[pk] for pk in pks if pk in by_id}
+
+    def serialized(self):
+        """TreatmentSerializer output for the whole catalog, ordered by id."""
+        return self._load().data
+
+    def representation(self, pk):
+        return self._load().data_by_id.get(pk)
+
+
+catalog = TreatmentCatalog()
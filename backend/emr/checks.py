@@ -0,0 +1,40 @@
+"""
+The treatment catalog version (emr/catalog.py), the auth user cache
+(emr/authentication.py) and, through the catalog version, the timeline cache
+(emr/timeline.py) are invalidated through the Django cache. A cache kept in
+each process's memory only invalidates the worker that made the write, so
+serving from several worker processes needs a shared one.
+"""
+from django.conf import settings
+from django.core import checks
+from django.core.cache import caches
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.exceptions import ImproperlyConfigured
+
+PROCESS_LOCAL_CACHES = (LocMemCache, DummyCache)
+
+
+def cache_errors():
+    workers = getattr(settings, 'WEB_CONCURRENCY', 1)
+    backend = caches['default']
+    if workers > 1 and isinstance(backend, PROCESS_LOCAL_CACHES):
+        return [checks.Error(
+            f"WEB_CONCURRENCY is {workers} but the default cache ({type(backend).__name__}) is not shared "
+            "between processes, so catalog, auth user and timeline invalidations reach only one worker.",
+            hint="Set CACHE_BACKEND and CACHE_LOCATION to a shared cache (Redis, memcached or the file based cache).",
+            id='emr.E001',
+        )]
+    return []
+
+
+@checks.register(checks.Tags.caches)
+def check_shared_cache(app_configs, **kwargs):
+    return cache_errors()
+
+
+def require_shared_cache():
+    """Called by the WSGI/ASGI entry points, which system checks do not cover."""
+    errors = cache_errors()
+    if errors:
+        raise ImproperlyConfigured(errors[0].msg)
@@ -0,0 +1,61 @@
+import hashlib
+
+from django.db import IntegrityError, transaction
+from django.db.models import F, Subquery
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date
+
+from .models import DeletionCount
+
+
+def list_version(model):
+    """
+    (newest updated_at, rows deleted so far) for a whole table: a version for
+    its unfiltered list. One read of the updated_at index and of the
+    DeletionCount row, where an aggregate with COUNT(*) would scan the table.
+    None for an empty table.
+    """
+    deletes = DeletionCount.objects.filter(model=model._meta.label_lower).values('count')
+    return model.objects.order_by('-updated_at').values_list('updated_at', Subquery(deletes)).first()
+
+
+def count_deletion(model):
+    label = model._meta.label_lower
+    if DeletionCount.objects.filter(model=label).update(count=F('count') + 1):
+        return
+    try:
+        with transaction.atomic():
+            DeletionCount.objects.create(model=label, count=1)
+    except IntegrityError:
+        # Created concurrently
+        DeletionCount.objects.filter(model=label).update(count=F('count') + 1)
+
+
+class ConditionalGetMixin:
+    """
+    Weak ETag / Last-Modified support for read endpoints.
+
+    Views pass a cheap `version` (the newest updated_at plus anything else
+    that distinguishes the representation) and a callable that builds the
+    real response. When the client's validators still match, a 304 is
+    returned before anything is serialized.
+    """
+
+    def conditional_response(self, request, version, respond):
+        if version is None or version[0] is None:
+            return respond()
+        stamp = version[0]
+        key = ':'.join(str(part) for part in version) + ':' + request.get_full_path()
+        etag = 'W/"%s"' % hashlib.md5(key.encode()).hexdigest()
+        last_modified = int(stamp.timestamp())
+
+        response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+        if response is None:
+            response = respond()
+            if response.status_code != 200:
+                return response
+        response['ETag'] = etag
+        response['Last-Modified'] = http_date(last_modified)
+        # Browsers may keep the body but must revalidate before using it
+        patch_cache_control(response, private=True, no_cache=True)
+        return response
@@ -0,0 +1,59 @@
+"""
+Dashboard stats, read from the DailyStats rollup (emr/rollups.py).
+
+The two queries are built here and run by the caller, so the sync view
+(DashboardStatsView) and the async one (emr/async_views.py) share them and
+the payload they are turned into.
+"""
+from django.db.models import Sum
+from django.utils import timezone
+
+from .models import DailyStats
+
+MAX_DAYS = 366
+
+
+def parse_days(value):
+    """The chart length asked for, clamped to 1..MAX_DAYS; ValueError when not a number."""
+    return min(max(int(value), 1), MAX_DAYS)
+
+
+def totals_query():
+    # Kwargs for DailyStats.objects.aggregate() / aaggregate()
+    return {'total_patients': Sum('new_patients'), 'pending_reports': Sum('pending_reports')}
+
+
+def window_query(today, days):
+    start = today - timezone.timedelta(days=days - 1)
+    return DailyStats.objects.filter(date__gte=start, date__lte=today)
+
+
+def payload(today, days, totals, rows):
+    window = {row.date: row for row in rows}
+    today_row = window.get(today)
+
+    # 1. Summary Stats
+    total_patients = totals['total_patients'] or 0
+    visits_today = today_row.visits if today_row else 0
+    new_registrations = today_row.new_patients if today_row else 0
+    pending_reports = totals['pending_reports'] or 0
+
+    stats = [
+        {'name': 'Total Patients', 'value': str(total_patients), 'change': '', 'changeType': 'neutral'},
+        {'name': 'Visits Today', 'value': str(visits_today), 'change': '', 'changeType': 'neutral'},
+        {'name': 'New Registrations', 'value': str(new_registrations), 'change': '', 'changeType': 'neutral'},
+        {'name': 'Pending Reports', 'value': str(pending_reports), 'changeType': 'neutral'},
+    ]
+
+    # 2. Chart Data (last `days` days, 7 by default)
+    label = '%a' if days <= 7 else '%d %b' # Mon, Tue... or 05 Jan
+    chart_data = []
+    for i in range(days - 1, -1, -1):
+        day = today - timezone.timedelta(days=i)
+        row = window.get(day)
+        chart_data.append({'name': day.strftime(label), 'date': day.isoformat(), 'visits': row.visits if row else 0})
+
+    return {
+        'stats': stats,
+        'chartData': chart_data
+    }
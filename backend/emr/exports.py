@@ -0,0 +1,127 @@
+import csv
+import datetime
+import zlib
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import models
+from django.utils import timezone
+
+from .models import Payment, Visit
+
+FORMATS = ('csv', 'ndjson')
+
+# Rows fetched per round-trip (a server-side cursor on Postgres)
+CHUNK_SIZE = 2000
+# Rows written per yielded piece of the response
+ROWS_PER_PIECE = 500
+
+# Export name -> (queryset, [(column, lookup)], date lookup, doctor lookup)
+EXPORTS = {
+    'visits': (
+        Visit.objects.order_by('date', 'id'),
+        [
+            ('id', 'id'), ('date', 'date'), ('regNo', 'patient__reg_no'), ('patientName', 'patient__name'),
+            ('doctorName', 'doctor_name'), ('status', 'status'), ('consultationFee', 'consultation_fee'),
+            ('isPaid', 'is_paid'), ('totalAmount', 'total_amount'), ('amountPaid', 'amount_paid'),
+            ('billNumber', 'bill__bill_number'), ('grandTotal', 'bill__grand_total'),
+            ('totalPaid', 'bill__total_paid'), ('balance', 'bill__balance'), ('billStatus', 'bill__status'),
+        ],
+        'date',
+        'doctor_name',
+    ),
+    'payments': (
+        Payment.objects.order_by('date', 'id'),
+        [
+            ('id', 'id'), ('date', 'date'), ('amount', 'amount'), ('mode', 'mode'),
+            ('billNumber', 'bill__bill_number'), ('visitId', 'bill__visit_id'), ('visitDate', 'bill__visit__date'),
+            ('regNo', 'bill__visit__patient__reg_no'), ('patientName', 'bill__visit__patient__name'),
+            ('doctorName', 'bill__visit__doctor_name'), ('receivedBy', 'received_by__username'),
+        ],
+        'date',
+        'bill__visit__doctor_name',
+    ),
+}
+
+
+class ExportError(Exception):
+    pass
+
+
+def day_bounds(start, end):
+    # Payment.date is a timestamp: compare against local midnight so the
+    # index on it can be used
+    tz = timezone.get_current_timezone()
+    bounds = []
+    if start:
+        bounds.append(('gte', timezone.make_aware(datetime.datetime.combine(start, datetime.time.min), tz)))
+    if end:
+        bounds.append(('lt', timezone.make_aware(datetime.datetime.combine(end + datetime.timedelta(days=1), datetime.time.min), tz)))
+    return bounds
+
+
+def export_queryset(name, start=None, end=None, doctor=None):
+    """Return (columns, values_list queryset) for export `name` with the filters applied."""
+    if name not in EXPORTS:
+        raise ExportError(f"Unknown export '{name}'")
+    queryset, columns, date_field, doctor_field = EXPORTS[name]
+    if isinstance(queryset.model._meta.get_field(date_field), models.DateTimeField):
+        for op, bound in day_bounds(start, end):
+            queryset = queryset.filter(**{f'{date_field}__{op}': bound})
+    else:
+        if start:
+            queryset = queryset.filter(**{f'{date_field}__gte': start})
+        if end:
+            queryset = queryset.filter(**{f'{date_field}__lte': end})
+    if doctor:
+        queryset = queryset.filter(**{f'{doctor_field}__iexact': doctor})
+    return [c for c, _ in columns], queryset.values_list(*[lookup for _, lookup in columns])
+
+
+class _Buffer:
+    # csv.writer target that hands back what was written
+    def write(self, value):
+        return value
+
+
+def _csv_pieces(columns, rows):
+    writer = csv.writer(_Buffer())
+    piece = [writer.writerow(columns)]
+    for row in rows:
+        piece.append(writer.writerow(row))
+        if len(piece) >= ROWS_PER_PIECE:
+            yield ''.join(piece).encode()
+            piece = []
+    if piece:
+        yield ''.join(piece).encode()
+
+
+def _ndjson_pieces(columns, rows):
+    encoder = DjangoJSONEncoder()
+    piece = []
+    for row in rows:
+        piece.append(encoder.encode(dict(zip(columns, row))))
+        piece.append('\n')
+        if len(piece) >= 2 * ROWS_PER_PIECE:
+            yield ''.join(piece).encode()
+            piece = []
+    if piece:
+        yield ''.join(piece).encode()
+
+
+def _gzip(pieces):
+    compressor = zlib.compressobj(wbits=31) # gzip container
+    for piece in pieces:
+        data = compressor.compress(piece)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def stream(name, fmt='csv', compress=False, using=None, **filters):
+    """Iterate the encoded export, holding at most one chunk of rows in memory."""
+    if fmt not in FORMATS:
+        raise ExportError(f"Unknown format '{fmt}', expected one of {', '.join(FORMATS)}")
+    columns, queryset = export_queryset(name, **filters)
+    rows = queryset.using(using).iterator(chunk_size=CHUNK_SIZE)
+    pieces = _csv_pieces(columns, rows) if fmt == 'csv' else _ndjson_pieces(columns, rows)
+    return _gzip(pieces) if compress else pieces
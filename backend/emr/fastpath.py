@@ -0,0 +1,140 @@
+from django.conf import settings
+from django.core.exceptions import FieldDoesNotExist
+from rest_framework import ISO_8601, serializers
+from rest_framework.settings import api_settings
+
+from .sparse import SparseFieldsMixin
+
+# Field types whose representation is a plain function of the column value.
+# Exact types only: subclasses may override to_representation.
+_PLAIN = {
+    serializers.CharField: str,
+    serializers.EmailField: str,
+    serializers.URLField: str,
+    serializers.SlugField: str,
+    serializers.IntegerField: int,
+}
+# Types that keep their own (cheap, stateless) to_representation
+_BOUND = (
+    serializers.DecimalField, serializers.BooleanField, serializers.ChoiceField, serializers.BigIntegerField,
+    serializers.DateField, serializers.DateTimeField, serializers.FloatField,
+)
+
+
+def _converter(field):
+    kind = type(field)
+    if kind in _PLAIN:
+        return _PLAIN[kind]
+    if kind is serializers.DateField:
+        output_format = getattr(field, 'format', api_settings.DATE_FORMAT)
+        if output_format is not None and output_format.lower() == ISO_8601:
+            return _isoformat
+    if kind in _BOUND:
+        return field.to_representation
+    if kind is serializers.PrimaryKeyRelatedField and field.pk_field is None:
+        return _identity
+    return None
+
+
+def _isoformat(value):
+    return value.isoformat()
+
+
+def _identity(value):
+    return value
+
+
+class ValuesRepresentation:
+    """
+    Renders rows fetched with QuerySet.values() into exactly what a
+    (sparse) serializer would return for the same objects, without building
+    model instances or walking serializer fields per row.
+
+    Compiled once per request from the serializer's rendered fields;
+    `compile()` returns None when a field needs the serializer (method
+    fields, files, to-many relations), and callers fall back to it.
+    """
+
+    def __init__(self, plan, lookups):
+        self.plan = plan
+        self.lookups = lookups
+
+    @classmethod
+    def compile(cls, serializer):
+        lookups = []
+        plan = cls._compile(serializer, '', lookups)
+        if plan is None:
+            return None
+        return cls(plan, list(dict.fromkeys(lookups)))
+
+    @classmethod
+    def _compile(cls, serializer, prefix, lookups):
+        # -> [(key, lookup, converter, nested plan or None)]
+        model = serializer.Meta.model
+        plan = []
+        for key, field in serializer.fields.items():
+            if field.write_only:
+                continue
+            source = field.source
+            if '.' in source or source == '*':
+                return None
+            try:
+                model_field = model._meta.get_field(source)
+            except FieldDoesNotExist:
+                return None
+
+            if isinstance(field, SparseFieldsMixin):
+                # A nested serializer over a single-valued relation: null when
+                # the related row is missing, as with the serializer
+                if model_field.many_to_many or model_field.one_to_many:
+                    return None
+                related_pk = f'{prefix}{source}__{field.Meta.model._meta.pk.name}'
+                lookups.append(related_pk)
+                nested = cls._compile(field, f'{prefix}{source}__', lookups)
+                if nested is None:
+                    return None
+                plan.append((key, related_pk, None, nested))
+                continue
+
+            if not model_field.concrete:
+                return None
+            convert = _converter(field)
+            if convert is None:
+                return None
+            lookups.append(prefix + source)
+            plan.append((key, prefix + source, convert, None))
+        return plan
+
+    def render(self, row):
+        return self._render(self.plan, row)
+
+    def _render(self, plan, row):
+        data = {}
+        for key, lookup, convert, nested in plan:
+            value = row[lookup]
+            if nested is not None:
+                data[key] = self._render(nested, row) if value is not None else None
+            else:
+                data[key] = None if value is None else convert(value)
+        return data
+
+
+class ValuesListMixin:
+    """
+    List action that pages a values() queryset and renders it with a
+    ValuesRepresentation when the requested fields allow it (the compact
+    list shapes always do), and with the serializer otherwise.
+    """
+
+    def values_list_response(self, request):
+        if not getattr(settings, 'API_VALUES_READ_PATH', True):
+            return None
+        representation = ValuesRepresentation.compile(self.get_serializer())
+        if representation is None:
+            return None
+        # The cursor position is read from every ordering field
+        ordering = [name.lstrip('-') for name in self.paginator.ordering]
+        queryset = self.filter_queryset(self.get_queryset()).prefetch_related(None)
+        rows = queryset.values(*dict.fromkeys(representation.lookups + ordering))
+        page = self.paginate_queryset(rows)
+        return self.get_paginated_response([representation.render(row) for row in page])
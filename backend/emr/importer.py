@@ -0,0 +1,255 @@
+import csv
+import itertools
+import json
+from collections import Counter
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+
+from .models import Patient, Treatment, Visit
+from .serializers import PatientImportSerializer, TreatmentSerializer, VisitImportSerializer
+from .catalog import catalog
+from . import revenue, rollups, search
+
+FORMATS = ('csv', 'ndjson')
+
+# Per-row errors kept in the report; the failed count covers the rest
+MAX_REPORTED_ERRORS = 1000
+
+
+class ImportFormatError(Exception):
+    pass
+
+
+class BadRow:
+    # Stands in for a line that could not be parsed at all
+    def __init__(self, message):
+        self.message = message
+
+
+def _text_lines(stream):
+    # Works for text files, binary files, uploaded files and the raw request,
+    # one line at a time so the input is never held in memory.
+    first = True
+    for line in stream:
+        if isinstance(line, bytes):
+            try:
+                line = line.decode('utf-8')
+            except UnicodeDecodeError:
+                raise ImportFormatError("Input is not valid UTF-8")
+        if first:
+            line = line.lstrip('\ufeff')
+            first = False
+        yield line
+
+
+def read_rows(stream, fmt='csv'):
+    """Yield one dict per CSV record or NDJSON line (BadRow for unparseable lines)."""
+    if fmt not in FORMATS:
+        raise ImportFormatError(f"Unknown format '{fmt}', expected one of {', '.join(FORMATS)}")
+    lines = _text_lines(stream)
+    if fmt == 'csv':
+        for record in csv.DictReader(lines):
+            # An empty cell means the column was not given
+            yield {key: value for key, value in record.items() if key and value not in ('', None)}
+        return
+    for line in lines:
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError as e:
+            yield BadRow(f"Invalid JSON: {e}")
+            continue
+        yield row if isinstance(row, dict) else BadRow("Expected a JSON object")
+
+
+class ImportReport:
+    def __init__(self):
+        self.created = 0
+        self.updated = 0
+        self.unchanged = 0
+        self.failed = 0
+        self.errors = []
+
+    def fail(self, row_number, errors):
+        self.failed += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append({'row': row_number, 'errors': errors})
+
+    def checkpoint(self):
+        return (self.created, self.updated, self.unchanged, self.failed, len(self.errors))
+
+    def rollback(self, checkpoint):
+        self.created, self.updated, self.unchanged, self.failed, errors = checkpoint
+        del self.errors[errors:]
+
+    def as_dict(self):
+        return {'created': self.created, 'updated': self.updated, 'unchanged': self.unchanged,
+                'failed': self.failed, 'errors': self.errors}
+
+
+class Importer:
+    """Validates and writes one kind of record a batch at a time.
+
+    `bulk_create` skips `save()` and the model signals, so each importer
+    does the work those would have done (search keys, rollups, version
+    columns) once per batch.
+    """
+    serializer_class = None
+
+    def __init__(self, report):
+        self.report = report
+
+    def validate(self, batch):
+        # -> [(row_number, validated_data)], failing the rest
+        valid = []
+        for row_number, row in batch:
+            if isinstance(row, BadRow):
+                self.report.fail(row_number, {'non_field_errors': [row.message]})
+                continue
+            serializer = self.serializer_class(data=row)
+            if serializer.is_valid():
+                valid.append((row_number, serializer.validated_data))
+            else:
+                self.report.fail(row_number, serializer.errors)
+        return valid
+
+    def run_batch(self, batch):
+        valid = self.validate(batch)
+        if not valid:
+            return
+        checkpoint = self.report.checkpoint()
+        try:
+            with transaction.atomic():
+                self.write(valid)
+        except IntegrityError:
+            # Lost a race with another writer; retry row by row to find it
+            self.report.rollback(checkpoint)
+            for row in valid:
+                try:
+                    with transaction.atomic():
+                        self.write([row])
+                except IntegrityError as e:
+                    self.report.fail(row[0], {'non_field_errors': [str(e)]})
+
+    def write(self, rows):
+        raise NotImplementedError
+
+    def finish(self):
+        pass
+
+
+class PatientImporter(Importer):
+    serializer_class = PatientImportSerializer
+
+    def write(self, rows):
+        seen = set(Patient.objects.filter(reg_no__in=[data['reg_no'] for _, data in rows])
+                   .values_list('reg_no', flat=True))
+        patients = []
+        for row_number, data in rows:
+            if data['reg_no'] in seen:
+                self.report.fail(row_number, {'regNo': ["patient with this reg no already exists."]})
+                continue
+            seen.add(data['reg_no'])
+            patient = Patient(**data)
+            patient.set_search_keys()
+            patients.append(patient)
+
+        Patient.objects.bulk_create(patients)
+        search.index_patients(patients)
+        for day, count in Counter(p.first_visit_date for p in patients).items():
+            rollups.bump(day, new_patients=count)
+        self.report.created += len(patients)
+
+
+class VisitImporter(Importer):
+    serializer_class = VisitImportSerializer
+
+    def write(self, rows):
+        reg_keys = {data['regNo'].upper() for _, data in rows if data.get('regNo')}
+        patient_ids = {data['patientId'] for _, data in rows if data.get('patientId')}
+        by_reg = dict(Patient.objects.filter(reg_no_key__in=reg_keys).values_list('reg_no_key', 'id'))
+        known = set(Patient.objects.filter(pk__in=patient_ids).values_list('id', flat=True))
+
+        visits = []
+        for row_number, data in rows:
+            data = dict(data)
+            reg_no, patient_id = data.pop('regNo', None), data.pop('patientId', None)
+            patient_id = by_reg.get(reg_no.upper()) if reg_no else (patient_id if patient_id in known else None)
+            if patient_id is None:
+                field = 'regNo' if reg_no else 'patientId'
+                self.report.fail(row_number, {field: ["No such patient."]})
+                continue
+            visits.append(Visit(patient_id=patient_id, **data))
+
+        Visit.objects.bulk_create(visits)
+        states = Counter(rollups.visit_state(v.date, v.diagnosis) for v in visits)
+        for (day, pending), count in states.items():
+            rollups.bump(day, visits=count, pending_reports=count if pending else 0)
+        Patient.objects.filter(pk__in={v.patient_id for v in visits}).update(updated_at=timezone.now())
+        revenue.refresh({v.date for v in visits})
+        self.report.created += len(visits)
+
+
+class TreatmentImporter(Importer):
+    # Upserts by title, so re-running the same file changes nothing
+    serializer_class = TreatmentSerializer
+    FIELDS = ('description', 'image', 'price')
+
+    def write(self, rows):
+        # Titles are not unique in the schema; the oldest match is the one updated
+        existing = {}
+        for treatment in Treatment.objects.filter(title__in=[data['title'] for _, data in rows]).order_by('-id'):
+            existing[treatment.title] = treatment
+        new, changed = {}, {}
+        for _, data in rows:
+            treatment = existing.get(data['title']) or new.get(data['title'])
+            if treatment is None:
+                new[data['title']] = Treatment(**data)
+                continue
+            fields = [name for name in self.FIELDS if name in data and getattr(treatment, name) != data[name]]
+            for name in fields:
+                setattr(treatment, name, data[name])
+            if fields and treatment.pk:
+                changed[treatment.pk] = treatment
+            elif treatment.pk:
+                self.report.unchanged += 1
+
+        Treatment.objects.bulk_create(new.values())
+        Treatment.objects.bulk_update(changed.values(), self.FIELDS)
+        self.report.created += len(new)
+        self.report.updated += len(changed)
+
+    def finish(self):
+        catalog.invalidate()
+        transaction.on_commit(catalog.invalidate)
+
+
+IMPORTERS = {
+    'patients': PatientImporter,
+    'visits': VisitImporter,
+    'treatments': TreatmentImporter,
+}
+
+
+def import_rows(kind, rows, batch_size=None):
+    """Import an iterable of row dicts of `kind`, `batch_size` rows per transaction."""
+    if kind not in IMPORTERS:
+        raise ImportFormatError(f"Unknown import '{kind}', expected one of {', '.join(IMPORTERS)}")
+    batch_size = batch_size or settings.IMPORT_BATCH_SIZE
+    report = ImportReport()
+    importer = IMPORTERS[kind](report)
+    numbered = enumerate(rows, 1)
+    while True:
+        batch = list(itertools.islice(numbered, batch_size))
+        if not batch:
+            break
+        importer.run_batch(batch)
+    importer.finish()
+    return report
+
+
+def import_stream(kind, stream, fmt='csv', batch_size=None):
+    return import_rows(kind, read_rows(stream, fmt), batch_size=batch_size)
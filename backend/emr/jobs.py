@@ -0,0 +1,164 @@
+import logging
+import os
+import random
+import socket
+import traceback
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.utils import timezone
+
+from .models import Job
+
+logger = logging.getLogger(__name__)
+
+# name -> function(**payload)
+registry = {}
+
+
+def task(name):
+    """Register a function as the handler for jobs called `name`."""
+    def register(func):
+        registry[name] = func
+        return func
+    return register
+
+
+def enqueue(name, payload=None, delay=0, max_attempts=5):
+    """
+    Queue a job; `payload` (JSON) is passed to the handler as keyword
+    arguments. The row is written in the caller's transaction, so a job
+    queued by a request that rolls back never runs. With JOBS_RUN_INLINE the
+    job runs in-process once the transaction commits instead.
+    """
+    if name not in registry:
+        raise KeyError(f"Unknown job {name!r}")
+    job = Job.objects.create(
+        name=name, payload=payload or {}, max_attempts=max_attempts,
+        run_at=timezone.now() + timedelta(seconds=delay),
+    )
+    if getattr(settings, 'JOBS_RUN_INLINE', False):
+        transaction.on_commit(lambda: execute(job.pk))
+    return job
+
+
+def worker_id():
+    return f'{socket.gethostname()}:{os.getpid()}'
+
+
+def claim(limit=1, worker=None):
+    """
+    Mark up to `limit` due jobs as running for this worker and return their
+    ids. Uses SELECT ... FOR UPDATE SKIP LOCKED where the database has it;
+    elsewhere (SQLite) each candidate is taken with a conditional UPDATE so
+    two workers can never both claim a job.
+    """
+    worker = worker or worker_id()
+    now = timezone.now()
+    lease = timedelta(seconds=getattr(settings, 'JOBS_LEASE_SECONDS', 600))
+    # Jobs whose worker died mid-run are offered again once the lease expires
+    Job.objects.filter(status='running', locked_at__lt=now - lease).update(status='queued', locked_by='')
+
+    due = Job.objects.filter(status='queued', run_at__lte=now).order_by('run_at', 'id')
+    if connection.features.has_select_for_update_skip_locked:
+        with transaction.atomic():
+            ids = list(due.select_for_update(skip_locked=True).values_list('id', flat=True)[:limit])
+            Job.objects.filter(pk__in=ids).update(status='running', locked_by=worker, locked_at=now)
+        return ids
+
+    ids = []
+    for pk in due.values_list('id', flat=True)[:limit * 2]:
+        if Job.objects.filter(pk=pk, status='queued').update(status='running', locked_by=worker, locked_at=now):
+            ids.append(pk)
+            if len(ids) == limit:
+                break
+    return ids
+
+
+def backoff(attempts):
+    # 10s, 20s, 40s ... capped at an hour, with jitter so retries spread out
+    base = getattr(settings, 'JOBS_RETRY_BASE_SECONDS', 10)
+    return min(base * 2 ** (attempts - 1), 3600) * random.uniform(0.8, 1.2)
+
+
+def execute(job_id):
+    """Run one claimed job and record the outcome."""
+    job = Job.objects.get(pk=job_id)
+    job.attempts += 1
+    try:
+        registry[job.name](**job.payload)
+    except Exception:
+        job.last_error = traceback.format_exc()
+        if job.attempts >= job.max_attempts:
+            job.status = 'failed'
+            job.finished_at = timezone.now()
+            logger.error("Job %s failed permanently", job, exc_info=True)
+        else:
+            job.status = 'queued'
+            job.run_at = timezone.now() + timedelta(seconds=backoff(job.attempts))
+            logger.warning("Job %s failed, retrying at %s", job, job.run_at, exc_info=True)
+    else:
+        job.status = 'done'
+        job.finished_at = timezone.now()
+        job.last_error = ''
+    job.locked_by = ''
+    job.save(update_fields=['attempts', 'status', 'run_at', 'last_error', 'locked_by', 'finished_at'])
+    return job.status
+
+
+def purge_finished(older_than=None):
+    """Delete done and failed jobs that finished before `older_than` (JOBS_KEEP_FINISHED_DAYS ago)."""
+    if older_than is None:
+        older_than = timezone.now() - timedelta(days=getattr(settings, 'JOBS_KEEP_FINISHED_DAYS', 7))
+    deleted, _ = Job.objects.filter(status__in=('done', 'failed'), finished_at__lt=older_than).delete()
+    return deleted
+
+
+def run_pending(limit=None):
+    """Claim and run due jobs in this thread until none are left (or `limit` ran)."""
+    ran = 0
+    while limit is None or ran < limit:
+        ids = claim()
+        if not ids:
+            break
+        execute(ids[0])
+        ran += 1
+    return ran
+
+
+# Built-in jobs
+
+@task('render_previews')
+def render_previews(name):
+    from .blobs import ensure_previews
+    ensure_previews(name)
+
+
+@task('rebuild_daily_stats')
+def rebuild_daily_stats(since=None):
+    from . import rollups
+    rollups.rebuild(since=since)
+
+
+@task('purge_stale_uploads')
+def purge_stale_uploads(older_than_hours=48):
+    from .uploads import purge_stale
+    purge_stale(timezone.now() - timedelta(hours=older_than_hours))
+
+
+@task('render_receipt')
+def render_receipt(bill_id):
+    from . import receipts
+    from .models import Bill
+    try:
+        bill = receipts.load_bill(bill_id)
+    except Bill.DoesNotExist:
+        return
+    receipts.get_or_render(bill)
+
+
+@task('close_revenue')
+def close_revenue():
+    from . import revenue
+    revenue.close()
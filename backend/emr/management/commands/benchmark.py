@@ -0,0 +1,70 @@
+import json
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from emr import benchmark
+
+
+class Command(BaseCommand):
+    help = (
+        "Load test the main API endpoints on a running server and save the results as JSON. "
+        "add_payment writes to the database, so point it at a seeded copy, not production data."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--url', default='http://127.0.0.1:8000', help="Server to benchmark")
+        parser.add_argument('--user', default='loadtest@example.com', help="Login email (see seed_synthetic)")
+        parser.add_argument('--password', default='loadtest')
+        parser.add_argument('--scenario', action='append', choices=benchmark.SCENARIOS, dest='scenarios',
+                            help="Run only this scenario (repeatable); all by default")
+        parser.add_argument('--requests', type=int, default=200, help="Requests per scenario")
+        parser.add_argument('--concurrency', type=int, default=8, help="Concurrent clients")
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--output', default=None,
+                            help="Results file, benchmarks/<timestamp>.json under the project by default")
+        parser.add_argument('--compare', default=None, help="Earlier results file to check for regressions")
+        parser.add_argument('--tolerance', type=float, default=0.1,
+                            help="Allowed slowdown against --compare before failing, as a fraction")
+
+    def handle(self, *args, **options):
+        if options['requests'] < 1 or options['concurrency'] < 1:
+            raise CommandError("--requests and --concurrency must be positive")
+        baseline = None
+        if options['compare']:
+            try:
+                baseline = json.loads(Path(options['compare']).read_text())
+            except (OSError, ValueError) as e:
+                raise CommandError(f"Cannot read {options['compare']}: {e}")
+
+        runner = benchmark.Benchmark(
+            options['url'], options['user'], options['password'],
+            concurrency=options['concurrency'], requests=options['requests'], seed=options['seed'],
+        )
+        try:
+            results = runner.run(options['scenarios'] or benchmark.SCENARIOS)
+        except (OSError, benchmark.BenchmarkError) as e:
+            raise CommandError(str(e))
+
+        self.stdout.write(f"{'scenario':<12} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'queries':>8} {'errors':>7}")
+        for name, row in results['scenarios'].items():
+            self.stdout.write(
+                f"{name:<12} {row['throughput']:>8} {row['p50Ms']:>8} {row['p95Ms']:>8} {row['p99Ms']:>8} "
+                f"{row['meanQueries'] if row['meanQueries'] is not None else '-':>8} {row['errors']:>7}"
+            )
+
+        output = Path(options['output'] or Path(settings.BASE_DIR) / 'benchmarks' /
+                      f"{timezone.now().strftime('%Y%m%d-%H%M%S')}.json")
+        output.parent.mkdir(parents=True, exist_ok=True)
+        output.write_text(json.dumps(results, indent=2))
+        self.stdout.write(self.style.SUCCESS(f"Saved results to {output}"))
+
+        if baseline is not None:
+            regressions = benchmark.compare(baseline, results, options['tolerance'])
+            for scenario, metric, before, after in regressions:
+                self.stderr.write(f"{scenario} {metric}: {before} -> {after}")
+            if regressions:
+                raise CommandError(f"{len(regressions)} metrics regressed against {options['compare']}")
+            self.stdout.write(self.style.SUCCESS(f"No regressions against {options['compare']}"))
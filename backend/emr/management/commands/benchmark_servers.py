@@ -0,0 +1,66 @@
+import json
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from emr import benchmark
+
+READ_SCENARIOS = [name for pair in benchmark.ASYNC_PAIRS for name in pair]
+
+
+class Command(BaseCommand):
+    help = (
+        "Start the project under a WSGI server and under an ASGI server (uvicorn) in turn, "
+        "run the same read scenarios against each and compare requests per second."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', default='loadtest@example.com', help="Login email (see seed_synthetic)")
+        parser.add_argument('--password', default='loadtest')
+        parser.add_argument('--scenario', action='append', choices=benchmark.SCENARIOS, dest='scenarios',
+                            help="Run only this scenario (repeatable); the sync/async read pairs by default")
+        parser.add_argument('--requests', type=int, default=500, help="Requests per scenario")
+        parser.add_argument('--concurrency', type=int, default=16, help="Concurrent clients")
+        parser.add_argument('--threads', type=int, default=8, help="Worker threads of the WSGI server")
+        parser.add_argument('--wsgi-port', type=int, default=8101)
+        parser.add_argument('--asgi-port', type=int, default=8102)
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--output', default=None,
+                            help="Results file, benchmarks/servers-<timestamp>.json under the project by default")
+
+    def handle(self, *args, **options):
+        if options['requests'] < 1 or options['concurrency'] < 1:
+            raise CommandError("--requests and --concurrency must be positive")
+        scenarios = options['scenarios'] or READ_SCENARIOS
+
+        results = {}
+        for kind, port in (('wsgi', options['wsgi_port']), ('asgi', options['asgi_port'])):
+            server = benchmark.Server(kind, port, threads=options['threads'], cwd=settings.BASE_DIR)
+            runner = benchmark.Benchmark(
+                server.url, options['user'], options['password'],
+                concurrency=options['concurrency'], requests=options['requests'], seed=options['seed'],
+            )
+            self.stdout.write(f"Benchmarking the {kind} server on {server.url}")
+            try:
+                with server:
+                    results[kind] = dict(runner.run(scenarios), command=server.command())
+            except (OSError, benchmark.BenchmarkError) as e:
+                raise CommandError(str(e))
+
+        self.stdout.write(f"{'scenario':<22} {'wsgi req/s':>10} {'asgi req/s':>10} {'ratio':>6} "
+                          f"{'wsgi p95':>9} {'asgi p95':>9} {'errors':>7}")
+        for name in scenarios:
+            wsgi, asgi = results['wsgi']['scenarios'][name], results['asgi']['scenarios'][name]
+            ratio = f"{asgi['throughput'] / wsgi['throughput']:.2f}" if wsgi['throughput'] else '-'
+            self.stdout.write(
+                f"{name:<22} {wsgi['throughput']:>10} {asgi['throughput']:>10} {ratio:>6} "
+                f"{wsgi['p95Ms']:>9} {asgi['p95Ms']:>9} {wsgi['errors'] + asgi['errors']:>7}"
+            )
+
+        output = Path(options['output'] or Path(settings.BASE_DIR) / 'benchmarks' /
+                      f"servers-{timezone.now().strftime('%Y%m%d-%H%M%S')}.json")
+        output.parent.mkdir(parents=True, exist_ok=True)
+        output.write_text(json.dumps(results, indent=2))
+        self.stdout.write(self.style.SUCCESS(f"Saved results to {output}"))
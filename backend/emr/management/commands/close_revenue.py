@@ -0,0 +1,24 @@
+import datetime
+
+from django.core.management.base import BaseCommand
+
+from emr import revenue
+
+
+class Command(BaseCommand):
+    help = "Roll up revenue for closed days (everything before today by default)"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--through', type=datetime.date.fromisoformat, default=None,
+            help="Last day to close (YYYY-MM-DD), yesterday by default",
+        )
+        parser.add_argument('--rebuild', action='store_true', help="Drop the existing rollup and recompute all history")
+
+    def handle(self, *args, **options):
+        if options['rebuild']:
+            revenue.reopen()
+        rows = revenue.close(through=options['through'])
+        self.stdout.write(self.style.SUCCESS(
+            f"Wrote {rows} rollup rows, closed through {revenue.closed_through()}"
+        ))
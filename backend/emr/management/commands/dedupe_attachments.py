@@ -0,0 +1,38 @@
+from django.core.management.base import BaseCommand
+
+from emr import blobs
+from emr.models import Patient, VisitAttachment
+from emr.storage import content_store, is_content_name
+
+
+class Command(BaseCommand):
+    help = "Move legacy attachments and registration documents into the content-addressed store"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--delete-originals', action='store_true', help="Remove the old files once moved")
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        moved = 0
+        sources = [
+            (VisitAttachment.objects.exclude(file__startswith='cas/'), 'file'),
+            (Patient.objects.exclude(registration_document='').exclude(registration_document__isnull=True)
+                .exclude(registration_document__startswith='cas/'), 'registration_document'),
+        ]
+        for queryset, field in sources:
+            for obj in queryset.iterator(chunk_size=options['batch_size']):
+                old = getattr(obj, field)
+                if is_content_name(old.name):
+                    continue
+                if not content_store.exists(old.name):
+                    self.stderr.write(f"Missing file {old.name} ({obj._meta.model_name} {obj.pk})")
+                    continue
+                with content_store.open(old.name, 'rb') as f:
+                    new_name = content_store.save(old.name, f)
+                # update() so the save signals do not count the reference twice
+                type(obj).objects.filter(pk=obj.pk).update(**{field: new_name})
+                blobs.attached([new_name])
+                if options['delete_originals']:
+                    content_store.delete(old.name)
+                moved += 1
+        self.stdout.write(self.style.SUCCESS(f"Moved {moved} files"))
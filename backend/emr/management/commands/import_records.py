@@ -0,0 +1,37 @@
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from emr import importer
+
+
+class Command(BaseCommand):
+    help = "Bulk import patients, visits or treatments from a CSV or NDJSON file"
+
+    def add_arguments(self, parser):
+        parser.add_argument('kind', choices=list(importer.IMPORTERS))
+        parser.add_argument('path', help="File to import, or - for stdin")
+        parser.add_argument('--format', choices=importer.FORMATS, default=None,
+                            help="Defaults to ndjson for .ndjson/.jsonl files, csv otherwise")
+        parser.add_argument('--batch-size', type=int, default=None, help="Rows per transaction")
+
+    def handle(self, *args, **options):
+        path = options['path']
+        fmt = options['format'] or ('ndjson' if path.endswith(('.ndjson', '.jsonl')) else 'csv')
+        try:
+            if path == '-':
+                report = importer.import_stream(options['kind'], sys.stdin.buffer, fmt, options['batch_size'])
+            else:
+                with open(path, 'rb') as f:
+                    report = importer.import_stream(options['kind'], f, fmt, options['batch_size'])
+        except (OSError, importer.ImportFormatError) as e:
+            raise CommandError(str(e))
+
+        for error in report.errors:
+            messages = '; '.join(f"{field}: {' '.join(map(str, problems))}" for field, problems in error['errors'].items())
+            self.stderr.write(f"Row {error['row']}: {messages}")
+        if report.failed > len(report.errors):
+            self.stderr.write(f"... and {report.failed - len(report.errors)} more")
+        self.stdout.write(self.style.SUCCESS(
+            f"Created {report.created}, updated {report.updated}, unchanged {report.unchanged}, failed {report.failed}"
+        ))
@@ -0,0 +1,19 @@
+import datetime
+
+from django.core.management.base import BaseCommand
+
+from emr import rollups
+
+
+class Command(BaseCommand):
+    help = "Recompute the DailyStats dashboard rollup from visits and patients"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--since', type=datetime.date.fromisoformat, default=None,
+            help="Only rebuild days on or after this date (YYYY-MM-DD)",
+        )
+
+    def handle(self, *args, **options):
+        days = rollups.rebuild(since=options['since'])
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt {days} days of stats"))
@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+
+from emr.models import Patient
+from emr import search
+
+
+class Command(BaseCommand):
+    help = "Rebuild the patient name search index from the patient table"
+
+    def handle(self, *args, **options):
+        search.rebuild_index()
+        self.stdout.write(self.style.SUCCESS(f"Indexed {Patient.objects.count()} patients"))
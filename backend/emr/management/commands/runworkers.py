@@ -0,0 +1,63 @@
+import signal
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from emr import jobs
+
+# Seconds between deletions of old finished jobs
+PURGE_INTERVAL = 3600
+
+
+def _run_job(job_id):
+    try:
+        return jobs.execute(job_id)
+    finally:
+        connections.close_all()
+
+
+class Command(BaseCommand):
+    help = "Run queued background jobs (emr.Job) with a pool of worker threads or processes"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=4)
+        parser.add_argument('--mode', choices=['thread', 'process'], default='thread')
+        parser.add_argument('--poll', type=float, default=1.0, help="Seconds to sleep when the queue is empty")
+        parser.add_argument('--once', action='store_true', help="Exit once no jobs are due")
+
+    def handle(self, *args, **options):
+        workers = max(options['workers'], 1)
+        stopping = threading.Event()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            signal.signal(sig, lambda *_: stopping.set())
+
+        # Forked processes must not share the parent's DB connections
+        connections.close_all()
+        pool_class = ProcessPoolExecutor if options['mode'] == 'process' else ThreadPoolExecutor
+        worker = jobs.worker_id()
+        running = set()
+        purged_at = None
+        self.stdout.write(f"Running jobs with {workers} {options['mode']} workers as {worker}")
+
+        with pool_class(max_workers=workers) as pool:
+            while not stopping.is_set():
+                if purged_at is None or time.monotonic() - purged_at >= PURGE_INTERVAL:
+                    purged = jobs.purge_finished()
+                    purged_at = time.monotonic()
+                    if purged:
+                        self.stdout.write(f"Deleted {purged} finished jobs")
+                running = {f for f in running if not f.done()}
+                free = workers - len(running)
+                ids = jobs.claim(limit=free, worker=worker) if free else []
+                for job_id in ids:
+                    running.add(pool.submit(_run_job, job_id))
+                if not ids:
+                    if options['once'] and not running:
+                        break
+                    stopping.wait(options['poll'])
+            # Leaving the with-block waits for in-flight jobs to finish
+        connections.close_all()
+        self.stdout.write("Workers stopped")
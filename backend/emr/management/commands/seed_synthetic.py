@@ -0,0 +1,43 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from emr.models import User
+from emr import synthetic
+
+
+class Command(BaseCommand):
+    help = "Fill the database with synthetic patients, visits, treatments, bills and payments for load testing"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--patients', type=int, default=1000)
+        parser.add_argument('--visits', type=int, default=5000, help="Total visits, at least one per patient")
+        parser.add_argument('--days', type=int, default=730, help="Spread visits over this many days up to today")
+        parser.add_argument('--seed', type=int, default=0, help="Random seed; the same seed gives the same data")
+        parser.add_argument('--batch-size', type=int, default=1000, help="Patients written per transaction")
+        parser.add_argument('--user', default='loadtest@example.com',
+                            help="Create this reception login (if missing) for the benchmark to use")
+        parser.add_argument('--password', default='loadtest')
+
+    def handle(self, *args, **options):
+        if options['patients'] < 1 or options['days'] < 1 or options['batch_size'] < 1:
+            raise CommandError("--patients, --days and --batch-size must be positive")
+
+        if options['user'] and not User.objects.filter(email=options['user']).exists():
+            User.objects.create_user(
+                username=options['user'].split('@')[0], email=options['user'],
+                password=options['password'], role='reception',
+            )
+
+        started = time.perf_counter()
+
+        def progress(counts):
+            elapsed = time.perf_counter() - started
+            self.stdout.write(f"{counts['patients']} patients, {counts['visits']} visits ({elapsed:.0f}s)")
+
+        counts = synthetic.seed(
+            patients=options['patients'], visits=options['visits'], days=options['days'],
+            seed=options['seed'], batch_size=options['batch_size'], progress=progress,
+        )
+        summary = ', '.join(f"{count} {name}" for name, count in counts.items())
+        self.stdout.write(self.style.SUCCESS(f"Created {summary} in {time.perf_counter() - started:.1f}s"))
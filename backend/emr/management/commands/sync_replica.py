@@ -0,0 +1,23 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, connections
+
+
+class Command(BaseCommand):
+    help = (
+        "Copy the primary SQLite database onto the SQLite read replica (DB_REPLICA_NAME). "
+        "A local stand-in for replication; Postgres replicas are fed by streaming replication."
+    )
+
+    def handle(self, *args, **options):
+        alias = getattr(settings, 'REPLICA_DATABASE', None)
+        if not alias:
+            raise CommandError("No read replica is configured (set DB_REPLICA_NAME)")
+        primary, replica = connections[DEFAULT_DB_ALIAS], connections[alias]
+        if primary.vendor != 'sqlite' or replica.vendor != 'sqlite':
+            raise CommandError("sync_replica only copies SQLite databases")
+        primary.ensure_connection()
+        replica.ensure_connection()
+        # The online backup API copies a consistent snapshot while the primary stays writable
+        primary.connection.backup(replica.connection)
+        self.stdout.write(self.style.SUCCESS(f"Copied {primary.settings_dict['NAME']} to {replica.settings_dict['NAME']}"))
@@ -0,0 +1,60 @@
+# Generated by Django 6.0 on 2026-01-12 10:41
+
+import re
+
+from django.db import migrations, models
+
+
+def backfill_search_keys(apps, schema_editor):
+    Patient = apps.get_model('emr', 'Patient')
+    patients = list(Patient.objects.only('id', 'mobile', 'reg_no'))
+    for p in patients:
+        p.mobile_digits = re.sub(r'\D', '', p.mobile or '')[-10:]
+        p.reg_no_key = (p.reg_no or '').upper()
+    Patient.objects.bulk_update(patients, ['mobile_digits', 'reg_no_key'], batch_size=1000)
+
+
+def create_name_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'sqlite':
+        schema_editor.execute(
+            "CREATE VIRTUAL TABLE IF NOT EXISTS emr_patient_fts USING fts5("
+            "name, tokenize='unicode61 remove_diacritics 2', prefix='2 3')"
+        )
+        schema_editor.execute("INSERT INTO emr_patient_fts(rowid, name) SELECT id, name FROM emr_patient")
+    elif vendor == 'postgresql':
+        schema_editor.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+        schema_editor.execute(
+            'CREATE INDEX IF NOT EXISTS emr_patient_name_trgm '
+            'ON emr_patient USING gin ((UPPER("name"::text)) gin_trgm_ops)'
+        )
+
+
+def drop_name_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'sqlite':
+        schema_editor.execute("DROP TABLE IF EXISTS emr_patient_fts")
+    elif vendor == 'postgresql':
+        schema_editor.execute("DROP INDEX IF EXISTS emr_patient_name_trgm")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('emr', '0005_bill_payment'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='patient',
+            name='mobile_digits',
+            field=models.CharField(blank=True, db_index=True, editable=False, max_length=15),
+        ),
+        migrations.AddField(
+            model_name='patient',
+            name='reg_no_key',
+            field=models.CharField(blank=True, db_index=True, editable=False, max_length=50),
+        ),
+        migrations.RunPython(backfill_search_keys, migrations.RunPython.noop),
+        migrations.RunPython(create_name_index, drop_name_index),
+    ]
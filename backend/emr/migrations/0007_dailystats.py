@@ -0,0 +1,42 @@
+# Generated by Django 6.0 on 2026-01-14 18:02
+
+from django.db import migrations, models
+from django.db.models import Count, Q
+
+
+def backfill(apps, schema_editor):
+    DailyStats = apps.get_model('emr', 'DailyStats')
+    Visit = apps.get_model('emr', 'Visit')
+    Patient = apps.get_model('emr', 'Patient')
+
+    rows = {}
+    per_day = Visit.objects.values('date').annotate(
+        visit_count=Count('id'), pending=Count('id', filter=Q(diagnosis=''))
+    ).order_by()
+    for row in per_day:
+        rows[row['date']] = DailyStats(date=row['date'], visits=row['visit_count'], pending_reports=row['pending'])
+    for row in Patient.objects.values('first_visit_date').annotate(n=Count('id')).order_by():
+        stats = rows.setdefault(row['first_visit_date'], DailyStats(date=row['first_visit_date']))
+        stats.new_patients = row['n']
+    DailyStats.objects.bulk_create(rows.values(), batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('emr', '0006_patient_search_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailyStats',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField(unique=True)),
+                ('visits', models.IntegerField(default=0)),
+                ('new_patients', models.IntegerField(default=0)),
+                ('pending_reports', models.IntegerField(default=0)),
+            ],
+        ),
+        migrations.RunPython(backfill, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,35 @@
+# Generated by Django 6.0 on 2026-01-16 11:27
+
+from django.db import migrations, models
+
+
+def seed_sequences(apps, schema_editor):
+    # Continue numbering after the highest existing BILL-<year>-<n> per year
+    Bill = apps.get_model('emr', 'Bill')
+    BillSequence = apps.get_model('emr', 'BillSequence')
+    last = {}
+    for number in Bill.objects.values_list('bill_number', flat=True).iterator():
+        parts = (number or '').split('-')
+        if len(parts) == 3 and parts[1].isdigit() and parts[2].isdigit():
+            year, value = int(parts[1]), int(parts[2])
+            last[year] = max(last.get(year, 0), value)
+    BillSequence.objects.bulk_create([BillSequence(year=y, last_value=v) for y, v in last.items()])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('emr', '0007_dailystats'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BillSequence',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('year', models.PositiveIntegerField(unique=True)),
+                ('last_value', models.PositiveIntegerField(default=0)),
+            ],
+        ),
+        migrations.RunPython(seed_sequences, migrations.RunPython.noop),
+    ]
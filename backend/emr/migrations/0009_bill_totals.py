@@ -0,0 +1,35 @@
+# Generated by Django 6.0 on 2026-01-19 09:12
+
+from django.db import migrations, models
+from django.db.models import DecimalField, F, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+
+
+def backfill_totals(apps, schema_editor):
+    Bill = apps.get_model('emr', 'Bill')
+    Payment = apps.get_model('emr', 'Payment')
+    paid = Payment.objects.filter(bill=OuterRef('pk')).values('bill').annotate(total=Sum('amount')).values('total')
+    money = DecimalField(max_digits=10, decimal_places=2)
+    Bill.objects.update(total_paid=Coalesce(Subquery(paid, output_field=money), Value(0, output_field=money)))
+    Bill.objects.update(balance=F('grand_total') - F('total_paid'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('emr', '0008_billsequence'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='bill',
+            name='balance',
+            field=models.DecimalField(decimal_places=2, default=0.0, max_digits=10),
+        ),
+        migrations.AddField(
+            model_name='bill',
+            name='total_paid',
+            field=models.DecimalField(decimal_places=2, default=0.0, max_digits=10),
+        ),
+        migrations.RunPython(backfill_totals, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 6.0 on 2026-01-27 17:30
+
+import emr.storage
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('emr', '0011_attachmentupload'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StoredFile',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=255, unique=True)),
+                ('size', models.PositiveBigIntegerField(default=0)),
+                ('ref_count', models.IntegerField(default=0)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.AlterField(
+            model_name='patient',
+            name='registration_document',
+            field=models.FileField(blank=True, null=True, storage=emr.storage.ContentAddressedStorage(), upload_to='patient_docs/'),
+        ),
+        migrations.AlterField(
+            model_name='visitattachment',
+            name='file',
+            field=models.FileField(storage=emr.storage.ContentAddressedStorage(), upload_to='visit_attachments/'),
+        ),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 6.0 on 2026-02-09 11:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('emr', '0013_job'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='payment',
+            name='date',
+            field=models.DateTimeField(auto_now_add=True, db_index=True),
+        ),
+        migrations.AddIndex(
+            model_name='visit',
+            index=models.Index(fields=['date', 'id'], name='emr_visit_date_2989c0_idx'),
+        ),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 6.0 on 2026-02-16 09:37
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('emr', '0014_export_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RevenueWatermark',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('closed_through', models.DateField()),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='RevenueRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('doctor_name', models.CharField(max_length=255)),
+                ('metric', models.CharField(choices=[('consultation', 'Consultation fees'), ('treatment', 'Treatment charges'), ('collection', 'Collections')], max_length=20)),
+                ('key', models.CharField(blank=True, max_length=50)),
+                ('amount', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('count', models.IntegerField(default=0)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('date', 'doctor_name', 'metric', 'key'), name='emr_revenue_rollup_unique')],
+            },
+        ),
+    ]
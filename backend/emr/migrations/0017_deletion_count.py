@@ -0,0 +1,21 @@
+# Generated by Django 6.0 on 2026-10-17 03:47
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('emr', '0016_user_token_version'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DeletionCount',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('model', models.CharField(max_length=100, unique=True)),
+                ('count', models.PositiveBigIntegerField(default=0)),
+            ],
+        ),
+    ]
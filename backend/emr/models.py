@@ -1,5 +1,18 @@
+import re
+import uuid
+from decimal import Decimal
+
 from django.db import models
 from django.contrib.auth.models import AbstractUser
+from django.utils import timezone
+
+from .storage import content_store
+
+
+def normalize_mobile(value):
+    # Digits only, keeping the last 10 so "+91 98480-12345" and "9848012345" match
+    digits = re.sub(r'\D', '', value or '')
+    return digits[-10:]
 
 class User(AbstractUser):
     ROLE_CHOICES = (
@@ -11,9 +24,19 @@ class User(AbstractUser):
     role = models.CharField(max_length=20, choices=ROLE_CHOICES, default='doctor')
     avatar = models.URLField(blank=True, null=True)
 
+    # Bumped by change_password(). Access tokens carry the version they were
+    # issued with, so older ones are refused (see emr/authentication.py).
+    token_version = models.PositiveIntegerField(default=0)
+
     USERNAME_FIELD = 'email'
     REQUIRED_FIELDS = ['username']
 
+    def change_password(self, raw_password):
+        # Not set_password(), which check_password() also calls when it
+        # upgrades the stored hash at login
+        self.set_password(raw_password)
+        self.token_version += 1
+
 class Patient(models.Model):
     SEX_CHOICES = (
         ('Male', 'Male'),
@@ -31,7 +54,26 @@ class Patient(models.Model):
     blood_group = models.CharField(max_length=5, blank=True, null=True)
     
     # New Field for Initial Registration Documents (Aadhar, Insurance, etc.)
-    registration_document = models.FileField(upload_to='patient_docs/', blank=True, null=True)
+    registration_document = models.FileField(upload_to='patient_docs/', storage=content_store, blank=True, null=True)
+
+    # Normalized search keys (see emr/search.py), derived on save
+    mobile_digits = models.CharField(max_length=15, blank=True, db_index=True, editable=False)
+    reg_no_key = models.CharField(max_length=50, blank=True, db_index=True, editable=False)
+
+    # Version column for conditional GETs; also bumped when any of the
+    # patient's visits (or their children) change, see emr/signals.py
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
+
+    def set_search_keys(self):
+        self.mobile_digits = normalize_mobile(self.mobile)
+        self.reg_no_key = (self.reg_no or '').upper()
+
+    def save(self, *args, **kwargs):
+        self.set_search_keys()
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None:
+            kwargs['update_fields'] = set(update_fields) | {'mobile_digits', 'reg_no_key'}
+        super().save(*args, **kwargs)
 
     def __str__(self):
         return f"{self.name} ({self.reg_no})"
@@ -77,15 +119,53 @@ class Visit(models.Model):
     amount_paid = models.DecimalField(max_digits=10, decimal_places=2, default=0.00) # Total collected
     
     created_at = models.DateTimeField(auto_now_add=True)
+    # Bumped by treatment, attachment, bill and payment writes too
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
+
+    class Meta:
+        # Date-ordered scans: visit lists, exports and reports
+        indexes = [models.Index(fields=['date', 'id'])]
 
     def __str__(self):
         return f"Visit for {self.patient.name} on {self.date} ({self.status})"
 
 class VisitAttachment(models.Model):
     visit = models.ForeignKey(Visit, on_delete=models.CASCADE, related_name='attachment_files')
-    file = models.FileField(upload_to='visit_attachments/')
+    file = models.FileField(upload_to='visit_attachments/', storage=content_store)
     uploaded_at = models.DateTimeField(auto_now_add=True)
 
+class StoredFile(models.Model):
+    # Reference count for a content-addressed file (emr/storage.py). When it
+    # drops to zero the file and its derived previews are deleted.
+    name = models.CharField(max_length=255, unique=True)
+    size = models.PositiveBigIntegerField(default=0)
+    ref_count = models.IntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.name} x{self.ref_count}"
+
+class AttachmentUpload(models.Model):
+    # A resumable upload in progress (see emr/uploads.py). Bytes are appended
+    # to a partial file until `offset` reaches `size`, then it becomes a
+    # VisitAttachment.
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    visit = models.ForeignKey(Visit, on_delete=models.CASCADE, related_name='uploads')
+    filename = models.CharField(max_length=255)
+    size = models.PositiveBigIntegerField()
+    offset = models.PositiveBigIntegerField(default=0) # Bytes received so far
+    sha256 = models.CharField(max_length=64, blank=True)
+    attachment = models.OneToOneField(VisitAttachment, on_delete=models.SET_NULL, null=True, blank=True)
+    created_by = models.ForeignKey('User', on_delete=models.SET_NULL, null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    @property
+    def is_complete(self):
+        return self.attachment_id is not None
+
+    def __str__(self):
+        return f"{self.filename} ({self.offset}/{self.size})"
+
 class VisitTreatment(models.Model):
     visit = models.ForeignKey(Visit, on_delete=models.CASCADE, related_name='treatments')
     treatment = models.ForeignKey(Treatment, on_delete=models.CASCADE)
@@ -107,19 +187,42 @@ class Bill(models.Model):
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='unpaid')
     created_at = models.DateTimeField(auto_now_add=True)
 
+    # Denormalized payment totals, maintained by emr/billing.py
+    total_paid = models.DecimalField(max_digits=10, decimal_places=2, default=0.00)
+    balance = models.DecimalField(max_digits=10, decimal_places=2, default=0.00)
+    updated_at = models.DateTimeField(auto_now=True) # Bumped by payment writes too
+
     def save(self, *args, **kwargs):
         if not self.bill_number:
-            # Simple auto-increment-like logic or timestamp based
-            import datetime
-            now = datetime.datetime.now()
-            # This is not concurrency safe but simple for now
-            count = Bill.objects.filter(created_at__year=now.year).count() + 1
-            self.bill_number = f"BILL-{now.year}-{count:04d}"
+            from .sequences import next_bill_number
+            self.bill_number = next_bill_number()
+        if self._state.adding:
+            self.balance = Decimal(self.grand_total) - Decimal(self.total_paid)
         super().save(*args, **kwargs)
 
     def __str__(self):
         return f"{self.bill_number} - {self.status}"
 
+class BillSequence(models.Model):
+    # Last bill number handed out for a year. Bill numbers are allocated by
+    # incrementing this row atomically (see emr/sequences.py) instead of
+    # counting the year's bills.
+    year = models.PositiveIntegerField(unique=True)
+    last_value = models.PositiveIntegerField(default=0)
+
+    def __str__(self):
+        return f"{self.year}: {self.last_value}"
+
+class DeletionCount(models.Model):
+    # Rows deleted so far from a table, by model label. A list's version is
+    # its newest updated_at plus this count (see emr/conditional.py), which
+    # catches deletes without counting the table's rows.
+    model = models.CharField(max_length=100, unique=True)
+    count = models.PositiveBigIntegerField(default=0)
+
+    def __str__(self):
+        return f"{self.model}: {self.count}"
+
 class Payment(models.Model):
     MODE_CHOICES = (
         ('cash', 'Cash'),
@@ -129,9 +232,80 @@ class Payment(models.Model):
     )
     bill = models.ForeignKey(Bill, on_delete=models.CASCADE, related_name='payments')
     amount = models.DecimalField(max_digits=10, decimal_places=2)
-    date = models.DateTimeField(auto_now_add=True)
+    date = models.DateTimeField(auto_now_add=True, db_index=True)
     mode = models.CharField(max_length=20, choices=MODE_CHOICES, default='cash')
     received_by = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True)
 
     def __str__(self):
         return f"{self.amount} via {self.mode}"
+
+class DailyStats(models.Model):
+    # Per-day rollup behind the dashboard, maintained incrementally by the
+    # signal handlers in emr/signals.py. `manage.py rebuild_daily_stats`
+    # recomputes it from scratch.
+    date = models.DateField(unique=True)
+    visits = models.IntegerField(default=0)
+    new_patients = models.IntegerField(default=0) # By Patient.first_visit_date
+    pending_reports = models.IntegerField(default=0) # Visits on this date without a diagnosis
+
+    def __str__(self):
+        return f"{self.date}: {self.visits} visits"
+
+class RevenueRollup(models.Model):
+    # Per-day revenue totals for closed days (see emr/revenue.py). Days up to
+    # RevenueWatermark.closed_through are served from here, later days are
+    # aggregated live from the visit, treatment and payment tables.
+    METRIC_CHOICES = (
+        ('consultation', 'Consultation fees'),
+        ('treatment', 'Treatment charges'),
+        ('collection', 'Collections'),
+    )
+    date = models.DateField()
+    doctor_name = models.CharField(max_length=255)
+    metric = models.CharField(max_length=20, choices=METRIC_CHOICES)
+    key = models.CharField(max_length=50, blank=True) # Treatment id or payment mode
+    amount = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    count = models.IntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['date', 'doctor_name', 'metric', 'key'], name='emr_revenue_rollup_unique'),
+        ]
+
+    def __str__(self):
+        return f"{self.date} {self.metric} {self.key}: {self.amount}"
+
+class RevenueWatermark(models.Model):
+    # Single row: the last day rolled up into RevenueRollup
+    closed_through = models.DateField()
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"Closed through {self.closed_through}"
+
+class Job(models.Model):
+    # Background work queued in the database and run by `manage.py runworkers`
+    # (see emr/jobs.py).
+    STATUS_CHOICES = (
+        ('queued', 'Queued'),
+        ('running', 'Running'),
+        ('done', 'Done'),
+        ('failed', 'Failed'),
+    )
+    name = models.CharField(max_length=100)
+    payload = models.JSONField(default=dict, blank=True)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='queued')
+    attempts = models.PositiveIntegerField(default=0)
+    max_attempts = models.PositiveIntegerField(default=5)
+    run_at = models.DateTimeField(default=timezone.now) # Not picked up before this
+    locked_by = models.CharField(max_length=100, blank=True)
+    locked_at = models.DateTimeField(null=True, blank=True)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [models.Index(fields=['status', 'run_at'])]
+
+    def __str__(self):
+        return f"{self.name} #{self.pk} ({self.status})"
@@ -0,0 +1,110 @@
+import json
+
+from django.conf import settings
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import Cursor, CursorPagination
+
+
+def _flip(name):
+    return name[1:] if name.startswith('-') else '-' + name
+
+
+class KeysetPagination(CursorPagination):
+    # Opaque, base64 encoded cursors over a stable ordering. Unlike offset
+    # pagination the database never has to count or skip rows, so the cost of
+    # a page does not grow with the size of the table.
+    #
+    # DRF's CursorPagination positions the cursor on the first ordering field
+    # only and steps over rows sharing that value with OFFSET (refusing past
+    # offset_cutoff). Here the position holds every ordering field, and the
+    # ordering must end in a unique one, so the next page is always a plain
+    # "(a, b) after (x, y)" range read with no offset.
+    page_size = settings.API_PAGE_SIZE
+    page_size_query_param = 'pageSize'
+    max_page_size = 200
+    cursor_query_param = 'cursor'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        if not self.page_size:
+            return None
+
+        self.base_url = request.build_absolute_uri()
+        self.ordering = self.get_ordering(request, queryset, view)
+        self.cursor = self.decode_cursor(request)
+        reverse = self.cursor.reverse if self.cursor else False
+        position = self.cursor.position if self.cursor else None
+
+        # Previous pages are read backwards from the cursor and flipped
+        ordering = [_flip(name) for name in self.ordering] if reverse else list(self.ordering)
+        queryset = queryset.order_by(*ordering)
+        if position is not None:
+            queryset = queryset.filter(self._after(ordering, self._values(position)))
+
+        # One extra row tells whether a following page exists
+        results = list(queryset[:self.page_size + 1])
+        self.page = results[:self.page_size]
+        following = self._get_position_from_instance(self.page[-1], self.ordering) \
+            if len(results) > self.page_size else None
+
+        if reverse:
+            self.page.reverse()
+            self.has_next, self.next_position = position is not None, position
+            self.has_previous, self.previous_position = following is not None, following
+        else:
+            self.has_next, self.next_position = following is not None, following
+            self.has_previous, self.previous_position = position is not None, position
+        if (self.has_previous or self.has_next) and self.template is not None:
+            self.display_page_controls = True
+        return self.page
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        position = self._get_position_from_instance(self.page[-1], self.ordering) if self.page else self.next_position
+        return self.encode_cursor(Cursor(offset=0, reverse=False, position=position))
+
+    def get_previous_link(self):
+        if not self.has_previous:
+            return None
+        position = self._get_position_from_instance(self.page[0], self.ordering) if self.page else self.previous_position
+        return self.encode_cursor(Cursor(offset=0, reverse=True, position=position))
+
+    def _values(self, position):
+        try:
+            values = json.loads(position)
+        except ValueError:
+            values = None
+        if not isinstance(values, list) or len(values) != len(self.ordering):
+            raise NotFound(self.invalid_cursor_message)
+        return values
+
+    def _after(self, ordering, values):
+        # (a, b, c) after (x, y, z) in the given directions:
+        # a > x OR (a = x AND b > y) OR (a = x AND b = y AND c > z)
+        condition = Q()
+        equal = {}
+        for name, value in zip(ordering, values):
+            field = name.lstrip('-')
+            condition |= Q(**equal, **{f"{field}__{'lt' if name.startswith('-') else 'gt'}": value})
+            equal[field] = value
+        return condition
+
+    def _get_position_from_instance(self, instance, ordering):
+        values = []
+        for name in ordering:
+            field = name.lstrip('-')
+            value = instance[field] if isinstance(instance, dict) else getattr(instance, field)
+            values.append(str(value))
+        return json.dumps(values)
+
+
+class PatientPagination(KeysetPagination):
+    ordering = ('-id',)
+
+
+class VisitPagination(KeysetPagination):
+    # id breaks ties between visits on the same date
+    ordering = ('-date', '-id')
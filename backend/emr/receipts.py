@@ -0,0 +1,86 @@
+import hashlib
+import posixpath
+
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.template.loader import render_to_string
+
+from .catalog import catalog
+from .models import Bill, Job
+
+
+def load_bill(bill_id):
+    return Bill.objects.select_related('visit__patient').get(pk=bill_id)
+
+
+def receipt_version(bill):
+    """
+    Content version of a bill's receipt. Payments bump the bill's updated_at
+    and treatment changes bump the visit's (see emr/signals.py), so any
+    change to what the receipt shows produces a new version.
+    """
+    visit = bill.visit
+    key = f'{bill.updated_at.isoformat()}|{visit.updated_at.isoformat()}|{visit.patient.updated_at.isoformat()}'
+    return hashlib.sha1(key.encode()).hexdigest()[:16]
+
+
+def receipt_name(bill, version):
+    return f'receipts/{bill.pk}/{version}.html'
+
+
+def render(bill):
+    visit = bill.visit
+    lines = []
+    for vt in visit.treatments.all():
+        treatment = catalog.get(vt.treatment_id) or vt.treatment
+        lines.append({
+            'title': treatment.title,
+            'sittings': vt.sittings,
+            'rate': vt.cost_per_sitting,
+            'amount': vt.cost_per_sitting * vt.sittings,
+        })
+    subtotal = visit.consultation_fee + sum((line['amount'] for line in lines), 0)
+    return render_to_string('emr/receipt.html', {
+        'bill': bill,
+        'visit': visit,
+        'patient': visit.patient,
+        'lines': lines,
+        'payments': list(bill.payments.order_by('date')),
+        'subtotal': subtotal,
+        'discount': subtotal - bill.grand_total,
+    })
+
+
+def get_or_render(bill):
+    """Return (version, html), rendering and storing the receipt only if this version is new."""
+    version = receipt_version(bill)
+    name = receipt_name(bill, version)
+    if default_storage.exists(name):
+        with default_storage.open(name, 'rb') as f:
+            return version, f.read().decode()
+    html = render(bill)
+    if not default_storage.exists(name):
+        default_storage.save(name, ContentFile(html.encode()))
+    _prune(bill, keep=name)
+    return version, html
+
+
+def _prune(bill, keep):
+    folder = posixpath.dirname(keep)
+    try:
+        _, files = default_storage.listdir(folder)
+    except FileNotFoundError:
+        return
+    for filename in files:
+        name = posixpath.join(folder, filename)
+        if name != keep:
+            default_storage.delete(name)
+
+
+def schedule(bill):
+    """Render the receipt for the bill's current version in the background."""
+    from . import jobs
+    # A job still waiting in the queue loads the bill when it runs, so it
+    # renders this version too; a running one may have loaded it already
+    if not Job.objects.filter(name='render_receipt', status='queued', payload__bill_id=bill.pk).exists():
+        jobs.enqueue('render_receipt', {'bill_id': bill.pk})
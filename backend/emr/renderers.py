@@ -0,0 +1,35 @@
+from rest_framework.renderers import JSONRenderer
+
+try:
+    import orjson
+except ImportError: # Optional; the stock renderer is used without it
+    orjson = None
+
+
+class FastJSONRenderer(JSONRenderer):
+    """
+    JSONRenderer that encodes with orjson when it is installed.
+
+    The output is byte for byte what JSONRenderer writes with the default
+    UNICODE_JSON / COMPACT_JSON settings: datetimes, decimals, lazy strings
+    and anything else orjson does not handle the same way go through DRF's
+    encoder, and U+2028/U+2029 are escaped. The one difference is that
+    floats outside 1e-4..1e16 use orjson's exponent form (1e16, not 1e+16);
+    the API renders money as strings, so no endpoint returns such floats.
+    Indented output (the browsable API, ?indent=) uses JSONRenderer.
+    """
+    OPTIONS = (orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_NON_STR_KEYS) if orjson else 0
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if orjson is None or data is None or self.ensure_ascii or not self.compact:
+            return super().render(data, accepted_media_type, renderer_context)
+        if self.get_indent(accepted_media_type, renderer_context or {}) is not None:
+            return super().render(data, accepted_media_type, renderer_context)
+        try:
+            ret = orjson.dumps(data, default=self.encoder_class().default, option=self.OPTIONS)
+        except (TypeError, orjson.JSONEncodeError):
+            # e.g. integers beyond 64 bits
+            return super().render(data, accepted_media_type, renderer_context)
+        if b'\xe2\x80\xa8' in ret or b'\xe2\x80\xa9' in ret:
+            ret = ret.replace(b'\xe2\x80\xa8', b'\\u2028').replace(b'\xe2\x80\xa9', b'\\u2029')
+        return ret
@@ -0,0 +1,189 @@
+import datetime
+from collections import namedtuple
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import CharField, Count, DateField, DecimalField, ExpressionWrapper, F, Sum, Value
+from django.db.models.functions import TruncDate, TruncMonth, TruncWeek
+from django.utils import timezone
+
+from .exports import day_bounds
+from .models import Bill, Payment, RevenueRollup, RevenueWatermark, Visit, VisitTreatment
+
+GROUPS = ('day', 'week', 'month', 'doctor', 'treatment')
+METRICS = ('consultation', 'treatment', 'collection')
+
+ZERO = Decimal('0.00')
+
+# Where each metric is read from when aggregating live. `date_field` is
+# filtered on directly (as a timestamp when `timestamp` is set), `day` is the
+# calendar day the amount belongs to.
+Source = namedtuple('Source', 'model date_field timestamp day doctor key amount')
+
+
+def _sources():
+    return {
+        'consultation': Source(Visit, 'date', False, F('date'), 'doctor_name', None, F('consultation_fee')),
+        'treatment': Source(
+            VisitTreatment, 'visit__date', False, F('visit__date'), 'visit__doctor_name', 'treatment_id',
+            ExpressionWrapper(F('sittings') * F('cost_per_sitting'), output_field=DecimalField(max_digits=14, decimal_places=2)),
+        ),
+        'collection': Source(
+            Payment, 'date', True, TruncDate('date', tzinfo=timezone.get_current_timezone()),
+            'bill__visit__doctor_name', 'mode', F('amount'),
+        ),
+    }
+
+
+def _bucket(group, day, doctor, key):
+    if group == 'week':
+        return TruncWeek(day, output_field=DateField())
+    if group == 'month':
+        return TruncMonth(day, output_field=DateField())
+    return F({'day': day, 'doctor': doctor, 'treatment': key}[group])
+
+
+def _as_date(value):
+    return datetime.date.fromisoformat(value) if isinstance(value, str) else value
+
+
+def _live(metric, start, end):
+    """`metric` rows in [start, end] (either may be None), annotated with day, doctor and key."""
+    source = _sources()[metric]
+    queryset = source.model.objects.all()
+    if source.timestamp:
+        for op, bound in day_bounds(start, end):
+            queryset = queryset.filter(**{f'{source.date_field}__{op}': bound})
+    else:
+        if start:
+            queryset = queryset.filter(**{f'{source.date_field}__gte': start})
+        if end:
+            queryset = queryset.filter(**{f'{source.date_field}__lte': end})
+    key = F(source.key) if source.key else Value('', output_field=CharField())
+    return queryset.annotate(day=source.day, doctor=F(source.doctor), key=key), source.amount
+
+
+def closed_through():
+    return RevenueWatermark.objects.values_list('closed_through', flat=True).first()
+
+
+def _rebuild(start, end):
+    # Replace the rollup rows for [start, end] with fresh aggregates
+    rows = []
+    for metric in METRICS:
+        queryset, amount = _live(metric, start, end)
+        per_day = queryset.values('day', 'doctor', 'key').annotate(total=Sum(amount), n=Count('pk')).order_by()
+        rows.extend(
+            RevenueRollup(date=r['day'], doctor_name=r['doctor'], metric=metric, key=str(r['key']), amount=r['total'], count=r['n'])
+            for r in per_day
+        )
+    existing = RevenueRollup.objects.all()
+    if start:
+        existing = existing.filter(date__gte=start)
+    existing.filter(date__lte=end).delete()
+    RevenueRollup.objects.bulk_create(rows, batch_size=1000)
+    return len(rows)
+
+
+def close(through=None):
+    """Roll up every day after the watermark up to `through` (yesterday by default)."""
+    through = through or timezone.localdate() - datetime.timedelta(days=1)
+    with transaction.atomic():
+        mark = RevenueWatermark.objects.select_for_update().first()
+        start = mark.closed_through + datetime.timedelta(days=1) if mark else None
+        if start and start > through:
+            return 0
+        rows = _rebuild(start, through)
+        if mark:
+            mark.closed_through = through
+            mark.save()
+        else:
+            RevenueWatermark.objects.create(closed_through=through)
+    return rows
+
+
+def reopen():
+    """Drop the rollup entirely; the next close() recomputes all history."""
+    with transaction.atomic():
+        RevenueWatermark.objects.all().delete()
+        RevenueRollup.objects.all().delete()
+
+
+def refresh(dates):
+    """Recompute the rollup for any of `dates` that are already closed."""
+    today = timezone.localdate()
+    dates = {_as_date(d) for d in dates if d}
+    dates = {d for d in dates if d < today}
+    if not dates:
+        return
+    through = closed_through()
+    dates = [d for d in dates if through and d <= through]
+    if dates:
+        _rebuild(min(dates), max(dates))
+
+
+def empty_row(key):
+    return {'key': key, 'consultationFees': ZERO, 'consultations': 0, 'treatmentCharges': ZERO, 'treatments': 0,
+            'collected': ZERO, 'payments': 0, 'collections': {}, 'outstanding': ZERO, 'outstandingBills': 0}
+
+
+def _add(rows, bucket, metric, key, total, count):
+    if bucket is None:
+        return
+    if isinstance(bucket, datetime.datetime):
+        bucket = bucket.date()
+    if isinstance(bucket, datetime.date):
+        bucket = bucket.isoformat()
+    row = rows.setdefault(str(bucket), empty_row(str(bucket)))
+    total = total or ZERO
+    if metric == 'consultation':
+        row['consultationFees'] += total
+        row['consultations'] += count
+    elif metric == 'treatment':
+        row['treatmentCharges'] += total
+        row['treatments'] += count
+    elif metric == 'collection':
+        row['collected'] += total
+        row['payments'] += count
+        row['collections'][key] = row['collections'].get(key, ZERO) + total
+    else:
+        row['outstanding'] += total
+        row['outstandingBills'] += count
+
+
+def report(start, end, group='day'):
+    """
+    Revenue between `start` and `end` (inclusive) grouped by `group`.
+
+    Days up to the watermark come from one GROUP BY over RevenueRollup; the
+    open days after it from one GROUP BY per metric over the base tables.
+    Outstanding balances are always read live since payments keep changing
+    them.
+    """
+    if group not in GROUPS:
+        raise ValueError(f"Unknown grouping '{group}'")
+    rows = {}
+    metrics = ('treatment',) if group == 'treatment' else METRICS
+    through = closed_through()
+
+    if through and start <= through:
+        closed = RevenueRollup.objects.filter(date__gte=start, date__lte=min(end, through), metric__in=metrics)
+        closed = closed.annotate(bucket=_bucket(group, 'date', 'doctor_name', 'key'))
+        for r in closed.values('bucket', 'metric', 'key').annotate(total=Sum('amount'), n=Sum('count')).order_by():
+            _add(rows, r['bucket'], r['metric'], r['key'], r['total'], r['n'])
+
+    live_start = max(start, through + datetime.timedelta(days=1)) if through else start
+    if live_start <= end:
+        for metric in metrics:
+            queryset, amount = _live(metric, live_start, end)
+            queryset = queryset.annotate(bucket=_bucket(group, 'day', 'doctor', 'key'))
+            for r in queryset.values('bucket', 'key').annotate(total=Sum(amount), n=Count('pk')).order_by():
+                _add(rows, r['bucket'], metric, str(r['key']), r['total'], r['n'])
+
+    if group != 'treatment':
+        bills = Bill.objects.filter(visit__date__gte=start, visit__date__lte=end, balance__gt=0)
+        bills = bills.annotate(bucket=_bucket(group, 'visit__date', 'visit__doctor_name', None))
+        for r in bills.values('bucket').annotate(total=Sum('balance'), n=Count('pk')).order_by():
+            _add(rows, r['bucket'], 'outstanding', '', r['total'], r['n'])
+
+    return [rows[key] for key in sorted(rows)]
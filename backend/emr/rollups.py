@@ -0,0 +1,83 @@
+import datetime
+
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, Q
+
+from .models import DailyStats, Patient, Visit
+
+COUNTERS = ('visits', 'new_patients', 'pending_reports')
+
+
+def _as_date(value):
+    if isinstance(value, str):
+        return datetime.date.fromisoformat(value)
+    return value
+
+
+def bump(day, **deltas):
+    """Atomically add `deltas` to the counters of the DailyStats row for `day`."""
+    deltas = {name: delta for name, delta in deltas.items() if delta}
+    if day is None or not deltas:
+        return
+    day = _as_date(day)
+    changes = {name: F(name) + delta for name, delta in deltas.items()}
+    if DailyStats.objects.filter(date=day).update(**changes):
+        return
+    try:
+        with transaction.atomic():
+            DailyStats.objects.create(date=day, **deltas)
+    except IntegrityError:
+        # Another writer created the row first
+        DailyStats.objects.filter(date=day).update(**changes)
+
+
+def visit_state(date, diagnosis):
+    return (_as_date(date), diagnosis == '')
+
+
+def apply_visit_change(old, new):
+    """Move one visit's contribution from state `old` to `new` (either may be None)."""
+    if old == new:
+        return
+    if old is not None:
+        bump(old[0], visits=-1, pending_reports=-1 if old[1] else 0)
+    if new is not None:
+        bump(new[0], visits=1, pending_reports=1 if new[1] else 0)
+
+
+def apply_patient_change(old_date, new_date):
+    if _as_date(old_date) == _as_date(new_date):
+        return
+    bump(old_date, new_patients=-1)
+    bump(new_date, new_patients=1)
+
+
+def rebuild(since=None):
+    """Recompute DailyStats from Visit and Patient, optionally only from `since` onwards."""
+    rows = {}
+
+    visits = Visit.objects.all()
+    patients = Patient.objects.all()
+    if since:
+        visits = visits.filter(date__gte=since)
+        patients = patients.filter(first_visit_date__gte=since)
+
+    per_day = visits.values('date').annotate(
+        visit_count=Count('id'), pending=Count('id', filter=Q(diagnosis=''))
+    ).order_by()
+    for row in per_day:
+        stats = rows.setdefault(row['date'], DailyStats(date=row['date']))
+        stats.visits = row['visit_count']
+        stats.pending_reports = row['pending']
+
+    for row in patients.values('first_visit_date').annotate(n=Count('id')).order_by():
+        stats = rows.setdefault(row['first_visit_date'], DailyStats(date=row['first_visit_date']))
+        stats.new_patients = row['n']
+
+    with transaction.atomic():
+        existing = DailyStats.objects.all()
+        if since:
+            existing = existing.filter(date__gte=since)
+        existing.delete()
+        DailyStats.objects.bulk_create(rows.values(), batch_size=1000)
+    return len(rows)
@@ -0,0 +1,156 @@
+import asyncio
+import re
+
+from asgiref.sync import sync_to_async
+from django.db import connection
+from django.db.models.expressions import RawSQL
+
+from .models import Patient, normalize_mobile
+
+# Name index table for SQLite. Rows are keyed by the patient id (rowid) and
+# maintained by the signal handlers in emr/signals.py.
+FTS_TABLE = 'emr_patient_fts'
+
+TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+
+
+def _name_tokens(query):
+    return [t for t in TOKEN_RE.findall(query.lower()) if not t.isdigit()]
+
+
+def _fts_match(tokens):
+    # Every token must match as a prefix of some word in the name:
+    # "ram ku" -> "ram"* AND "ku"*
+    return ' AND '.join('"%s"*' % t.replace('"', '') for t in tokens)
+
+
+def index_patients(patients):
+    """Write (or rewrite) the name index rows for the given patients."""
+    if connection.vendor != 'sqlite':
+        # Postgres uses an expression index on the table itself
+        return
+    rows = [(p.pk, p.name) for p in patients]
+    if not rows:
+        return
+    with connection.cursor() as cursor:
+        cursor.executemany(f'INSERT OR REPLACE INTO {FTS_TABLE}(rowid, name) VALUES (%s, %s)', rows)
+
+
+def unindex_patient(patient_id):
+    if connection.vendor != 'sqlite':
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(f'DELETE FROM {FTS_TABLE} WHERE rowid = %s', [patient_id])
+
+
+def rebuild_index():
+    """Re-populate the name index from the patient table (backfill / repair)."""
+    if connection.vendor != 'sqlite':
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(f'DELETE FROM {FTS_TABLE}')
+        cursor.execute(f'INSERT INTO {FTS_TABLE}(rowid, name) SELECT id, name FROM emr_patient')
+
+
+def _search_names(query, tokens, limit):
+    if connection.vendor == 'sqlite':
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s ORDER BY rank LIMIT %s',
+                [_fts_match(tokens), limit],
+            )
+            return [row[0] for row in cursor.fetchall()]
+
+    queryset = Patient.objects.all()
+    if connection.vendor == 'postgresql':
+        # icontains compiles to UPPER(name) LIKE UPPER(%s), which is served
+        # by the pg_trgm GIN index created in migration 0006.
+        queryset = queryset.filter(name__icontains=query).annotate(
+            score=RawSQL('similarity("emr_patient"."name", %s)', (query,))
+        ).order_by('-score', '-id')
+    else:
+        for token in tokens:
+            queryset = queryset.filter(name__icontains=token)
+        queryset = queryset.order_by('-id')
+    return list(queryset.values_list('id', flat=True)[:limit])
+
+
+def _reg_no_ids(query, limit):
+    reg_key = query.upper()
+    # Range scan instead of LIKE so the plain b-tree index on reg_no_key is
+    # usable. An exact match sorts first.
+    return (
+        Patient.objects.filter(reg_no_key__gte=reg_key, reg_no_key__lt=reg_key + '\U0010ffff')
+        .order_by('reg_no_key').values_list('id', flat=True)[:limit]
+    )
+
+
+def _mobile_ids(query, limit):
+    """None when the query cannot be a mobile number."""
+    if not re.fullmatch(r'[\d\s+()-]+', query):
+        return None
+    digits = normalize_mobile(query)
+    if not digits:
+        return None
+    return (
+        Patient.objects.filter(mobile_digits__gte=digits, mobile_digits__lt=digits + ':')
+        .order_by('-id').values_list('id', flat=True)[:limit]
+    )
+
+
+def _rank(limit, *matches):
+    ranked = []
+    for ids in matches:
+        for pk in ids:
+            if pk not in ranked and len(ranked) < limit:
+                ranked.append(pk)
+    return ranked
+
+
+def search_patients(query, limit=20):
+    """
+    Ranked patient lookup. Matches are ordered by:
+    exact reg no, reg no prefix, mobile number prefix, then name relevance.
+    Every step is an indexed lookup capped at `limit` rows.
+    """
+    query = query.strip()
+    if not query:
+        return []
+
+    ranked = _rank(limit, _reg_no_ids(query, limit))
+
+    mobile_ids = _mobile_ids(query, limit)
+    if mobile_ids is not None and len(ranked) < limit:
+        ranked = _rank(limit, ranked, mobile_ids)
+
+    tokens = _name_tokens(query)
+    if tokens and len(ranked) < limit:
+        ranked = _rank(limit, ranked, _search_names(query, tokens, limit))
+
+    patients = Patient.objects.in_bulk(ranked)
+    return [patients[pk] for pk in ranked if pk in patients]
+
+
+async def asearch_patients(query, limit=20):
+    """
+    search_patients() for async views. The lookups are independent, so all
+    of them are issued at once rather than stopping when `limit` is reached.
+    """
+    query = query.strip()
+    if not query:
+        return []
+
+    async def ids(queryset):
+        return [pk async for pk in queryset]
+
+    lookups = [ids(_reg_no_ids(query, limit))]
+    mobile_ids = _mobile_ids(query, limit)
+    if mobile_ids is not None:
+        lookups.append(ids(mobile_ids))
+    tokens = _name_tokens(query)
+    if tokens:
+        lookups.append(sync_to_async(_search_names)(query, tokens, limit))
+
+    ranked = _rank(limit, *await asyncio.gather(*lookups))
+    patients = await Patient.objects.ain_bulk(ranked)
+    return [patients[pk] for pk in ranked if pk in patients]
@@ -0,0 +1,96 @@
+import threading
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .models import BillSequence
+
+
+def reserve(year, count=1):
+    """
+    Atomically take the next `count` values of the year's sequence and
+    return the first one. Inside the caller's transaction this is a
+    savepoint: the UPDATE locks the counter row (the whole database on
+    SQLite) until the caller commits, and a rollback gives the values back.
+    """
+    with transaction.atomic():
+        updated = BillSequence.objects.filter(year=year).update(last_value=F('last_value') + count)
+        if not updated:
+            try:
+                with transaction.atomic():
+                    BillSequence.objects.create(year=year, last_value=count)
+                return 1
+            except IntegrityError:
+                # Created concurrently; take our values from the existing row
+                BillSequence.objects.filter(year=year).update(last_value=F('last_value') + count)
+        last = BillSequence.objects.filter(year=year).values_list('last_value', flat=True).get()
+    return last - count + 1
+
+
+class Block:
+    """
+    Values reserved by one reserve() call. Until the transaction that
+    reserved them commits, only that transaction may draw from the block,
+    and if it rolls back the counter goes back with it, so the block must be
+    dropped or its values would be handed out a second time.
+    """
+
+    def __init__(self, start, size):
+        self.next = start
+        self.last = start + size - 1
+        self.committed = False
+        self.connection = transaction.get_connection()
+        # Runs at once outside a transaction
+        transaction.on_commit(self._commit)
+
+    def _commit(self):
+        self.committed = True
+
+    def usable(self):
+        if self.next > self.last:
+            return False
+        if self.committed:
+            return True
+        # Rolling back a transaction or savepoint discards the on_commit
+        # callbacks registered in it
+        return self.connection is transaction.get_connection() and any(
+            callback == self._commit for sids, callback, *rest in self.connection.run_on_commit
+        )
+
+    def take(self):
+        value = self.next
+        self.next += 1
+        return value
+
+
+class BlockAllocator:
+    """
+    Hands out sequence values from blocks reserved in the database, so only
+    one in every `block_size` allocations costs a round-trip. With a block
+    size above 1, numbers reserved by a process that exits unused are lost,
+    so sequences stay unique but may have gaps.
+    """
+
+    def __init__(self, block_size=1):
+        self.block_size = block_size
+        self._lock = threading.Lock()
+        self._blocks = {} # year -> Block
+
+    def next(self, year):
+        if self.block_size <= 1:
+            return reserve(year)
+        with self._lock:
+            block = self._blocks.get(year)
+            if block is None or not block.usable():
+                block = self._blocks[year] = Block(reserve(year, self.block_size), self.block_size)
+            return block.take()
+
+
+allocator = BlockAllocator(getattr(settings, 'BILL_NUMBER_BLOCK_SIZE', 1))
+
+
+def next_bill_number():
+    year = timezone.localdate().year
+    return f"BILL-{year}-{allocator.next(year):04d}"
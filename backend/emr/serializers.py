@@ -1,5 +1,11 @@
+from django.db import transaction
 from rest_framework import serializers
+from rest_framework.validators import UniqueValidator
 from .models import User, Patient, Visit, VisitAttachment, Treatment, VisitTreatment, Bill, Payment
+from .billing import set_grand_total
+from .catalog import catalog
+from .sparse import SparseFieldsMixin
+from . import blobs, revenue
 
 class UserSerializer(serializers.ModelSerializer):
     # Frontend sends 'username' as the Full Name. We map this to 'first_name' internally or keep it as username if unique.
@@ -33,9 +39,16 @@ class UserSerializer(serializers.ModelSerializer):
         user = User.objects.create_user(password=password, **validated_data)
         return user
 
-class PatientSerializer(serializers.ModelSerializer):
+    def update(self, instance, validated_data):
+        # Hash a new password, which also retires the user's existing tokens
+        password = validated_data.pop('password', None)
+        if password:
+            instance.change_password(password)
+        return super().update(instance, validated_data)
+
+class PatientSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     firstVisitDate = serializers.DateField(source='first_visit_date')
-    regNo = serializers.CharField(source='reg_no')
+    regNo = serializers.CharField(source='reg_no', max_length=50, validators=[UniqueValidator(queryset=Patient.objects.all())])
     altMobile = serializers.CharField(source='alt_mobile', required=False, allow_null=True)
     bloodGroup = serializers.CharField(source='blood_group', required=False, allow_null=True)
     registration_document = serializers.FileField(required=False, allow_null=True)
@@ -43,6 +56,8 @@ class PatientSerializer(serializers.ModelSerializer):
     class Meta:
         model = Patient
         fields = ['id', 'name', 'mobile', 'altMobile', 'age', 'sex', 'address', 'regNo', 'firstVisitDate', 'bloodGroup', 'registration_document']
+        # Rendered by list endpoints unless ?fields= or ?expand= say otherwise (see emr/sparse.py)
+        compact_fields = ['id', 'name', 'mobile', 'age', 'sex', 'regNo', 'firstVisitDate']
 
 class VisitAttachmentSerializer(serializers.ModelSerializer):
     class Meta:
@@ -54,14 +69,32 @@ class TreatmentSerializer(serializers.ModelSerializer):
         model = Treatment
         fields = ['id', 'title', 'description', 'image', 'price']
 
+class CatalogTreatmentField(serializers.PrimaryKeyRelatedField):
+    # Validates treatment ids against the in-process catalog instead of the DB
+    def to_internal_value(self, data):
+        try:
+            treatment = catalog.get(int(data))
+        except (TypeError, ValueError):
+            self.fail('incorrect_type', data_type=type(data).__name__)
+        if treatment is None:
+            self.fail('does_not_exist', pk_value=data)
+        return treatment
+
 class VisitTreatmentSerializer(serializers.ModelSerializer):
-    treatment = TreatmentSerializer(read_only=True)
-    treatment_id = serializers.PrimaryKeyRelatedField(source='treatment', queryset=Treatment.objects.all(), write_only=True)
+    treatment = serializers.SerializerMethodField()
+    treatment_id = CatalogTreatmentField(source='treatment', queryset=Treatment.objects.all(), write_only=True)
 
     class Meta:
         model = VisitTreatment
         fields = ['id', 'treatment', 'treatment_id', 'sittings', 'cost_per_sitting']
 
+    def get_treatment(self, obj):
+        # Served from the catalog so rendering needs neither a join nor a query per row
+        data = catalog.representation(obj.treatment_id)
+        if data is None:
+            data = TreatmentSerializer(obj.treatment).data
+        return data
+
 class PaymentSerializer(serializers.ModelSerializer):
     receivedBy = serializers.CharField(source='received_by.name', read_only=True)
     
@@ -69,24 +102,20 @@ class PaymentSerializer(serializers.ModelSerializer):
         model = Payment
         fields = ['id', 'amount', 'date', 'mode', 'receivedBy']
 
-class BillSerializer(serializers.ModelSerializer):
+class BillSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     payments = PaymentSerializer(many=True, read_only=True)
     grandTotal = serializers.DecimalField(source='grand_total', max_digits=10, decimal_places=2)
     billNumber = serializers.CharField(source='bill_number', read_only=True)
-    balance = serializers.SerializerMethodField()
-    totalPaid = serializers.SerializerMethodField()
+    # Stored on the bill and kept current by emr/billing.py
+    balance = serializers.DecimalField(max_digits=10, decimal_places=2, read_only=True)
+    totalPaid = serializers.DecimalField(source='total_paid', max_digits=10, decimal_places=2, read_only=True)
 
     class Meta:
         model = Bill
         fields = ['id', 'billNumber', 'grandTotal', 'status', 'payments', 'balance', 'totalPaid']
+        compact_fields = ['id', 'billNumber', 'grandTotal', 'status', 'balance', 'totalPaid']
 
-    def get_totalPaid(self, obj):
-        return sum(p.amount for p in obj.payments.all())
-
-    def get_balance(self, obj):
-        return obj.grand_total - self.get_totalPaid(obj)
-
-class VisitSerializer(serializers.ModelSerializer):
+class VisitSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     patientId = serializers.PrimaryKeyRelatedField(source='patient', queryset=Patient.objects.all())
     doctorName = serializers.CharField(source='doctor_name')
     clinicalHistory = serializers.CharField(source='clinical_history', required=False, allow_blank=True)
@@ -94,6 +123,7 @@ class VisitSerializer(serializers.ModelSerializer):
     
     # Custom field to return list of file URLs
     attachments = serializers.SerializerMethodField()
+    attachmentPreviews = serializers.SerializerMethodField()
     # Write-only field for multiple file uploads
     files = serializers.ListField(
         child=serializers.FileField(),
@@ -119,8 +149,16 @@ class VisitSerializer(serializers.ModelSerializer):
     class Meta:
         model = Visit
         fields = ['id', 'patientId', 'date', 'doctorName', 'clinicalHistory', 'diagnosis', 'treatmentPlan', 'investigations', 
-                  'notes', 'attachments', 'files', 'status', 'consultationFee', 'isPaid', 'totalAmount', 'amountPaid', 
+                  'notes', 'attachments', 'attachmentPreviews', 'files', 'status', 'consultationFee', 'isPaid', 'totalAmount', 'amountPaid', 
                   'treatments', 'visit_treatments', 'bill']
+        # Clinical notes, attachments, treatments and payments are left to ?expand=
+        compact_fields = ['id', 'patientId', 'date', 'doctorName', 'status', 'consultationFee', 'isPaid', 'totalAmount',
+                          'amountPaid', 'bill']
+
+    def get_attachmentPreviews(self, obj):
+        # Original plus derived thumbnail/preview URLs (None when not an image or not rendered yet)
+        request = self.context.get('request')
+        return [blobs.preview_urls(att.file, request) for att in obj.attachment_files.all()]
 
     def get_attachments(self, obj):
         # build absolute URI if request is available context
@@ -133,28 +171,83 @@ class VisitSerializer(serializers.ModelSerializer):
                 urls.append(att.file.url)
         return urls
 
+    def _attach_files(self, visit, files_data):
+        attachments = VisitAttachment.objects.bulk_create(
+            [VisitAttachment(visit=visit, file=file_data) for file_data in files_data]
+        )
+        # bulk_create skips the post_save handler that counts file references
+        blobs.attached([a.file.name for a in attachments])
+
+    def _resolve_treatments(self, visit_treatments_data):
+        # Prices come from the cached catalog, so this needs no query at all
+        rows = []
+        for vt_data in visit_treatments_data:
+            try:
+                rows.append((int(vt_data['treatmentId']), int(vt_data.get('sittings', 1))))
+            except (KeyError, TypeError, ValueError):
+                raise serializers.ValidationError({'visit_treatments': f'Invalid treatment row: {vt_data}'})
+            if rows[-1][1] < 1:
+                raise serializers.ValidationError({'visit_treatments': f'sittings must be at least 1: {vt_data}'})
+        treatments = catalog.in_bulk({treatment_id for treatment_id, _ in rows})
+        missing = sorted({treatment_id for treatment_id, _ in rows} - set(treatments))
+        if missing:
+            raise serializers.ValidationError({'visit_treatments': f'Unknown treatment ids: {missing}'})
+        return [(treatments[treatment_id], sittings) for treatment_id, sittings in rows]
+
+    def _sync_treatments(self, visit, visit_treatments_data, existing=()):
+        """
+        Make the visit's VisitTreatment rows match the payload. Rows are paired
+        with existing ones by treatment (in order, so the same treatment may
+        appear twice); matches are updated in place, the rest are created or
+        deleted in bulk.
+        """
+        unmatched = {}
+        for vt in existing:
+            unmatched.setdefault(vt.treatment_id, []).append(vt)
+
+        to_create, to_update = [], []
+        for treatment, sittings in self._resolve_treatments(visit_treatments_data):
+            matches = unmatched.get(treatment.pk)
+            if matches:
+                vt = matches.pop(0)
+                # Kept rows are repriced at the catalog's current price
+                if vt.sittings != sittings or vt.cost_per_sitting != treatment.price:
+                    vt.sittings = sittings
+                    vt.cost_per_sitting = treatment.price
+                    to_update.append(vt)
+            else:
+                to_create.append(VisitTreatment(
+                    visit=visit, treatment=treatment, sittings=sittings, cost_per_sitting=treatment.price
+                ))
+
+        stale = [vt.pk for rows in unmatched.values() for vt in rows]
+        if stale:
+            VisitTreatment.objects.filter(pk__in=stale).delete()
+        if to_update:
+            VisitTreatment.objects.bulk_update(to_update, ['sittings', 'cost_per_sitting'])
+        if to_create:
+            VisitTreatment.objects.bulk_create(to_create)
+        if stale or to_update or to_create:
+            # The bulk writes skip the signal that keeps closed days current
+            revenue.refresh([visit.date])
+
     def create(self, validated_data):
         files_data = validated_data.pop('files', [])
         visit_treatments_data = validated_data.pop('visit_treatments', [])
-        
-        visit = Visit.objects.create(**validated_data)
-        
-        for file_data in files_data:
-            VisitAttachment.objects.create(visit=visit, file=file_data)
-
-        # Handle treatments if any (though usually added later)
-        if visit_treatments_data:
-            for vt_data in visit_treatments_data:
-                treatment = Treatment.objects.get(pk=vt_data['treatmentId'])
-                VisitTreatment.objects.create(
-                    visit=visit,
-                    treatment=treatment,
-                    sittings=vt_data.get('sittings', 1),
-                    cost_per_sitting=treatment.price
-                )
+
+        with transaction.atomic():
+            visit = Visit.objects.create(**validated_data)
+
+            if files_data:
+                self._attach_files(visit, files_data)
+
+            # Handle treatments if any (though usually added later)
+            if visit_treatments_data:
+                self._sync_treatments(visit, visit_treatments_data)
 
         return visit
-        
+
+    @transaction.atomic
     def update(self, instance, validated_data):
         files_data = validated_data.pop('files', [])
         visit_treatments_data = validated_data.pop('visit_treatments', None)
@@ -162,31 +255,17 @@ class VisitSerializer(serializers.ModelSerializer):
         # Update basic fields
         for attr, value in validated_data.items():
             setattr(instance, attr, value)
-        
+
         instance.save()
-        
+
         if files_data:
-            for file_data in files_data:
-                VisitAttachment.objects.create(visit=instance, file=file_data)
-        
-        # Update Treatments
+            self._attach_files(instance, files_data)
+
+        # Update Treatments: diff against what is stored rather than clearing
+        # and re-adding every row
         if visit_treatments_data is not None:
-            # Clear existing treatments? Or merge? 
-            # Logic: If updating treatments, usually easiest to clear and re-add or sync.
-            # For simplicity, let's clear and re-add (BE CAREFUL if tracking progress, but here it's simple list)
-            instance.treatments.all().delete()
-            for vt_data in visit_treatments_data:
-                treatment = Treatment.objects.get(pk=vt_data['treatmentId'])
-                VisitTreatment.objects.create(
-                    visit=instance,
-                    treatment=treatment,
-                    sittings=vt_data.get('sittings', 1),
-                    # Use current price, or valid logic to keep old price if needed. 
-                    # Assuming we want fresh price or passed price?
-                    # The prompt implies custom pricing might be future, but let's stick to treatment price for now
-                    cost_per_sitting=treatment.price 
-                )
-        
+            self._sync_treatments(instance, visit_treatments_data, existing=list(instance.treatments.all()))
+
         # Auto-create or Update Bill if we are "finishing" consultation
         # Logic: If totalAmount is present, we should update the Bill.
         
@@ -199,7 +278,36 @@ class VisitSerializer(serializers.ModelSerializer):
                 # status depends on payments...
             )
         else:
-            instance.bill.grand_total = instance.total_amount
-            instance.bill.save()
+            set_grand_total(instance.bill, instance.total_amount)
             
         return instance
+
+class PatientImportSerializer(PatientSerializer):
+    # One row of a bulk patient import (emr/importer.py), which checks regNo
+    # uniqueness for the whole batch in one query instead of once per row.
+    regNo = serializers.CharField(source='reg_no', max_length=50)
+
+class VisitImportSerializer(serializers.ModelSerializer):
+    # One row of a bulk visit import (emr/importer.py). The patient is named
+    # by regNo or patientId and resolved for the whole batch by the importer,
+    # so validating a row never touches the database.
+    regNo = serializers.CharField(required=False)
+    patientId = serializers.IntegerField(required=False)
+    doctorName = serializers.CharField(source='doctor_name')
+    clinicalHistory = serializers.CharField(source='clinical_history', required=False, allow_blank=True)
+    treatmentPlan = serializers.CharField(source='treatment_plan', required=False, allow_blank=True)
+    status = serializers.ChoiceField(choices=Visit.STATUS_CHOICES, required=False)
+    consultationFee = serializers.DecimalField(source='consultation_fee', max_digits=10, decimal_places=2, required=False)
+    isPaid = serializers.BooleanField(source='is_paid', required=False)
+    totalAmount = serializers.DecimalField(source='total_amount', max_digits=10, decimal_places=2, required=False)
+    amountPaid = serializers.DecimalField(source='amount_paid', max_digits=10, decimal_places=2, required=False)
+
+    class Meta:
+        model = Visit
+        fields = ['regNo', 'patientId', 'date', 'doctorName', 'clinicalHistory', 'diagnosis', 'treatmentPlan',
+                  'investigations', 'notes', 'status', 'consultationFee', 'isPaid', 'totalAmount', 'amountPaid']
+
+    def validate(self, data):
+        if not data.get('regNo') and not data.get('patientId'):
+            raise serializers.ValidationError("regNo or patientId is required")
+        return data
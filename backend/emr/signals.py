@@ -0,0 +1,195 @@
+from django.db import transaction
+from django.db.models.signals import pre_save, post_save, post_delete
+from django.dispatch import receiver
+
+from django.utils import timezone
+
+from .models import User, Patient, Visit, Treatment, VisitTreatment, VisitAttachment, Bill, Payment
+from .catalog import catalog
+from . import authentication, blobs, conditional, revenue, rollups, search
+
+
+@receiver(post_save, sender=Patient)
+def index_patient(sender, instance, **kwargs):
+    search.index_patients([instance])
+
+
+@receiver(post_delete, sender=Patient)
+def unindex_patient(sender, instance, **kwargs):
+    search.unindex_patient(instance.pk)
+
+
+# Daily rollups. The previous values are read in pre_save so the post_save
+# handler can move the row's contribution between days in the same
+# transaction as the write itself.
+
+def _touches(update_fields, *names):
+    return update_fields is None or any(name in update_fields for name in names)
+
+
+@receiver(pre_save, sender=Visit)
+def remember_visit_state(sender, instance, raw=False, update_fields=None, **kwargs):
+    instance._rollup_state = None
+    if raw or instance._state.adding or not _touches(update_fields, 'date', 'diagnosis'):
+        return
+    old = Visit.objects.filter(pk=instance.pk).values('date', 'diagnosis').first()
+    if old:
+        instance._rollup_state = rollups.visit_state(old['date'], old['diagnosis'])
+
+
+@receiver(post_save, sender=Visit)
+def update_visit_rollup(sender, instance, created, raw=False, update_fields=None, **kwargs):
+    if raw:
+        return
+    if created:
+        rollups.apply_visit_change(None, rollups.visit_state(instance.date, instance.diagnosis))
+    elif instance._rollup_state is not None:
+        rollups.apply_visit_change(instance._rollup_state, rollups.visit_state(instance.date, instance.diagnosis))
+
+
+@receiver(post_delete, sender=Visit)
+def remove_visit_rollup(sender, instance, **kwargs):
+    rollups.apply_visit_change(rollups.visit_state(instance.date, instance.diagnosis), None)
+
+
+@receiver(pre_save, sender=Patient)
+def remember_patient_state(sender, instance, raw=False, update_fields=None, **kwargs):
+    instance._rollup_first_visit = None
+    instance._previous_document = None
+    if raw or instance._state.adding or not _touches(update_fields, 'first_visit_date', 'registration_document'):
+        return
+    old = Patient.objects.filter(pk=instance.pk).values('first_visit_date', 'registration_document').first()
+    if old:
+        instance._rollup_first_visit = old['first_visit_date']
+        instance._previous_document = old['registration_document'] or None
+
+
+@receiver(post_save, sender=Patient)
+def update_patient_rollup(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    if created:
+        rollups.apply_patient_change(None, instance.first_visit_date)
+    elif instance._rollup_first_visit is not None:
+        rollups.apply_patient_change(instance._rollup_first_visit, instance.first_visit_date)
+
+
+@receiver(post_delete, sender=Patient)
+def remove_patient_rollup(sender, instance, **kwargs):
+    rollups.apply_patient_change(instance.first_visit_date, None)
+
+
+@receiver(post_save, sender=Treatment)
+@receiver(post_delete, sender=Treatment)
+def invalidate_treatment_catalog(sender, **kwargs):
+    # Now, so this transaction reads its own write, and again on commit so no
+    # worker keeps a copy loaded before the commit became visible.
+    catalog.invalidate()
+    transaction.on_commit(catalog.invalidate)
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def forget_cached_user(sender, instance, **kwargs):
+    # As with the catalog: now, and again once the write is visible to others
+    authentication.forget(instance.pk)
+    transaction.on_commit(lambda: authentication.forget(instance.pk))
+
+
+# Version columns. A child write bumps updated_at on every ancestor so the
+# conditional GET checks in emr/conditional.py only need to read those.
+
+@receiver(post_delete, sender=Patient)
+@receiver(post_delete, sender=Visit)
+def count_list_deletion(sender, **kwargs):
+    # Part of the unfiltered lists' version: a delete need not move max(updated_at)
+    conditional.count_deletion(sender)
+
+
+def touch_visit(visit_ids):
+    # `visit_ids` is a list of ids or a values() subquery
+    now = timezone.now()
+    Visit.objects.filter(pk__in=visit_ids).update(updated_at=now)
+    Patient.objects.filter(visits__id__in=visit_ids).update(updated_at=now)
+
+
+@receiver(post_save, sender=Visit)
+@receiver(post_delete, sender=Visit)
+def touch_visit_patient(sender, instance, raw=False, **kwargs):
+    if not raw:
+        Patient.objects.filter(pk=instance.patient_id).update(updated_at=timezone.now())
+
+
+@receiver(post_save, sender=VisitTreatment)
+@receiver(post_delete, sender=VisitTreatment)
+@receiver(post_save, sender=VisitAttachment)
+@receiver(post_delete, sender=VisitAttachment)
+@receiver(post_save, sender=Bill)
+@receiver(post_delete, sender=Bill)
+def touch_parent_visit(sender, instance, raw=False, **kwargs):
+    if not raw:
+        touch_visit([instance.visit_id])
+
+
+@receiver(post_save, sender=Payment)
+@receiver(post_delete, sender=Payment)
+def touch_payment_bill(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    Bill.objects.filter(pk=instance.bill_id).update(updated_at=timezone.now())
+    # As a subquery: the bill may be mid-delete when payments cascade
+    touch_visit(Bill.objects.filter(pk=instance.bill_id).values('visit_id'))
+
+
+# Content-addressed file references (emr/blobs.py)
+
+@receiver(post_save, sender=VisitAttachment)
+def retain_attachment_file(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        blobs.attached([instance.file.name])
+
+
+@receiver(post_delete, sender=VisitAttachment)
+def release_attachment_file(sender, instance, **kwargs):
+    blobs.release([instance.file.name])
+
+
+@receiver(post_save, sender=Patient)
+def retain_registration_document(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    current = instance.registration_document.name or None
+    previous = None if created else instance._previous_document
+    if current != previous:
+        blobs.attached([current])
+        blobs.release([previous])
+
+
+@receiver(post_delete, sender=Patient)
+def release_registration_document(sender, instance, **kwargs):
+    blobs.release([instance.registration_document.name])
+
+
+# Revenue rollup (emr/revenue.py). Writes that land on an already closed day
+# recompute that day; writes to open days need nothing.
+
+@receiver(post_save, sender=Visit)
+@receiver(post_delete, sender=Visit)
+def refresh_visit_revenue(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    previous = getattr(instance, '_rollup_state', None)
+    revenue.refresh([instance.date, previous[0] if previous else None])
+
+
+@receiver(post_save, sender=VisitTreatment)
+@receiver(post_delete, sender=VisitTreatment)
+def refresh_treatment_revenue(sender, instance, raw=False, **kwargs):
+    if not raw:
+        revenue.refresh(Visit.objects.filter(pk=instance.visit_id).values_list('date', flat=True))
+
+
+@receiver(post_delete, sender=Payment)
+def refresh_payment_revenue(sender, instance, **kwargs):
+    # New payments are always dated today, so only deletes reach closed days
+    revenue.refresh([timezone.localdate(instance.date)])
@@ -0,0 +1,117 @@
+from django.core.exceptions import FieldDoesNotExist
+from rest_framework import serializers
+
+
+def _split(names):
+    # ['id', 'bill.balance'] -> {'id': [], 'bill': ['balance']}
+    tree = {}
+    for name in names or ():
+        head, _, rest = name.strip().partition('.')
+        if head:
+            tree.setdefault(head, [])
+            if rest:
+                tree[head].append(rest)
+    return tree
+
+
+def _serializer(field):
+    # The serializer behind a nested field, unwrapping many=True
+    if isinstance(field, serializers.ListSerializer):
+        field = field.child
+    return field if isinstance(field, SparseFieldsMixin) else None
+
+
+class SparseFieldsMixin:
+    """
+    Lets callers choose which fields a serializer renders.
+
+    `fields` keeps only the named fields, `expand` adds fields left out of
+    the compact shape, and `compact=True` renders Meta.compact_fields only.
+    Names may be dotted (`bill.payments`) to reach into nested serializers,
+    and `expand=*` expands everything. Write-only fields are never removed.
+    """
+
+    def __init__(self, *args, fields=None, expand=None, compact=False, **kwargs):
+        super().__init__(*args, **kwargs)
+        if fields is not None or expand or compact:
+            self.restrict(fields, expand, compact)
+
+    def restrict(self, fields=None, expand=None, compact=False):
+        wanted = _split(fields) if fields is not None else None
+        expanded = _split(expand)
+        everything = '*' in expanded
+        compact_fields = getattr(self.Meta, 'compact_fields', None)
+
+        for name, field in list(self.fields.items()):
+            if field.write_only:
+                continue
+            if wanted is not None:
+                keep = name in wanted
+            elif compact and compact_fields is not None:
+                keep = name in compact_fields or name in expanded or everything
+            else:
+                keep = True
+            if not keep:
+                self.fields.pop(name)
+                continue
+
+            nested = _serializer(field)
+            if nested is None:
+                continue
+            sub_fields = wanted.get(name) if wanted is not None else None
+            sub_expand = ['*'] if everything else expanded.get(name, [])
+            # Naming a nested field in `expand` renders it in full
+            sub_compact = compact and name not in expanded and not sub_fields
+            nested.restrict(sub_fields or None, sub_expand, sub_compact)
+
+    def model_columns(self, prefix=''):
+        """
+        Names for QuerySet.only() covering every rendered field, including
+        those of nested serializers over single-valued relations (which the
+        view must select_related under the same names).
+        """
+        model = self.Meta.model
+        columns = [prefix + model._meta.pk.name]
+        for field in self.fields.values():
+            if field.write_only or field.source == '*':
+                continue
+            name = field.source.split('.')[0]
+            try:
+                model_field = model._meta.get_field(name)
+            except FieldDoesNotExist:
+                continue
+            nested = _serializer(field)
+            if nested is not None:
+                if not model_field.many_to_many and not model_field.one_to_many:
+                    columns.extend(nested.model_columns(prefix + name + '__'))
+            elif model_field.concrete:
+                columns.append(prefix + name)
+        return list(dict.fromkeys(columns))
+
+
+def sparse_options(params, compact=False):
+    """
+    Serializer kwargs for the ?fields= and ?expand= in `params`. `compact`
+    asks for the compact shape unless ?fields= names something specific.
+    """
+    fields = params.get('fields')
+    fields = [name for name in fields.split(',') if name] if fields is not None else None
+    expand = [name for name in params.get('expand', '').split(',') if name]
+    return {'fields': fields, 'expand': expand, 'compact': compact and fields is None}
+
+
+class SparseFieldsViewMixin:
+    """
+    Reads ?fields= and ?expand= for GET requests and passes them to the
+    serializer. Actions in `compact_actions` render the compact shape unless
+    ?fields= asks for something specific.
+    """
+    compact_actions = ('list',)
+
+    def get_serializer(self, *args, **kwargs):
+        if self.request is not None and self.request.method == 'GET':
+            kwargs.update(self.sparse_options())
+        return super().get_serializer(*args, **kwargs)
+
+    def sparse_options(self):
+        return sparse_options(self.request.query_params, self.action in self.compact_actions)
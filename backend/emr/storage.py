@@ -0,0 +1,45 @@
+import hashlib
+import os
+
+from django.core.files.storage import FileSystemStorage
+from django.utils.deconstruct import deconstructible
+
+CAS_PREFIX = 'cas'
+
+
+def content_name(digest, ext=''):
+    # cas/ab/abcdef....png: fan out by the first byte to keep directories small
+    return f'{CAS_PREFIX}/{digest[:2]}/{digest}{ext}'
+
+
+def is_content_name(name):
+    return bool(name) and name.startswith(CAS_PREFIX + '/')
+
+
+@deconstructible
+class ContentAddressedStorage(FileSystemStorage):
+    """
+    Stores each file under the SHA-256 of its contents instead of its upload
+    name, so the same scan uploaded twice is written to disk once. Reference
+    counts live in StoredFile (see emr/blobs.py).
+    """
+
+    def save(self, name, content, max_length=None):
+        if name is None:
+            name = content.name
+        hasher = hashlib.sha256()
+        if hasattr(content, 'seek'):
+            content.seek(0)
+        for chunk in content.chunks():
+            hasher.update(chunk)
+        if hasattr(content, 'seek'):
+            content.seek(0)
+
+        ext = os.path.splitext(name)[1].lower()[:10]
+        name = content_name(hasher.hexdigest(), ext)
+        if not self.exists(name):
+            name = self._save(name, content)
+        return name
+
+
+content_store = ContentAddressedStorage()
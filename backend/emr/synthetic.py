@@ -0,0 +1,278 @@
+"""
+Synthetic clinic data for load tests and benchmarks.
+
+Rows are generated from a seeded RNG and inserted in bulk, a batch of
+patients (and all their visits, treatments, bills and payments) per
+transaction. Signals do not fire for bulk inserts, so the derived tables
+(name index, DailyStats, revenue rollup) are rebuilt once at the end.
+"""
+import datetime
+import random
+from collections import Counter
+from decimal import Decimal
+
+from django.core.management.color import no_style
+from django.db import connection, models, transaction
+from django.db.models import Max
+from django.utils import timezone
+
+from .models import Bill, Patient, Payment, Treatment, Visit, VisitTreatment, normalize_mobile
+from .importer import import_rows
+from . import revenue, rollups, search, sequences
+
+FIRST_NAMES = (
+    'Aarav', 'Aditi', 'Anil', 'Anjali', 'Arjun', 'Bhavana', 'Chandra', 'Deepa', 'Divya', 'Ganesh',
+    'Gita', 'Hari', 'Indira', 'Kavya', 'Kiran', 'Krishna', 'Lakshmi', 'Madhavi', 'Mahesh', 'Meena',
+    'Mohan', 'Nandini', 'Naveen', 'Padma', 'Pooja', 'Prakash', 'Priya', 'Rahul', 'Rajesh', 'Ramesh',
+    'Ravi', 'Rekha', 'Sandeep', 'Sarita', 'Shankar', 'Sita', 'Srinivas', 'Suresh', 'Swathi', 'Uma',
+    'Venkat', 'Vijay', 'Vinod', 'Yamini',
+)
+LAST_NAMES = (
+    'Reddy', 'Rao', 'Sharma', 'Naidu', 'Kumar', 'Iyer', 'Menon', 'Nair', 'Pillai', 'Varma',
+    'Gupta', 'Patel', 'Das', 'Chowdary', 'Shetty', 'Joshi', 'Kulkarni', 'Yadav', 'Goud', 'Murthy',
+)
+CITIES = ('Hyderabad', 'Secunderabad', 'Warangal', 'Vijayawada', 'Guntur', 'Nellore', 'Karimnagar', 'Khammam')
+DOCTORS = ('Dr. Anitha Rao', 'Dr. Suresh Menon', 'Dr. Kavitha Nair', 'Dr. Prasad Varma', 'Dr. Farah Khan')
+COMPLAINTS = (
+    'Lower back pain', 'Joint pain in both knees', 'Chronic headache', 'Stiff neck', 'Insomnia',
+    'Digestive issues', 'Skin rash', 'Fatigue', 'Weight gain', 'Sinus congestion',
+)
+DIAGNOSES = (
+    'Lumbar spondylosis', 'Osteoarthritis', 'Migraine', 'Cervical spondylosis', 'Anxiety',
+    'Irritable bowel syndrome', 'Eczema', 'Hypothyroidism', 'Obesity', 'Chronic sinusitis',
+)
+BLOOD_GROUPS = ('A+', 'A-', 'B+', 'B-', 'AB+', 'AB-', 'O+', 'O-')
+FEES = (Decimal('0.00'), Decimal('300.00'), Decimal('500.00'))
+PAYMENT_MODES = ('cash', 'cash', 'upi', 'upi', 'card', 'online')
+
+# Used when the database has no treatments yet
+TREATMENTS = (
+    ('Abhyangam', 1200), ('Shirodhara', 2500), ('Kizhi', 1800), ('Nasyam', 800),
+    ('Vasti', 2000), ('Pizhichil', 3500), ('Udwarthanam', 1500), ('Thalapothichil', 1500),
+)
+
+
+class _Table:
+    """
+    Rows for one model as plain tuples with explicit ids, written with one
+    executemany per flush. Skips model instances and the ORM's per-value
+    preparation, which dominate bulk_create at these volumes. Columns not
+    given to add() take their field default, or now() for auto_now(_add).
+    """
+
+    def __init__(self, model, now):
+        self.fields = model._meta.concrete_fields
+        ops = connection.ops
+        self.defaults = {}
+        self.adapters = []
+        for field in self.fields:
+            if isinstance(field, models.DateTimeField):
+                self.adapters.append(ops.adapt_datetimefield_value)
+            elif isinstance(field, models.DateField):
+                self.adapters.append(ops.adapt_datefield_value)
+            else:
+                self.adapters.append(None)
+            if getattr(field, 'auto_now', False) or getattr(field, 'auto_now_add', False):
+                self.defaults[field.attname] = now
+            elif not field.primary_key:
+                self.defaults[field.attname] = field.get_default()
+        self.sql = 'INSERT INTO %s (%s) VALUES (%s)' % (
+            ops.quote_name(model._meta.db_table),
+            ', '.join(ops.quote_name(field.column) for field in self.fields),
+            ', '.join(['%s'] * len(self.fields)),
+        )
+        self.model = model
+        self.next_id = (model.objects.aggregate(last=Max('pk'))['last'] or 0) + 1
+        self.rows = []
+
+    def add(self, **values):
+        pk = values['id'] = self.next_id
+        self.next_id += 1
+        defaults = self.defaults
+        row = []
+        for field, adapt in zip(self.fields, self.adapters):
+            value = values[field.attname] if field.attname in values else defaults[field.attname]
+            row.append(adapt(value) if adapt is not None and value is not None else value)
+        self.rows.append(row)
+        return pk
+
+    def flush(self):
+        count = len(self.rows)
+        if count:
+            with connection.cursor() as cursor:
+                cursor.executemany(self.sql, self.rows)
+            self.rows = []
+        return count
+
+
+def _treatments():
+    catalog = list(Treatment.objects.values_list('id', 'price'))
+    if not catalog:
+        import_rows('treatments', [
+            {'title': title, 'price': price, 'description': f"{title} therapy."} for title, price in TREATMENTS
+        ])
+        catalog = list(Treatment.objects.values_list('id', 'price'))
+    return catalog
+
+
+class Generator:
+    def __init__(self, days, seed, start_number):
+        self.rng = random.Random(seed)
+        self.now = timezone.now()
+        self.today = timezone.localdate()
+        self.first_day = self.today - datetime.timedelta(days=days - 1)
+        self.treatments = _treatments()
+        self.number = start_number
+        self.tables = {model: _Table(model, self.now) for model in (Patient, Visit, VisitTreatment, Bill, Payment)}
+        self.counts = Counter()
+
+    def at(self, day):
+        # A time during clinic hours on `day`, never in the future
+        moment = timezone.make_aware(datetime.datetime.combine(day, datetime.time(9)) +
+                                     datetime.timedelta(minutes=self.rng.randrange(10 * 60)))
+        return min(moment, self.now)
+
+    def patient(self):
+        rng = self.rng
+        self.number += 1
+        mobile = f'9{rng.randrange(10 ** 9):09d}'
+        reg_no = f'SYN-{self.number:07d}'
+        first_visit_date = self.first_day + datetime.timedelta(days=rng.randrange((self.today - self.first_day).days + 1))
+        pk = self.tables[Patient].add(
+            name=f'{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}',
+            mobile=mobile,
+            alt_mobile=f'8{rng.randrange(10 ** 9):09d}' if rng.random() < 0.2 else None,
+            age=rng.randint(1, 90),
+            sex=rng.choices(('Male', 'Female', 'Other'), weights=(49, 49, 2))[0],
+            address=f'{rng.randint(1, 999)}, Street {rng.randint(1, 60)}, {rng.choice(CITIES)}',
+            reg_no=reg_no,
+            first_visit_date=first_visit_date,
+            blood_group=rng.choice(BLOOD_GROUPS) if rng.random() < 0.6 else None,
+            registration_document=None,
+            mobile_digits=normalize_mobile(mobile),
+            reg_no_key=reg_no.upper(),
+        )
+        return pk, first_visit_date
+
+    def visit(self, patient_id, day):
+        rng = self.rng
+        status = rng.choice(('booked', 'in_progress', 'completed')) if day == self.today else 'completed'
+        fee = rng.choice(FEES)
+        lines = [
+            (treatment_id, rng.randint(1, 5), price)
+            for treatment_id, price in rng.sample(self.treatments, min(len(self.treatments), rng.choice((0, 0, 1, 1, 2))))
+        ]
+        total = fee + sum((sittings * price for _, sittings, price in lines), Decimal('0.00'))
+        created_at = self.at(day)
+        bill_total, paid, payments = self.bill(total, day) if total > 0 and status != 'booked' else (None, 0, [])
+
+        visit_id = self.tables[Visit].add(
+            patient_id=patient_id,
+            date=day,
+            doctor_name=rng.choice(DOCTORS),
+            clinical_history=rng.choice(COMPLAINTS),
+            # Some visits are still waiting for their report
+            diagnosis='' if status != 'completed' or rng.random() < 0.05 else rng.choice(DIAGNOSES),
+            investigations='CBC, ESR' if rng.random() < 0.2 else '',
+            status=status,
+            consultation_fee=fee,
+            is_paid=status != 'booked',
+            total_amount=total,
+            amount_paid=paid,
+            created_at=created_at,
+        )
+        for treatment_id, sittings, price in lines:
+            self.tables[VisitTreatment].add(visit_id=visit_id, treatment_id=treatment_id, sittings=sittings, cost_per_sitting=price)
+        if bill_total is not None:
+            balance = bill_total - paid
+            bill_id = self.tables[Bill].add(
+                visit_id=visit_id,
+                bill_number=None, # Numbered per year when the batch is written
+                grand_total=bill_total,
+                total_paid=paid,
+                balance=balance,
+                status='paid' if balance <= 0 else ('partially_paid' if paid > 0 else 'unpaid'),
+                created_at=created_at,
+            )
+            self.bill_years.append((day.year, bill_id))
+            for amount, mode, date in payments:
+                self.tables[Payment].add(bill_id=bill_id, amount=amount, mode=mode, date=date, received_by_id=None)
+
+    def bill(self, total, day):
+        # Mostly settled bills, some part paid, some not paid at all
+        rng = self.rng
+        roll = rng.random()
+        if roll < 0.1:
+            paid = Decimal('0.00')
+        elif roll < 0.8:
+            paid = total
+        else:
+            paid = (total * rng.randint(2, 8) / 10).quantize(Decimal('0.01'))
+        first = paid if rng.random() < 0.7 else (paid / 2).quantize(Decimal('0.01'))
+        parts = [first] if first == paid else [first, paid - first]
+        payments = [
+            (amount, rng.choice(PAYMENT_MODES), self.at(min(day + datetime.timedelta(days=i * rng.randint(0, 14)), self.today)))
+            for i, amount in enumerate(parts) if amount > 0
+        ]
+        return total, paid, payments
+
+    def write_batch(self, patient_count, visit_count):
+        rng = self.rng
+        self.bill_years = []
+        patients = [self.patient() for _ in range(patient_count)]
+        # Every patient has their first visit; the rest are spread at random
+        for patient_id, first_visit_date in patients:
+            self.visit(patient_id, first_visit_date)
+        for _ in range(visit_count - patient_count):
+            patient_id, first_visit_date = rng.choice(patients)
+            self.visit(patient_id, first_visit_date + datetime.timedelta(
+                days=rng.randrange((self.today - first_visit_date).days + 1)
+            ))
+
+        # Bill numbers come from the same per-year sequences as live bills
+        bill_rows = {row[0]: row for row in self.tables[Bill].rows}
+        number_column = [field.attname for field in self.tables[Bill].fields].index('bill_number')
+        for year, count in Counter(year for year, _ in self.bill_years).items():
+            number = sequences.reserve(year, count)
+            for bill_year, bill_id in self.bill_years:
+                if bill_year == year:
+                    bill_rows[bill_id][number_column] = f'BILL-{year}-{number:04d}'
+                    number += 1
+
+        for model, table in self.tables.items():
+            self.counts[model._meta.verbose_name_plural] += table.flush()
+
+
+def seed(patients=1000, visits=5000, days=730, seed=0, batch_size=1000, progress=None):
+    """
+    Add `patients` patients with `visits` visits between them, dated over
+    the last `days` days, and return the number of rows written per table.
+    Registration numbers continue from earlier runs (SYN-0000001...).
+    """
+    visits = max(visits, patients)
+    start_number = Patient.objects.filter(reg_no__startswith='SYN-').count()
+    generator = Generator(days, seed, start_number)
+
+    written = 0
+    while written < patients:
+        count = min(batch_size, patients - written)
+        # Visits in proportion to this batch's share of the patients
+        visit_count = visits * (written + count) // patients - visits * written // patients
+        with transaction.atomic():
+            generator.write_batch(count, visit_count)
+        written += count
+        if progress:
+            progress(generator.counts)
+
+    # Explicit ids leave Postgres sequences behind; SQLite tracks the maximum itself
+    reset = connection.ops.sequence_reset_sql(no_style(), list(generator.tables))
+    if reset:
+        with connection.cursor() as cursor:
+            for sql in reset:
+                cursor.execute(sql)
+
+    search.rebuild_index()
+    rollups.rebuild()
+    revenue.reopen()
+    revenue.close()
+    return dict(generator.counts)
@@ -1,3 +1,1477 @@
-from django.test import TestCase
+import csv
+import datetime
+import gzip
+import hashlib
+import io
+import json
+from decimal import Decimal
+import threading
+from unittest import mock, skipUnless
 
-# Create your tests here.
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured, ValidationError as DjangoValidationError
+from django.db import IntegrityError, connection, transaction
+from django.db.models import F, Max, Sum
+from django.test import LiveServerTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from django.utils.translation import gettext_lazy
+from PIL import Image
+from rest_framework.test import APIClient
+
+from config import instrumentation, routers
+
+from .models import User, Patient, Visit, VisitAttachment, Treatment, VisitTreatment, Bill, Payment, DailyStats, BillSequence, StoredFile, Job, AttachmentUpload
+from . import benchmark, billing, blobs, checks, fastpath, jobs, receipts, revenue, rollups, sequences, synthetic, uploads
+from .catalog import catalog
+from .views import CustomTokenObtainPairSerializer
+
+
+def make_patient(n, **kwargs):
+    data = {
+        'name': f'Patient {n}',
+        'mobile': f'98480{n:05d}',
+        'age': 30,
+        'sex': 'Male',
+        'address': 'Hyderabad',
+        'reg_no': f'REG-{n:05d}',
+        'first_visit_date': datetime.date(2025, 1, 1),
+    }
+    data.update(kwargs)
+    return Patient.objects.create(**data)
+
+
+def make_full_visit(patient, user, treatment):
+    # A visit with every relation VisitSerializer renders
+    visit = Visit.objects.create(patient=patient, date=datetime.date(2025, 1, 1), doctor_name='Dr A')
+    VisitAttachment.objects.create(visit=visit, file=ContentFile(b'scan', name='scan.png'))
+    VisitTreatment.objects.create(visit=visit, treatment=treatment, sittings=2, cost_per_sitting=treatment.price)
+    bill = Bill.objects.create(visit=visit, grand_total=1000)
+    Payment.objects.create(bill=bill, amount=200, received_by=user)
+    Payment.objects.create(bill=bill, amount=300, received_by=user)
+    return visit
+
+
+# Reads stay on the primary unless a test opts in to the replica
+@override_settings(REPLICA_DATABASE=None)
+class APITestCase(TestCase):
+    def setUp(self):
+        # Process-level caches outlive the per-test rollback
+        cache.clear()
+        self.user = User.objects.create_user(
+            username='reception', email='reception@example.com', password='pass', role='reception'
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def count_queries(self, method, url, data=None):
+        with CaptureQueriesContext(connection) as ctx:
+            res = getattr(self.client, method)(url, data, format='json')
+        self.assertLess(res.status_code, 400, res.content)
+        return len(ctx.captured_queries)
+
+
+class PaginationTests(APITestCase):
+    def test_patients_are_paged_by_cursor(self):
+        for n in range(5):
+            make_patient(n)
+
+        res = self.client.get('/api/patients/?pageSize=2')
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual([p['regNo'] for p in res.data['results']], ['REG-00004', 'REG-00003'])
+
+        seen = []
+        url = '/api/patients/?pageSize=2'
+        while url:
+            res = self.client.get(url)
+            seen += [p['regNo'] for p in res.data['results']]
+            url = res.data['next']
+        self.assertEqual(seen, [f'REG-{n:05d}' for n in range(4, -1, -1)])
+
+    def test_visits_ordered_by_date_then_id(self):
+        patient = make_patient(1)
+        day = datetime.date(2025, 1, 1)
+        first = Visit.objects.create(patient=patient, date=day, doctor_name='Dr A')
+        second = Visit.objects.create(patient=patient, date=day, doctor_name='Dr A')
+        later = Visit.objects.create(patient=patient, date=day + datetime.timedelta(days=1), doctor_name='Dr A')
+
+        res = self.client.get(f'/api/visits/?patientId={patient.id}&pageSize=2')
+        self.assertEqual([v['id'] for v in res.data['results']], [later.id, second.id])
+        res = self.client.get(res.data['next'])
+        self.assertEqual([v['id'] for v in res.data['results']], [first.id])
+        self.assertIsNone(res.data['next'])
+
+    def test_visits_on_one_date_are_paged_by_keyset(self):
+        # More visits on a single date than DRF's offset cutoff would allow
+        patient = make_patient(1)
+        day = datetime.date(2025, 1, 1)
+        Visit.objects.bulk_create([Visit(patient=patient, date=day, doctor_name='Dr A') for _ in range(1205)])
+        expected = list(Visit.objects.order_by('-id').values_list('id', flat=True))
+
+        seen, pages = [], []
+        url = '/api/visits/?pageSize=200&fields=id'
+        while url:
+            with CaptureQueriesContext(connection) as ctx:
+                res = self.client.get(url)
+            self.assertEqual(res.status_code, 200)
+            pages.append(ctx.captured_queries[-1]['sql'])
+            seen += [v['id'] for v in res.data['results']]
+            url = res.data['next']
+        self.assertEqual(seen, expected)
+        self.assertFalse(any('OFFSET' in sql for sql in pages))
+
+        # And back again
+        res = self.client.get(res.data['previous'])
+        self.assertEqual([v['id'] for v in res.data['results']], expected[-205:-5])
+        self.assertEqual(self.client.get('/api/visits/?cursor=bogus').status_code, 404)
+
+
+@override_settings(MEDIA_ROOT='/tmp/emr-test-media')
+class QueryBudgetTests(APITestCase):
+    # Maximum number of queries each endpoint may issue, independent of how
+    # many rows it returns. Raise a budget only together with the code that
+    # needs it.
+    BUDGETS = {
+        'patient-list': 2, # version check + page
+        'visit-list': 5,
+        'visit-detail': 5,
+    }
+
+    def setUp(self):
+        super().setUp()
+        self.treatment = Treatment.objects.create(title='Abhyangam', description='Oil massage', price=1200)
+        self.patient = make_patient(1)
+        catalog.serialized() # Measure with a warm catalog
+
+    def seed(self, count):
+        for _ in range(count):
+            make_full_visit(self.patient, self.user, self.treatment)
+
+    def assertWithinBudget(self, name, method, url, data=None):
+        used = self.count_queries(method, url, data)
+        self.assertLessEqual(used, self.BUDGETS[name], f'{name} used {used} queries')
+        return used
+
+    def test_patient_list(self):
+        for n in range(2, 12):
+            make_patient(n)
+        self.assertWithinBudget('patient-list', 'get', '/api/patients/')
+
+    def test_visit_list_is_constant(self):
+        self.seed(1)
+        small = self.assertWithinBudget('visit-list', 'get', '/api/visits/')
+        self.seed(10)
+        large = self.assertWithinBudget('visit-list', 'get', f'/api/visits/?patientId={self.patient.id}')
+        self.assertEqual(small, large)
+
+    def test_visit_detail(self):
+        visit = make_full_visit(self.patient, self.user, self.treatment)
+        self.assertWithinBudget('visit-detail', 'get', f'/api/visits/{visit.id}/')
+
+
+class PatientSearchTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        self.ramesh = make_patient(1, name='Ramesh Kumar', mobile='+91 98480-11111', reg_no='SD-2025-101')
+        self.suresh = make_patient(2, name='Suresh Rao', mobile='9000022222', reg_no='SD-2025-202')
+        self.kumari = make_patient(3, name='Kumari Devi', mobile='9848033333', reg_no='SD-2024-303')
+
+    def search(self, query):
+        res = self.client.get('/api/patients/', {'search': query})
+        self.assertEqual(res.status_code, 200)
+        return [p['id'] for p in res.data['results']]
+
+    def test_name_prefix_tokens(self):
+        self.assertEqual(self.search('ram'), [self.ramesh.id])
+        self.assertEqual(self.search('kum ram'), [self.ramesh.id])
+        self.assertEqual(set(self.search('kum')), {self.ramesh.id, self.kumari.id})
+
+    def test_mobile_is_normalized(self):
+        self.assertEqual(self.search('98480 11111'), [self.ramesh.id])
+        self.assertEqual(set(self.search('98480')), {self.ramesh.id, self.kumari.id})
+
+    def test_reg_no_prefix_ranks_first(self):
+        self.assertEqual(self.search('sd-2025-2'), [self.suresh.id])
+        self.assertEqual(self.search('SD-2025'), [self.ramesh.id, self.suresh.id])
+
+    def test_index_follows_writes(self):
+        self.suresh.name = 'Mahesh Rao'
+        self.suresh.save()
+        self.assertEqual(self.search('mahesh'), [self.suresh.id])
+        self.assertEqual(self.search('suresh'), [])
+        self.suresh.delete()
+        self.assertEqual(self.search('mahesh'), [])
+
+
+class DailyStatsTests(APITestCase):
+    def stats(self, **params):
+        res = self.client.get('/api/dashboard/stats/', params)
+        self.assertEqual(res.status_code, 200)
+        return {s['name']: int(s['value']) for s in res.data['stats']}, res.data['chartData']
+
+    def test_rollup_tracks_writes(self):
+        today = timezone.localdate()
+        yesterday = today - datetime.timedelta(days=1)
+        patient = make_patient(1, first_visit_date=today)
+        visit = Visit.objects.create(patient=patient, date=today, doctor_name='Dr A')
+        Visit.objects.create(patient=patient, date=yesterday, doctor_name='Dr A', diagnosis='Vata')
+
+        stats, chart = self.stats()
+        self.assertEqual(stats, {'Total Patients': 1, 'Visits Today': 1, 'New Registrations': 1, 'Pending Reports': 1})
+        self.assertEqual([d['visits'] for d in chart[-2:]], [1, 1])
+
+        visit.diagnosis = 'Pitta'
+        visit.date = yesterday
+        visit.save()
+        stats, chart = self.stats()
+        self.assertEqual(stats['Visits Today'], 0)
+        self.assertEqual(stats['Pending Reports'], 0)
+        self.assertEqual([d['visits'] for d in chart[-2:]], [2, 0])
+
+        patient.delete()
+        stats, chart = self.stats(days=30)
+        self.assertEqual(len(chart), 30)
+        self.assertEqual(sum(d['visits'] for d in chart), 0)
+        self.assertEqual(stats['Total Patients'], 0)
+
+    def test_rebuild_matches_incremental(self):
+        today = timezone.localdate()
+        for n in range(3):
+            patient = make_patient(n, first_visit_date=today - datetime.timedelta(days=n))
+            Visit.objects.create(patient=patient, date=today - datetime.timedelta(days=n), doctor_name='Dr A')
+        before = list(DailyStats.objects.order_by('date').values('date', 'visits', 'new_patients', 'pending_reports'))
+        rollups.rebuild()
+        after = list(DailyStats.objects.order_by('date').values('date', 'visits', 'new_patients', 'pending_reports'))
+        self.assertEqual(before, after)
+
+    def test_dashboard_query_count(self):
+        self.assertEqual(self.count_queries('get', '/api/dashboard/stats/?days=90'), 2)
+
+
+class BillNumberTests(TransactionTestCase):
+    THREADS = 8
+    PER_THREAD = 10
+
+    def create_bills(self, allocator):
+        patient = make_patient(1)
+        errors = []
+
+        def worker():
+            try:
+                for _ in range(self.PER_THREAD):
+                    visit = Visit.objects.create(patient=patient, date=datetime.date(2025, 1, 1), doctor_name='Dr A')
+                    Bill.objects.create(visit=visit)
+            except Exception as e: # pragma: no cover - reported below
+                errors.append(e)
+            finally:
+                connection.close()
+
+        with mock.patch.object(sequences, 'allocator', allocator):
+            threads = [threading.Thread(target=worker) for _ in range(self.THREADS)]
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+        self.assertEqual(errors, [])
+        return [int(n.rsplit('-', 1)[1]) for n in Bill.objects.values_list('bill_number', flat=True)]
+
+    def assertGapFree(self, numbers):
+        total = self.THREADS * self.PER_THREAD
+        self.assertEqual(len(numbers), total)
+        self.assertEqual(sorted(numbers), list(range(1, total + 1)))
+
+    def test_concurrent_bills_unique_and_gap_free(self):
+        self.assertGapFree(self.create_bills(sequences.BlockAllocator(1)))
+
+    def test_block_reservation(self):
+        self.assertGapFree(self.create_bills(sequences.BlockAllocator(16)))
+        # One reservation per block rather than per bill
+        self.assertEqual(BillSequence.objects.get().last_value, 80)
+
+    def test_block_dropped_when_reservation_rolls_back(self):
+        allocator = sequences.BlockAllocator(4)
+        with self.assertRaises(RuntimeError), transaction.atomic():
+            self.assertEqual(allocator.next(2025), 1)
+            raise RuntimeError
+        # The counter went back to 0, so the cached 2..4 must not be handed out
+        numbers = [allocator.next(2025) for _ in range(6)]
+        self.assertEqual(numbers, [1, 2, 3, 4, 5, 6])
+        self.assertEqual(BillSequence.objects.get().last_value, 8)
+
+
+class PaymentLedgerTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        self.visit = Visit.objects.create(
+            patient=make_patient(1), date=datetime.date(2025, 1, 1), doctor_name='Dr A', total_amount=1000
+        )
+
+    def pay(self, amount):
+        res = self.client.post(f'/api/visits/{self.visit.id}/add_payment/', {'amount': amount, 'mode': 'upi'}, format='json')
+        self.assertEqual(res.status_code, 200, res.content)
+
+    def test_totals_and_status(self):
+        self.pay('250.50')
+        bill = Bill.objects.get(visit=self.visit)
+        self.assertEqual((bill.total_paid, bill.balance, bill.status), (Decimal('250.50'), Decimal('749.50'), 'partially_paid'))
+        self.pay(749.5)
+        bill.refresh_from_db()
+        self.assertEqual((bill.total_paid, bill.balance, bill.status), (Decimal('1000.00'), Decimal('0.00'), 'paid'))
+        self.visit.refresh_from_db()
+        self.assertEqual(self.visit.amount_paid, Decimal('1000.00'))
+
+        res = self.client.get(f'/api/visits/{self.visit.id}/')
+        self.assertEqual(res.data['bill']['totalPaid'], '1000.00')
+        self.assertEqual(res.data['bill']['balance'], '0.00')
+
+    def test_grand_total_change_recomputes_balance(self):
+        self.pay(400)
+        res = self.client.patch(f'/api/visits/{self.visit.id}/', {'totalAmount': '400.00'}, format='json')
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.data['bill']['status'], 'paid')
+        self.assertEqual(res.data['bill']['balance'], '0.00')
+
+    def test_fractional_amounts_settle_the_bill(self):
+        res = self.client.patch(f'/api/visits/{self.visit.id}/', {'totalAmount': '300.30'}, format='json')
+        self.assertEqual(res.status_code, 200)
+        self.pay('100.10')
+        self.pay('200.20')
+        bill = Bill.objects.get(visit=self.visit)
+        self.assertEqual((bill.total_paid, bill.balance, bill.status), (Decimal('300.30'), Decimal('0.00'), 'paid'))
+        self.assertFalse(Bill.objects.filter(pk=bill.pk, balance__gt=0).exists())
+        self.assertFalse(Bill.objects.filter(pk=bill.pk, total_paid__lt=F('grand_total')).exists())
+
+    def test_invalid_amount(self):
+        res = self.client.post(f'/api/visits/{self.visit.id}/add_payment/', {'amount': 'abc'}, format='json')
+        self.assertEqual(res.status_code, 400)
+
+    def test_parse_amount(self):
+        self.assertEqual(billing.parse_amount('12.346'), Decimal('12.35'))
+        self.assertEqual(billing.parse_amount(99999999.99), Decimal('99999999.99'))
+        for value in ('NaN', 'sNaN', 'Infinity', '-inf', '0', '-5', '0.00', '0.004', '1e8', '99999999.995', '1e9', '1e30'):
+            with self.subTest(value=value), self.assertRaises(ValueError):
+                billing.parse_amount(value)
+        res = self.client.post(f'/api/visits/{self.visit.id}/add_payment/', {'amount': 'NaN'}, format='json')
+        self.assertEqual(res.status_code, 400)
+        self.assertFalse(Payment.objects.exists())
+
+    def test_payment_query_count_is_constant(self):
+        self.pay(10)
+        first = self.count_queries('post', f'/api/visits/{self.visit.id}/add_payment/', {'amount': 10})
+        for _ in range(5):
+            self.pay(10)
+        self.assertEqual(self.count_queries('post', f'/api/visits/{self.visit.id}/add_payment/', {'amount': 10}), first)
+
+
+class BatchTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        self.treatment = Treatment.objects.create(title='Shirodhara', description='Oil pouring', price=2500)
+
+    def batch(self, *operations):
+        return self.client.post('/api/batch/', {'operations': list(operations)}, format='json')
+
+    def test_checkout_in_one_request(self):
+        res = self.batch(
+            {'op': 'create_patient', 'data': {'name': 'Ravi Teja', 'mobile': '9848012345', 'age': 40, 'sex': 'Male',
+                                              'address': 'Guntur', 'regNo': 'SD-2025-901', 'firstVisitDate': '2025-01-01'}},
+            {'op': 'create_visit', 'data': {'patientId': '$0.id', 'date': '2025-01-01', 'doctorName': 'Dr A'}},
+            {'op': 'update_visit', 'id': '$1.id', 'data': {
+                'visit_treatments': [{'treatmentId': self.treatment.id, 'sittings': 2}], 'totalAmount': '5000.00'}},
+            {'op': 'add_payment', 'id': '$1.id', 'data': {'amount': '1000', 'mode': 'upi'}},
+            {'op': 'add_payment', 'id': '$1.id', 'data': {'amount': 500}},
+            {'op': 'get_visit', 'id': '$2.id'},
+        )
+        self.assertEqual(res.status_code, 200, res.content)
+        results = res.data['results']
+        self.assertEqual([r['status'] for r in results], [201, 201, 200, 200, 200, 200])
+        visit = results[-1]['data']
+        self.assertEqual(visit['patientId'], results[0]['data']['id'])
+        self.assertEqual(len(visit['treatments']), 1)
+        self.assertEqual((visit['bill']['totalPaid'], visit['bill']['balance']), ('1500.00', '3500.00'))
+        self.assertEqual([p['mode'] for p in visit['bill']['payments']], ['upi', 'cash'])
+        # One receipt for the bill, not one per write
+        self.assertEqual(Job.objects.filter(name='render_receipt').count(), 1)
+
+    def test_failure_rolls_back_everything(self):
+        res = self.batch(
+            {'op': 'create_patient', 'data': {'name': 'Ravi Teja', 'mobile': '9848012345', 'age': 40, 'sex': 'Male',
+                                              'address': 'Guntur', 'regNo': 'SD-2025-901', 'firstVisitDate': '2025-01-01'}},
+            {'op': 'create_visit', 'data': {'patientId': '$0.id', 'date': '2025-01-01', 'doctorName': 'Dr A'}},
+            {'op': 'add_payment', 'id': '$1.id', 'data': {'amount': 'abc'}},
+        )
+        self.assertEqual(res.status_code, 400)
+        self.assertEqual((res.data['index'], res.data['op']), (2, 'add_payment'))
+        self.assertFalse(Patient.objects.exists())
+        self.assertFalse(Visit.objects.exists())
+
+        res = self.batch({'op': 'create_visit', 'data': {'date': '2025-01-01'}})
+        self.assertEqual(res.status_code, 400)
+        self.assertIn('doctorName', res.data['details'])
+
+    def test_bad_operations(self):
+        self.assertEqual(self.client.post('/api/batch/', {}, format='json').status_code, 400)
+        res = self.batch({'op': 'delete_everything'})
+        self.assertEqual((res.status_code, res.data['index']), (400, 0))
+        res = self.batch({'op': 'get_visit', 'id': '$1.id'}, {'op': 'get_visit', 'id': 1})
+        self.assertEqual(res.status_code, 400)
+        self.assertIn('has not run', res.data['error'])
+        self.assertEqual(self.batch({'op': 'get_visit', 'id': 99999}).status_code, 404)
+
+    def test_invalid_writes_are_400(self):
+        patient = {'name': 'Ravi Teja', 'mobile': '9848012345', 'age': 40, 'sex': 'Male', 'address': 'Guntur',
+                   'regNo': 'SD-2025-901', 'firstVisitDate': '2025-01-01'}
+        res = self.batch({'op': 'create_patient', 'data': patient}, {'op': 'create_patient', 'data': patient})
+        self.assertEqual((res.status_code, res.data['index']), (400, 1))
+        self.assertIn('regNo', res.data['details'])
+
+        visit = Visit.objects.create(patient=make_patient(1), date=datetime.date(2025, 1, 1), doctor_name='Dr A')
+        for amount in ('NaN', '1e9', '-1'):
+            res = self.batch({'op': 'add_payment', 'id': visit.id, 'data': {'amount': amount}})
+            self.assertEqual((res.status_code, res.data['op']), (400, 'add_payment'), amount)
+        self.assertFalse(Payment.objects.exists())
+
+        # Lost a race with a concurrent write
+        with mock.patch('emr.batch.record_payment', side_effect=IntegrityError('UNIQUE constraint failed')):
+            res = self.batch({'op': 'add_payment', 'id': visit.id, 'data': {'amount': '10'}})
+        self.assertEqual(res.status_code, 400)
+        self.assertIn('conflicts', res.data['error'])
+        with mock.patch('emr.batch.record_payment', side_effect=DjangoValidationError('bad amount')):
+            res = self.batch({'op': 'add_payment', 'id': visit.id, 'data': {'amount': '10'}})
+        self.assertEqual((res.status_code, res.data['details']), (400, ['bad amount']))
+
+
+@override_settings(MEDIA_ROOT='/tmp/emr-test-media')
+class PatientTimelineTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        self.treatment = Treatment.objects.create(title='Nasyam', description='Nasal oil', price=800)
+        self.patient = make_patient(1)
+        self.first = make_full_visit(self.patient, self.user, self.treatment)
+        # make_full_visit writes the payments directly; store the totals record_payment would
+        Bill.objects.filter(visit=self.first).update(total_paid=500, balance=500, status='partially_paid')
+        self.second = Visit.objects.create(patient=self.patient, date=datetime.date(2025, 2, 1), doctor_name='Dr B')
+        self.url = f'/api/patients/{self.patient.pk}/timeline/'
+
+    def timeline(self):
+        res = self.client.get(self.url)
+        self.assertEqual(res.status_code, 200, res.content)
+        return res.data
+
+    def test_payload(self):
+        data = self.timeline()
+        self.assertEqual(data['patient']['regNo'], self.patient.reg_no)
+        self.assertEqual([v['id'] for v in data['visits']], [self.second.id, self.first.id])
+        self.assertEqual(data['visits'][0], self.client.get(f'/api/visits/{self.second.id}/').data)
+        self.assertEqual(data['visits'][1]['bill']['totalPaid'], '500.00')
+        self.assertEqual(data['totals'], {'billed': '1000.00', 'paid': '500.00', 'outstanding': '500.00', 'bills': 1})
+        self.assertEqual(self.client.get('/api/patients/99999/timeline/').status_code, 404)
+        self.assertEqual(self.client.get('/api/patients/abc/timeline/').status_code, 404)
+
+    def test_queries_are_fixed_and_cached(self):
+        for n in range(3):
+            make_full_visit(self.patient, self.user, self.treatment)
+        catalog.get(self.treatment.pk)
+        # Patient, visits and bills, attachments, treatments, payments
+        self.assertEqual(self.count_queries('get', self.url), 5)
+        self.assertEqual(self.count_queries('get', self.url), 1)
+
+    def test_writes_invalidate(self):
+        self.timeline()
+        self.client.post(f'/api/visits/{self.first.id}/add_payment/', {'amount': 200}, format='json')
+        self.assertEqual(self.timeline()['totals']['paid'], '700.00')
+
+        self.client.patch(f'/api/visits/{self.second.id}/',
+                          {'visit_treatments': [{'treatmentId': self.treatment.id, 'sittings': 3}]}, format='json')
+        data = self.timeline()
+        self.assertEqual(len(data['visits'][0]['treatments']), 1)
+        self.assertEqual(data['totals']['bills'], 2)
+
+        VisitAttachment.objects.create(visit=self.second, file=ContentFile(b'xray', name='xray.png'))
+        self.assertEqual(len(self.timeline()['visits'][0]['attachments']), 1)
+
+        Payment.objects.filter(bill__visit=self.first).first().delete()
+        self.assertEqual(len(self.timeline()['visits'][1]['bill']['payments']), 2)
+
+        self.treatment.title = 'Nasya'
+        self.treatment.save()
+        self.assertEqual(self.timeline()['visits'][0]['treatments'][0]['treatment']['title'], 'Nasya')
+
+        self.first.delete()
+        self.assertEqual([v['id'] for v in self.timeline()['visits']], [self.second.id])
+
+
+class TreatmentSyncTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        self.treatments = [
+            Treatment.objects.create(title=f'Treatment {n}', description='', price=100 * (n + 1)) for n in range(10)
+        ]
+        self.visit = Visit.objects.create(patient=make_patient(1), date=datetime.date(2025, 1, 1), doctor_name='Dr A')
+
+    def sync(self, rows):
+        payload = {'visit_treatments': [{'treatmentId': str(t.id), 'sittings': s} for t, s in rows]}
+        return self.client.patch(f'/api/visits/{self.visit.id}/', payload, format='json')
+
+    def stored(self):
+        return sorted(self.visit.treatments.values_list('treatment_id', 'sittings'))
+
+    def test_diff_keeps_matching_rows(self):
+        a, b, c = self.treatments[:3]
+        self.assertEqual(self.sync([(a, 1), (b, 2)]).status_code, 200)
+        kept = self.visit.treatments.get(treatment=a).pk
+
+        res = self.sync([(a, 5), (c, 1), (c, 2)])
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(self.stored(), sorted([(a.id, 5), (c.id, 1), (c.id, 2)]))
+        self.assertEqual(self.visit.treatments.get(treatment=a).pk, kept)
+        self.assertEqual(len(res.data['treatments']), 3)
+
+    def test_sittings_below_one_are_invalid(self):
+        a = self.treatments[0]
+        self.sync([(a, 2)])
+        for sittings in (0, -1):
+            res = self.sync([(a, sittings)])
+            self.assertEqual(res.status_code, 400)
+            self.assertIn('visit_treatments', res.data)
+        res = self.client.post('/api/visits/', {
+            'patientId': self.visit.patient_id, 'date': '2025-01-02', 'doctorName': 'Dr A',
+            'visit_treatments': [{'treatmentId': a.id, 'sittings': 0}],
+        }, format='json')
+        self.assertEqual(res.status_code, 400)
+        self.assertEqual(self.stored(), [(a.id, 2)])
+        self.assertEqual(Visit.objects.count(), 1)
+
+    def test_unknown_treatment_rolls_back(self):
+        a = self.treatments[0]
+        self.sync([(a, 1)])
+        res = self.client.patch(
+            f'/api/visits/{self.visit.id}/',
+            {'diagnosis': 'Vata', 'visit_treatments': [{'treatmentId': 99999, 'sittings': 1}]},
+            format='json',
+        )
+        self.assertEqual(res.status_code, 400)
+        self.visit.refresh_from_db()
+        self.assertEqual(self.visit.diagnosis, '')
+        self.assertEqual(self.stored(), [(a.id, 1)])
+
+    def test_write_queries_do_not_grow_with_treatments(self):
+        def cost(count):
+            rows = [(t, 7) for t in self.treatments[:count]]
+            payload = {'visit_treatments': [{'treatmentId': t.id, 'sittings': s} for t, s in rows]}
+            self.client.patch(f'/api/visits/{self.visit.id}/', {'visit_treatments': []}, format='json')
+            with CaptureQueriesContext(connection) as ctx:
+                self.client.patch(f'/api/visits/{self.visit.id}/', payload, format='json')
+            return [q['sql'] for q in ctx.captured_queries if not q['sql'].startswith('SELECT')]
+
+        self.assertEqual(len(cost(2)), len(cost(10)))
+
+
+class TreatmentCatalogTests(APITestCase):
+    def test_reads_are_served_without_queries(self):
+        treatment = Treatment.objects.create(title='Nasyam', description='Nasal oil', price=800)
+        self.client.get('/api/treatments/')
+        self.assertEqual(self.count_queries('get', '/api/treatments/'), 0)
+        self.assertEqual(self.count_queries('get', f'/api/treatments/{treatment.id}/'), 0)
+
+    def test_writes_invalidate(self):
+        res = self.client.post('/api/treatments/', {'title': 'Vasti', 'description': 'Medicated enema', 'price': '2000.00'}, format='json')
+        tid = res.data['id']
+        self.assertEqual([t['title'] for t in self.client.get('/api/treatments/').data], ['Vasti'])
+
+        self.client.patch(f'/api/treatments/{tid}/', {'price': '2100.00'}, format='json')
+        self.assertEqual(self.client.get(f'/api/treatments/{tid}/').data['price'], '2100.00')
+
+        self.client.delete(f'/api/treatments/{tid}/')
+        self.assertEqual(self.client.get('/api/treatments/').data, [])
+        self.assertEqual(self.client.get(f'/api/treatments/{tid}/').status_code, 404)
+
+    def test_version_change_from_another_worker(self):
+        treatment = Treatment.objects.create(title='Kizhi', description='', price=1800)
+        self.assertEqual(catalog.get(treatment.id).price, 1800)
+        # Simulate a write made by another process: the row changes without
+        # this process's signal handlers, and only the shared version moves.
+        Treatment.objects.filter(pk=treatment.pk).update(price=1900)
+        self.assertEqual(catalog.get(treatment.id).price, 1800)
+        cache.delete('emr:treatment-catalog:version')
+        self.assertEqual(catalog.get(treatment.id).price, 1900)
+
+    def test_several_workers_need_a_shared_cache(self):
+        self.assertEqual(checks.cache_errors(), [])
+        with override_settings(WEB_CONCURRENCY=4):
+            self.assertEqual([e.id for e in checks.cache_errors()], ['emr.E001'])
+            with self.assertRaises(ImproperlyConfigured):
+                checks.require_shared_cache()
+            with override_settings(CACHES={'default': {
+                'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache', 'LOCATION': '/tmp/emr-test-cache',
+            }}):
+                self.assertEqual(checks.cache_errors(), [])
+
+
+class ConditionalGetTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        self.patient = make_patient(1)
+        self.visit = Visit.objects.create(patient=self.patient, date=datetime.date(2025, 1, 1), doctor_name='Dr A')
+
+    def revalidate(self, url):
+        first = self.client.get(url)
+        self.assertEqual(first.status_code, 200)
+        self.assertTrue(first['ETag'].startswith('W/"'))
+        return first['ETag']
+
+    def assertNotModified(self, url, etag):
+        with CaptureQueriesContext(connection) as ctx:
+            res = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(res.status_code, 304)
+        self.assertEqual(len(ctx.captured_queries), 1)
+
+    def assertModified(self, url, etag):
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_patient_detail(self):
+        url = f'/api/patients/{self.patient.id}/'
+        etag = self.revalidate(url)
+        self.assertNotModified(url, etag)
+        self.patient.address = 'Warangal'
+        self.patient.save()
+        self.assertModified(url, etag)
+
+    def test_visit_list_for_patient_follows_children(self):
+        url = f'/api/visits/?patientId={self.patient.id}'
+        etag = self.revalidate(url)
+        self.assertNotModified(url, etag)
+
+        self.client.post(f'/api/visits/{self.visit.id}/add_payment/', {'amount': 100}, format='json')
+        self.assertModified(url, etag)
+
+        etag = self.revalidate(url)
+        treatment = Treatment.objects.create(title='Nasyam', description='Nasal oil', price=800)
+        VisitTreatment.objects.create(visit=self.visit, treatment=treatment, cost_per_sitting=800)
+        self.assertModified(url, etag)
+
+    def test_visit_detail_and_list(self):
+        for url in (f'/api/visits/{self.visit.id}/', '/api/visits/', '/api/patients/'):
+            etag = self.revalidate(url)
+            self.assertNotModified(url, etag)
+        self.assertEqual(self.client.get('/api/visits/999/', HTTP_IF_NONE_MATCH='W/"x"').status_code, 404)
+        for url in ('/api/visits/abc/', '/api/patients/abc/'):
+            self.assertEqual(self.client.get(url).status_code, 404)
+
+    def test_unfiltered_lists_follow_deletes(self):
+        older = Visit.objects.create(patient=make_patient(2), date=datetime.date(2024, 1, 1), doctor_name='Dr A')
+        Visit.objects.filter(pk=older.pk).update(updated_at=timezone.now() - datetime.timedelta(days=1))
+        etags = {url: self.revalidate(url) for url in ('/api/visits/', '/api/patients/')}
+        # Neither delete moves the newest updated_at
+        older.delete()
+        self.assertModified('/api/visits/', etags['/api/visits/'])
+        Patient.objects.filter(pk=older.patient_id).update(updated_at=timezone.now() - datetime.timedelta(days=1))
+        etag = self.revalidate('/api/patients/')
+        Patient.objects.filter(pk=older.patient_id).delete()
+        self.assertModified('/api/patients/', etag)
+
+    def test_visit_reads_follow_the_catalog(self):
+        urls = (f'/api/visits/{self.visit.id}/', '/api/visits/', f'/api/visits/?patientId={self.patient.id}')
+        etags = {url: self.revalidate(url) for url in urls}
+        Treatment.objects.create(title='Nasyam', description='Nasal oil', price=800)
+        for url in urls:
+            self.assertModified(url, etags[url])
+
+
+@override_settings(MEDIA_ROOT='/tmp/emr-test-media', UPLOAD_TEMP_DIR='/tmp/emr-test-uploads')
+class ResumableUploadTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        self.visit = Visit.objects.create(patient=make_patient(1), date=datetime.date(2025, 1, 1), doctor_name='Dr A')
+        self.base = f'/api/visits/{self.visit.id}/uploads/'
+
+    def put(self, upload_id, offset, data):
+        return self.client.generic(
+            'PUT', f'{self.base}{upload_id}/', data, content_type='application/octet-stream', HTTP_UPLOAD_OFFSET=str(offset)
+        )
+
+    def test_chunked_upload_with_resume(self):
+        content = bytes(range(256)) * 1000
+        res = self.client.post(self.base, {'filename': 'MRI scan.pdf', 'size': len(content)}, format='json')
+        self.assertEqual(res.status_code, 201)
+        upload_id = res.data['id']
+
+        self.assertEqual(self.put(upload_id, 0, content[:100000]).data['offset'], 100000)
+        # A retried or out-of-order chunk is refused with the offset to resume from
+        res = self.put(upload_id, 0, content[:100000])
+        self.assertEqual((res.status_code, res.data['offset']), (409, 100000))
+        self.assertEqual(self.client.get(f'{self.base}{upload_id}/').data['offset'], 100000)
+
+        # Finalizing early is refused too
+        self.assertEqual(self.client.post(f'{self.base}{upload_id}/complete/').status_code, 409)
+
+        self.assertEqual(self.put(upload_id, 100000, content[100000:]).data['offset'], len(content))
+        res = self.client.post(
+            f'{self.base}{upload_id}/complete/', {'sha256': hashlib.sha256(content).hexdigest()}, format='json'
+        )
+        self.assertEqual(res.status_code, 200, res.data)
+        self.assertTrue(res.data['complete'])
+
+        attachment = self.visit.attachment_files.get()
+        with attachment.file.open('rb') as f:
+            self.assertEqual(f.read(), content)
+
+    def test_repeated_chunk_and_finalize(self):
+        res = self.client.post(self.base, {'filename': 'a.png', 'size': 3}, format='json')
+        upload = AttachmentUpload.objects.get(pk=res.data['id'])
+        self.assertEqual(self.put(upload.pk, 0, b'abc').data['offset'], 3)
+        # A request holding the upload as it was before the first one finished
+        stale = AttachmentUpload.objects.get(pk=upload.pk)
+        stale.offset = 0
+        with self.assertRaises(uploads.OffsetMismatch):
+            uploads.write_chunk(stale, 0, io.BytesIO(b'xyz'), 3)
+        with open(uploads.partial_path(upload), 'rb') as f:
+            self.assertEqual(f.read(), b'abc')
+
+        stale = AttachmentUpload.objects.get(pk=upload.pk)
+        attachment = uploads.finalize(upload)
+        self.assertEqual(uploads.finalize(stale), attachment)
+        self.assertEqual(self.client.post(f'{self.base}{upload.pk}/complete/').status_code, 200)
+        self.assertEqual(self.visit.attachment_files.count(), 1)
+
+    def test_checksum_mismatch(self):
+        res = self.client.post(self.base, {'filename': 'a.png', 'size': 3}, format='json')
+        self.put(res.data['id'], 0, b'abc')
+        res = self.client.post(f'{self.base}{res.data["id"]}/complete/', {'sha256': '0' * 64}, format='json')
+        self.assertEqual(res.status_code, 400)
+        self.assertFalse(self.visit.attachment_files.exists())
+
+
+@override_settings(MEDIA_ROOT='/tmp/emr-test-media')
+class ContentAddressedStorageTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        self.visit = Visit.objects.create(patient=make_patient(1), date=datetime.date(2025, 1, 1), doctor_name='Dr A')
+        buffer = io.BytesIO()
+        Image.new('RGB', (2000, 1000), 'orange').save(buffer, 'PNG')
+        self.png = buffer.getvalue()
+
+    def upload(self, name):
+        upload = SimpleUploadedFile(name, self.png, content_type='image/png')
+        res = self.client.post(f'/api/visits/{self.visit.id}/upload_attachment/', {'file': upload}, format='multipart')
+        self.assertEqual(res.status_code, 200)
+        jobs.run_pending()
+
+    def test_identical_files_are_stored_once(self):
+        self.upload('aadhar.png')
+        self.upload('aadhar (1).png')
+        first, second = self.visit.attachment_files.order_by('id')
+        self.assertEqual(first.file.name, second.file.name)
+        self.assertTrue(first.file.name.startswith('cas/'))
+        self.assertEqual(StoredFile.objects.get(name=first.file.name).ref_count, 2)
+
+        name = first.file.name
+        with self.captureOnCommitCallbacks(execute=True):
+            first.delete()
+        self.assertTrue(default_storage.exists(name))
+        with self.captureOnCommitCallbacks(execute=True):
+            second.delete()
+        self.assertFalse(StoredFile.objects.filter(name=name).exists())
+        self.assertFalse(default_storage.exists(name))
+
+    def test_previews_are_rendered(self):
+        self.upload('scan.png')
+        data = self.client.get(f'/api/visits/{self.visit.id}/').data
+        preview = data['attachmentPreviews'][0]
+        self.assertEqual(preview['url'], data['attachments'][0])
+        name = self.visit.attachment_files.get().file.name
+        with default_storage.open(blobs.derived_name(name, 'thumbnail')) as f:
+            self.assertEqual(max(Image.open(f).size), 256)
+        self.assertTrue(preview['thumbnail'].endswith(blobs.derived_name(name, 'thumbnail')))
+
+    def test_previews_pending_until_rendered(self):
+        buffer = io.BytesIO()
+        Image.new('RGB', (800, 600), 'teal').save(buffer, 'PNG')
+        upload = SimpleUploadedFile('xray.png', buffer.getvalue(), content_type='image/png')
+        self.client.post(f'/api/visits/{self.visit.id}/upload_attachment/', {'file': upload}, format='multipart')
+        name = self.visit.attachment_files.get().file.name
+        for variant in blobs.VARIANTS:
+            default_storage.delete(blobs.derived_name(name, variant))
+
+        url = f'/api/visits/{self.visit.id}/'
+        res = self.client.get(url)
+        preview = res.data['attachmentPreviews'][0]
+        self.assertEqual((preview['thumbnail'], preview['preview']), (None, None))
+        jobs.run_pending()
+        res = self.client.get(url, HTTP_IF_NONE_MATCH=res['ETag'])
+        self.assertEqual(res.status_code, 200)
+        self.assertTrue(res.data['attachmentPreviews'][0]['thumbnail'].endswith(blobs.derived_name(name, 'thumbnail')))
+
+
+@jobs.task('test_flaky')
+def flaky_job(fail_times, key):
+    calls = flaky_job.calls
+    calls[key] = calls.get(key, 0) + 1
+    if calls[key] <= fail_times:
+        raise RuntimeError('boom')
+
+flaky_job.calls = {}
+
+
+class JobQueueTests(TestCase):
+    def test_success(self):
+        job = jobs.enqueue('test_flaky', {'fail_times': 0, 'key': 'ok'})
+        self.assertEqual(jobs.run_pending(), 1)
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), ('done', 1))
+
+    def test_retry_with_backoff_then_fail(self):
+        job = jobs.enqueue('test_flaky', {'fail_times': 5, 'key': 'retry'}, max_attempts=2)
+        with self.assertLogs('emr.jobs', 'WARNING'):
+            jobs.run_pending()
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), ('queued', 1))
+        self.assertGreater(job.run_at, timezone.now())
+        self.assertIn('RuntimeError', job.last_error)
+        # Not due yet
+        self.assertEqual(jobs.run_pending(), 0)
+
+        Job.objects.filter(pk=job.pk).update(run_at=timezone.now())
+        with self.assertLogs('emr.jobs', 'ERROR'):
+            jobs.run_pending()
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), ('failed', 2))
+
+    def test_claim_is_exclusive(self):
+        for n in range(3):
+            jobs.enqueue('test_flaky', {'fail_times': 0, 'key': f'c{n}'})
+        first = jobs.claim(limit=2, worker='a')
+        second = jobs.claim(limit=2, worker='b')
+        self.assertEqual(len(first), 2)
+        self.assertEqual(len(second), 1)
+        self.assertFalse(set(first) & set(second))
+
+    def test_expired_lease_is_reclaimed(self):
+        job = jobs.enqueue('test_flaky', {'fail_times': 0, 'key': 'lease'})
+        jobs.claim(worker='dead')
+        Job.objects.filter(pk=job.pk).update(locked_at=timezone.now() - datetime.timedelta(hours=1))
+        self.assertEqual(jobs.claim(worker='alive'), [job.pk])
+
+    def test_purge_finished(self):
+        done = jobs.enqueue('test_flaky', {'fail_times': 0, 'key': 'old'})
+        recent = jobs.enqueue('test_flaky', {'fail_times': 0, 'key': 'recent'})
+        queued = jobs.enqueue('test_flaky', {'fail_times': 0, 'key': 'later'}, delay=60)
+        jobs.run_pending()
+        Job.objects.filter(pk=done.pk).update(finished_at=timezone.now() - datetime.timedelta(days=8))
+        self.assertEqual(jobs.purge_finished(), 1)
+        self.assertEqual(set(Job.objects.values_list('pk', flat=True)), {recent.pk, queued.pk})
+
+
+@override_settings(MEDIA_ROOT='/tmp/emr-test-media')
+class ReceiptTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        self.treatment = Treatment.objects.create(title='Shirodhara', description='Oil pouring', price=2500)
+        self.visit = Visit.objects.create(
+            patient=make_patient(1, name='Lakshmi Devi'), date=datetime.date(2025, 1, 1), doctor_name='Dr A',
+            consultation_fee=300,
+        )
+        self.client.patch(
+            f'/api/visits/{self.visit.id}/',
+            {'totalAmount': '5300.00', 'visit_treatments': [{'treatmentId': self.treatment.id, 'sittings': 2}]},
+            format='json',
+        )
+        self.url = f'/api/visits/{self.visit.id}/receipt/'
+
+    def test_rendered_in_background_and_cached(self):
+        bill = Bill.objects.get(visit=self.visit)
+        jobs.run_pending()
+        name = receipts.receipt_name(bill, receipts.receipt_version(receipts.load_bill(bill.pk)))
+        self.assertTrue(default_storage.exists(name))
+
+        res = self.client.get(self.url)
+        self.assertEqual(res.status_code, 200)
+        html = res.content.decode()
+        self.assertIn(bill.bill_number, html)
+        self.assertIn('Shirodhara', html)
+        self.assertIn('5000.00', html)
+        self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH=res['ETag']).status_code, 304)
+
+    def test_new_version_after_payment(self):
+        etag = self.client.get(self.url)['ETag']
+        self.client.post(f'/api/visits/{self.visit.id}/add_payment/', {'amount': 1000}, format='json')
+        jobs.run_pending()
+        res = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(res.status_code, 200)
+        self.assertIn('4300.00', res.content.decode()) # Balance due
+        bill = receipts.load_bill(Bill.objects.get(visit=self.visit).pk)
+        self.assertEqual(default_storage.listdir(f'receipts/{bill.pk}')[1], [f'{receipts.receipt_version(bill)}.html'])
+
+    def test_one_queued_render_per_bill(self):
+        queued = Job.objects.filter(name='render_receipt', status='queued')
+        self.assertEqual(queued.count(), 1)
+        for _ in range(3):
+            self.client.post(f'/api/visits/{self.visit.id}/add_payment/', {'amount': 100}, format='json')
+        self.assertEqual(queued.count(), 1)
+        jobs.run_pending()
+        self.client.post(f'/api/visits/{self.visit.id}/add_payment/', {'amount': 100}, format='json')
+        self.assertEqual(queued.count(), 1)
+        self.assertEqual(Job.objects.filter(name='render_receipt').count(), 2)
+
+    def test_no_bill(self):
+        visit = Visit.objects.create(patient=make_patient(2), date=datetime.date(2025, 1, 1), doctor_name='Dr A')
+        self.assertEqual(self.client.get(f'/api/visits/{visit.id}/receipt/').status_code, 404)
+
+
+class ImportTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        self.user.role = 'admin'
+        self.user.save()
+
+    def test_patient_csv(self):
+        make_patient(1)
+        body = (
+            'name,mobile,age,sex,address,regNo,firstVisitDate,altMobile\n'
+            'Ravi Kumar,+91 98480 11111,40,Male,Guntur,OLD-1,2024-03-01,\n'
+            ',9848022222,30,Female,Guntur,OLD-2,2024-03-01,\n' # No name
+            'Someone,9848033333,30,Female,Guntur,REG-00001,2024-03-01,\n' # Already registered
+            'Sita Devi,9848044444,55,Female,"Guntur, AP",OLD-3,2024-03-02,9848055555\n'
+            'Sita Again,9848044444,55,Female,Guntur,OLD-3,2024-03-02,\n' # Duplicate within the file
+        )
+        res = self.client.generic('POST', '/api/imports/patients/?batchSize=2', body, content_type='text/csv')
+        self.assertEqual(res.status_code, 200, res.data)
+        self.assertEqual((res.data['created'], res.data['failed']), (2, 3))
+        self.assertEqual([e['row'] for e in res.data['errors']], [2, 3, 5])
+        self.assertIn('name', res.data['errors'][0]['errors'])
+
+        ravi = Patient.objects.get(reg_no='OLD-1')
+        self.assertEqual((ravi.mobile_digits, ravi.reg_no_key), ('9848011111', 'OLD-1'))
+        self.assertEqual(Patient.objects.get(reg_no='OLD-3').address, 'Guntur, AP')
+        self.assertEqual(self.client.get('/api/patients/', {'search': 'sita'}).data['results'][0]['regNo'], 'OLD-3')
+        self.assertEqual(DailyStats.objects.get(date=datetime.date(2024, 3, 1)).new_patients, 1)
+
+    def test_duplicate_reg_no_on_create(self):
+        make_patient(1)
+        res = self.client.post('/api/patients/', {
+            'name': 'Someone', 'mobile': '9848033333', 'age': 30, 'sex': 'Female', 'address': 'Guntur',
+            'regNo': 'REG-00001', 'firstVisitDate': '2024-03-01',
+        }, format='json')
+        self.assertEqual(res.status_code, 400)
+        self.assertIn('regNo', res.data)
+        self.assertEqual(Patient.objects.count(), 1)
+
+    def test_visit_ndjson(self):
+        patient = make_patient(1)
+        stamp = patient.updated_at
+        body = '\n'.join([
+            '{"regNo": "reg-00001", "date": "2024-03-01", "doctorName": "Dr A", "diagnosis": "Vata"}',
+            '{"patientId": %d, "date": "2024-03-01", "doctorName": "Dr B"}' % patient.id,
+            '{"regNo": "NOPE", "date": "2024-03-01", "doctorName": "Dr A"}',
+            '{not json',
+            '',
+            '{"date": "2024-03-01", "doctorName": "Dr A"}',
+        ])
+        res = self.client.generic('POST', '/api/imports/visits/', body, content_type='application/x-ndjson')
+        self.assertEqual((res.data['created'], res.data['failed']), (2, 3), res.data)
+        errors = {e['row']: e['errors'] for e in res.data['errors']}
+        self.assertEqual(errors[3], {'regNo': ['No such patient.']})
+        self.assertEqual(sorted(errors), [3, 4, 5]) # Blank lines are not rows
+
+        stats = DailyStats.objects.get(date=datetime.date(2024, 3, 1))
+        self.assertEqual((stats.visits, stats.pending_reports), (2, 1))
+        patient.refresh_from_db()
+        self.assertGreater(patient.updated_at, stamp)
+
+    def test_multipart_upload(self):
+        upload = SimpleUploadedFile('treatments.csv', b'title,description,price\nNasyam,Nasal oils,800\n')
+        res = self.client.post('/api/imports/treatments/', {'file': upload}, format='multipart')
+        self.assertEqual(res.data['created'], 1, res.data)
+
+    def test_treatment_upsert_is_idempotent(self):
+        from .importer import import_rows
+        Treatment.objects.create(title='Nasyam', description='Old', price=500)
+        self.assertEqual(len(catalog.serialized()), 1)
+        rows = [
+            {'title': 'Nasyam', 'description': 'Nasal oils', 'price': 800},
+            {'title': 'Vasti', 'description': 'Enema', 'price': 2000},
+        ]
+        report = import_rows('treatments', rows)
+        self.assertEqual((report.created, report.updated, report.unchanged), (1, 1, 0))
+        report = import_rows('treatments', rows)
+        self.assertEqual((report.created, report.updated, report.unchanged), (0, 0, 2))
+        self.assertEqual(Treatment.objects.count(), 2)
+        self.assertEqual({t['title']: t['price'] for t in catalog.serialized()}, {'Nasyam': '800.00', 'Vasti': '2000.00'})
+
+    def test_admin_only(self):
+        self.user.role = 'reception'
+        self.user.save()
+        res = self.client.generic('POST', '/api/imports/patients/', 'name\n', content_type='text/csv')
+        self.assertEqual(res.status_code, 403)
+        self.assertEqual(self.client.generic('POST', '/api/imports/nothing/', '', content_type='text/csv').status_code, 403)
+
+
+class ExportTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        self.user.role = 'admin'
+        self.user.save()
+        patient = make_patient(1, name='Ravi, Kumar')
+        for day, doctor in [(1, 'Dr A'), (2, 'Dr B'), (3, 'Dr A')]:
+            visit = Visit.objects.create(patient=patient, date=datetime.date(2025, 1, day), doctor_name=doctor)
+            bill = Bill.objects.create(visit=visit, grand_total=1000)
+            Payment.objects.create(bill=bill, amount=100 * day, received_by=self.user)
+
+    def read(self, response):
+        return b''.join(response.streaming_content)
+
+    def test_visits_csv(self):
+        res = self.client.get('/api/exports/visits/', {'from': '2025-01-02', 'doctor': 'dr a'})
+        self.assertEqual(res['Content-Disposition'], 'attachment; filename="visits-2025-01-02.csv"')
+        rows = list(csv.DictReader(io.StringIO(self.read(res).decode())))
+        self.assertEqual(len(rows), 1)
+        self.assertEqual((rows[0]['date'], rows[0]['patientName'], rows[0]['balance']), ('2025-01-03', 'Ravi, Kumar', '1000.00'))
+
+    def test_payments_ndjson_gzip(self):
+        res = self.client.get('/api/exports/payments/', {'fileType': 'ndjson', 'gzip': '1'})
+        self.assertEqual(res['Content-Type'], 'application/gzip')
+        rows = [json.loads(line) for line in gzip.decompress(self.read(res)).splitlines()]
+        self.assertEqual([r['amount'] for r in rows], ['100.00', '200.00', '300.00'])
+        self.assertEqual(rows[0]['receivedBy'], 'reception')
+        self.assertEqual(self.client.get('/api/exports/payments/', {'to': '2000-01-01'}).getvalue().count(b'\n'), 1)
+
+    def test_streamed_in_chunks(self):
+        with mock.patch('emr.exports.ROWS_PER_PIECE', 1):
+            res = self.client.get('/api/exports/visits/')
+            self.assertEqual(len(list(res.streaming_content)), 3) # One piece per row, the first with the header
+
+    def test_bad_request(self):
+        self.assertEqual(self.client.get('/api/exports/visits/', {'from': 'January'}).status_code, 400)
+        self.assertEqual(self.client.get('/api/exports/visits/', {'fileType': 'xml'}).status_code, 400)
+        self.assertEqual(self.client.get('/api/exports/bills/').status_code, 404)
+        self.user.role = 'doctor'
+        self.user.save()
+        self.assertEqual(self.client.get('/api/exports/visits/').status_code, 403)
+
+
+class RevenueReportTests(APITestCase):
+    url = '/api/reports/revenue/'
+
+    def setUp(self):
+        super().setUp()
+        self.user.role = 'admin'
+        self.user.save()
+        self.treatment = Treatment.objects.create(title='Shirodhara', description='Oil pouring', price=1000)
+        patient = make_patient(1)
+        first = Visit.objects.create(patient=patient, date=datetime.date(2025, 1, 1), doctor_name='Dr A', consultation_fee=300)
+        VisitTreatment.objects.create(visit=first, treatment=self.treatment, sittings=2, cost_per_sitting=1000)
+        second = Visit.objects.create(patient=patient, date=datetime.date(2025, 1, 2), doctor_name='Dr B', consultation_fee=500)
+        self.first = first
+        for visit, total, payments in [(first, 2300, [(1000, 'cash'), (300, 'upi')]), (second, 500, [(500, 'card')])]:
+            bill = Bill.objects.create(visit=visit, grand_total=total)
+            for amount, mode in payments:
+                billing.record_payment(visit, Decimal(amount), mode, self.user)
+            Payment.objects.filter(bill=bill).update(date=timezone.make_aware(datetime.datetime.combine(visit.date, datetime.time(10))))
+
+    def get(self, **params):
+        res = self.client.get(self.url, {'from': '2025-01-01', 'to': '2025-01-31', **params})
+        self.assertEqual(res.status_code, 200, res.data)
+        return res.data
+
+    def test_by_day(self):
+        data = self.get()
+        self.assertEqual([r['key'] for r in data['rows']], ['2025-01-01', '2025-01-02'])
+        day = data['rows'][0]
+        self.assertEqual((day['consultationFees'], day['treatmentCharges'], day['collected']), ('300.00', '2000.00', '1300.00'))
+        self.assertEqual(day['collections'], {'cash': '1000.00', 'upi': '300.00'})
+        self.assertEqual((day['outstanding'], day['outstandingBills']), ('1000.00', 1))
+        self.assertEqual(data['totals']['collections'], {'cash': '1000.00', 'upi': '300.00', 'card': '500.00'})
+        self.assertEqual(data['totals']['consultationFees'], '800.00')
+
+    def test_groupings(self):
+        self.assertEqual([r['key'] for r in self.get(groupBy='doctor')['rows']], ['Dr A', 'Dr B'])
+        self.assertEqual(self.get(groupBy='week')['rows'][0]['key'], '2024-12-30')
+        month = self.get(groupBy='month')['rows']
+        self.assertEqual((len(month), month[0]['collected']), (1, '1800.00'))
+        treatment = self.get(groupBy='treatment')['rows']
+        self.assertEqual(treatment, [{**treatment[0], 'title': 'Shirodhara', 'treatmentCharges': '2000.00', 'treatments': 1}])
+        self.assertEqual(self.client.get(self.url, {'groupBy': 'year'}).status_code, 400)
+
+    def test_closed_days_match_live(self):
+        live = {group: self.get(groupBy=group) for group in revenue.GROUPS}
+        revenue.close(through=datetime.date(2025, 1, 1))
+        self.assertEqual(revenue.closed_through(), datetime.date(2025, 1, 1))
+        for group in revenue.GROUPS:
+            self.assertEqual(self.get(groupBy=group), live[group])
+        revenue.close(through=datetime.date(2025, 1, 31))
+        with CaptureQueriesContext(connection) as ctx:
+            self.assertEqual(self.get(), live['day'])
+        self.assertLessEqual(len(ctx), 6)
+
+    def test_edit_to_closed_day(self):
+        revenue.close(through=datetime.date(2025, 1, 31))
+        self.client.patch(
+            f'/api/visits/{self.first.id}/',
+            {'consultationFee': '400.00', 'visit_treatments': [{'treatmentId': self.treatment.id, 'sittings': 3}]},
+            format='json',
+        )
+        day = self.get()['rows'][0]
+        self.assertEqual((day['consultationFees'], day['treatmentCharges']), ('400.00', '3000.00'))
+        Payment.objects.filter(mode='upi').delete()
+        self.assertEqual(self.get()['rows'][0]['collections'], {'cash': '1000.00'})
+
+    def test_queues_closing_once(self):
+        self.get()
+        self.get()
+        self.assertEqual(Job.objects.filter(name='close_revenue').count(), 1)
+        jobs.run_pending()
+        self.assertEqual(revenue.closed_through(), timezone.localdate() - datetime.timedelta(days=1))
+
+
+@override_settings(MEDIA_ROOT='/tmp/emr-test-media')
+class SparseFieldsTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        self.treatment = Treatment.objects.create(title='Abhyangam', description='Oil massage', price=1200)
+        self.patient = make_patient(1)
+        self.visit = make_full_visit(self.patient, self.user, self.treatment)
+        self.visit.clinical_history = 'Long history'
+        self.visit.save()
+        catalog.serialized()
+
+    def test_compact_list(self):
+        with CaptureQueriesContext(connection) as ctx:
+            row = self.client.get('/api/visits/').data['results'][0]
+        self.assertEqual(set(row), {'id', 'patientId', 'date', 'doctorName', 'status', 'consultationFee', 'isPaid',
+                                    'totalAmount', 'amountPaid', 'bill'})
+        self.assertNotIn('payments', row['bill'])
+        self.assertEqual(row['bill']['grandTotal'], '1000.00')
+        page = [q['sql'] for q in ctx.captured_queries if 'emr_visit' in q['sql'] and 'LIMIT' in q['sql']][0]
+        self.assertNotIn('clinical_history', page)
+        self.assertEqual(len(ctx), 2) # Version check + page, nothing prefetched
+
+    def test_expand(self):
+        row = self.client.get('/api/visits/', {'expand': 'clinicalHistory,treatments,bill.payments'}).data['results'][0]
+        self.assertEqual(row['clinicalHistory'], 'Long history')
+        self.assertEqual(row['treatments'][0]['treatment']['title'], 'Abhyangam')
+        self.assertEqual(len(row['bill']['payments']), 2)
+        self.assertNotIn('diagnosis', row)
+        full = self.client.get('/api/visits/', {'expand': '*'}).data['results'][0]
+        self.assertEqual(full, self.client.get(f'/api/visits/{self.visit.id}/').data)
+
+    def test_fields(self):
+        data = self.client.get('/api/visits/', {'fields': 'id,date,bill.billNumber'}).data['results'][0]
+        self.assertEqual(data, {'id': self.visit.id, 'date': '2025-01-01', 'bill': {'billNumber': self.visit.bill.bill_number}})
+        data = self.client.get(f'/api/visits/{self.visit.id}/', {'fields': 'diagnosis,attachments'}).data
+        self.assertEqual(set(data), {'diagnosis', 'attachments'})
+
+    def test_patients(self):
+        row = self.client.get('/api/patients/').data['results'][0]
+        self.assertNotIn('address', row)
+        self.assertEqual(row['regNo'], 'REG-00001')
+        self.assertEqual(self.client.get('/api/patients/', {'fields': 'id,address'}).data['results'][0],
+                         {'id': self.patient.id, 'address': 'Hyderabad'})
+        self.assertIn('address', self.client.get(f'/api/patients/{self.patient.id}/').data)
+        # Writes ignore the query string
+        res = self.client.post('/api/patients/?fields=id', {
+            'name': 'New', 'mobile': '9848000000', 'age': 3, 'sex': 'Male', 'address': 'X', 'regNo': 'N-1',
+            'firstVisitDate': '2025-01-01',
+        }, format='json')
+        self.assertEqual(res.status_code, 201, res.data)
+        self.assertEqual(res.data['address'], 'X')
+
+
+@override_settings(MEDIA_ROOT='/tmp/emr-test-media')
+class FastReadPathTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        treatment = Treatment.objects.create(title='Abhyangam', description='Oil massage', price=1200)
+        patient = make_patient(1, name='Śrī Lakshmi "Devi"\u2028', alt_mobile=None, blood_group=None)
+        make_full_visit(patient, self.user, treatment)
+        Visit.objects.create(patient=patient, date=datetime.date(2025, 1, 2), doctor_name='Dr B', notes=None)
+        for n in range(2, 5):
+            make_patient(n)
+
+    def assertSameBytes(self, url, params=None):
+        with override_settings(API_VALUES_READ_PATH=False):
+            expected = self.client.get(url, params)
+        with mock.patch('emr.fastpath.ValuesRepresentation.render', autospec=True,
+                        side_effect=fastpath.ValuesRepresentation.render) as render:
+            actual = self.client.get(url, params)
+        self.assertEqual(actual.status_code, 200)
+        self.assertEqual(actual.content, expected.content)
+        return render.call_count
+
+    def test_visit_lists(self):
+        self.assertEqual(self.assertSameBytes('/api/visits/'), 2)
+        self.assertSameBytes('/api/visits/', {'fields': 'id,date,notes,bill.status,bill.billNumber'})
+        self.assertSameBytes('/api/visits/', {'pageSize': 1})
+        self.assertSameBytes('/api/visits/', {'expand': 'diagnosis,bill'}) # Payments need the serializer
+
+    def test_patient_lists(self):
+        self.assertEqual(self.assertSameBytes('/api/patients/'), 4)
+        self.assertSameBytes('/api/patients/', {'fields': 'id,name,altMobile,bloodGroup,address'})
+        self.assertSameBytes('/api/patients/', {'pageSize': 2})
+
+    def test_renderer_matches_drf(self):
+        data = {
+            'text': 'é\u2028\u2029 "q" \\ / \x1f', 'int': 10 ** 20, 'float': 0.1, 'none': None, 'bool': True,
+            'datetime': timezone.make_aware(datetime.datetime(2025, 1, 1, 10, 30)), 'date': datetime.date(2025, 1, 1),
+            'decimal': Decimal('12.50'), 'lazy': gettext_lazy('Paid'),
+            'tuple': (1, 2), 1: 'int key', 'nested': [{'a': []}],
+        }
+        from rest_framework.renderers import JSONRenderer
+        from .renderers import FastJSONRenderer
+        self.assertEqual(FastJSONRenderer().render(data), JSONRenderer().render(data))
+        self.assertEqual(FastJSONRenderer().render({'big': 2 ** 70}), JSONRenderer().render({'big': 2 ** 70}))
+        self.assertEqual(
+            FastJSONRenderer().render(data, 'application/json; indent=2'), JSONRenderer().render(data, 'application/json; indent=2')
+        )
+
+
+class RequestTimingTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        instrumentation.metrics.reset()
+        make_patient(1)
+
+    def test_server_timing_header(self):
+        with CaptureQueriesContext(connection) as ctx:
+            res = self.client.get('/api/patients/')
+        timing = dict(part.split(';', 1) for part in res['Server-Timing'].split(', '))
+        self.assertEqual(set(timing), {'db', 'view', 'serialize', 'total'})
+        self.assertIn(f'desc="{len(ctx.captured_queries)} queries"', timing['db'])
+
+    @override_settings(SLOW_REQUEST_MS=0)
+    def test_slow_requests_are_logged_with_worst_sql(self):
+        with self.assertLogs('emr.slow_requests', 'WARNING') as logs:
+            self.client.get('/api/patients/', {'search': 'Patient'})
+        entry = json.loads(logs.records[0].getMessage())
+        self.assertEqual(entry['route'], 'GET /api/patients/')
+        self.assertEqual(entry['status'], 200)
+        self.assertGreater(entry['queries'], 0)
+        self.assertIn('SELECT', entry['worstSql'])
+
+    def test_metrics_are_admin_only(self):
+        self.client.get('/api/patients/')
+        self.client.get('/api/patients/')
+        self.assertEqual(self.client.get('/api/metrics/').status_code, 403)
+
+        self.user.role = 'admin'
+        self.user.save()
+        routes = self.client.get('/api/metrics/').json()['routes']
+        stats = routes['GET /api/patients/']
+        self.assertEqual(stats['count'], 2)
+        self.assertEqual(sum(stats['buckets'].values()), 2)
+        self.assertEqual(routes['GET /api/metrics/']['count'], 1) # The denied request
+
+
+class SyntheticDataTests(TestCase):
+    def test_seed_is_consistent(self):
+        counts = synthetic.seed(patients=30, visits=120, days=60, batch_size=7)
+        self.assertEqual(counts['patients'], 30)
+        self.assertEqual(Visit.objects.count(), 120)
+        self.assertEqual(Bill.objects.count(), counts['bills'])
+
+        for bill in Bill.objects.select_related('visit').annotate(paid=Sum('payments__amount')):
+            self.assertEqual(bill.total_paid, bill.paid or 0)
+            self.assertEqual(bill.balance, bill.grand_total - bill.total_paid)
+            self.assertEqual(bill.visit.amount_paid, bill.total_paid)
+        self.assertEqual(Bill.objects.values('bill_number').distinct().count(), counts['bills'])
+        self.assertEqual(DailyStats.objects.aggregate(n=Sum('visits'))['n'], 120)
+        self.assertFalse(Payment.objects.filter(date__gt=timezone.now()).exists())
+
+        # Ids continue normally after the explicit-id inserts
+        visit = Visit.objects.create(patient=Patient.objects.first(), date=datetime.date(2025, 1, 1), doctor_name='Dr A')
+        self.assertGreater(visit.pk, Visit.objects.exclude(pk=visit.pk).aggregate(n=Max('pk'))['n'])
+
+
+@override_settings(PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'], SLOW_REQUEST_MS=60000,
+                   REPLICA_DATABASE=None)
+class BenchmarkTests(LiveServerTestCase):
+    def test_run_and_compare(self):
+        synthetic.seed(patients=5, visits=10, days=10)
+        User.objects.create_user(username='load', email='load@example.com', password='pass', role='reception')
+
+        results = benchmark.Benchmark(self.live_server_url, 'load@example.com', 'pass', concurrency=2, requests=4).run()
+        for name in benchmark.SCENARIOS:
+            row = results['scenarios'][name]
+            self.assertEqual((row['requests'], row['errors']), (4, 0), name)
+            self.assertLessEqual(row['p50Ms'], row['p99Ms'])
+            self.assertGreater(row['meanQueries'], 0)
+
+        self.assertEqual(benchmark.compare(results, results), [])
+        slower = json.loads(json.dumps(results))
+        slower['scenarios']['visits']['p95Ms'] *= 2
+        self.assertEqual([r[:2] for r in benchmark.compare(results, slower)], [('visits', 'p95Ms')])
+        self.assertEqual(benchmark.percentile([1, 2, 3, 4], 50), 2)
+
+
+@override_settings(REPLICA_DATABASE='replica')
+class ReplicaRoutingTests(APITestCase):
+    def test_writes_pin_reads_to_primary(self):
+        router = routers.PrimaryReplicaRouter()
+        token = routers._state.set(routers.RoutingState())
+        try:
+            self.assertIsNone(router.db_for_read(Patient)) # Not opted in
+            routers.use_replica(self.user.pk)
+            self.assertEqual(router.db_for_read(Patient), 'replica')
+            self.assertEqual(router.db_for_write(Patient), 'default')
+            self.assertIsNone(router.db_for_read(Patient))
+
+            routers.pin_user(self.user.pk)
+            routers._state.set(routers.RoutingState())
+            routers.use_replica(self.user.pk)
+            self.assertIsNone(router.db_for_read(Patient))
+        finally:
+            routers._state.reset(token)
+        self.assertEqual(routers.read_alias(), 'default') # Outside a request
+
+    def test_write_requests_pin_the_user(self):
+        visit = Visit.objects.create(patient=make_patient(1), date=datetime.date(2025, 1, 1), doctor_name='Dr A', total_amount=500)
+        self.client.get(f'/api/visits/{visit.pk}/')
+        self.assertFalse(routers.user_pinned(self.user.pk))
+        self.client.post(f'/api/visits/{visit.pk}/add_payment/', {'amount': '100'}, format='json')
+        self.assertTrue(routers.user_pinned(self.user.pk))
+
+        with override_settings(REPLICA_PIN_SECONDS=0):
+            cache.clear()
+            self.client.post(f'/api/visits/{visit.pk}/add_payment/', {'amount': '100'}, format='json')
+            self.assertFalse(routers.user_pinned(self.user.pk))
+
+
+@skipUnless('replica' in settings.DATABASES, "needs a replica database (DB_REPLICA_NAME)")
+@override_settings(REPLICA_DATABASE='replica')
+class ReplicaReadTests(APITestCase):
+    databases = '__all__'
+
+    def visits_today(self):
+        stats = self.client.get('/api/dashboard/stats/').data['stats']
+        return next(int(s['value']) for s in stats if s['name'] == 'Visits Today')
+
+    def test_reads_use_replica_until_the_user_writes(self):
+        today = timezone.localdate()
+        DailyStats.objects.create(date=today, visits=1)
+        DailyStats.objects.using('replica').create(date=today, visits=5)
+        self.assertEqual(self.visits_today(), 5)
+
+        res = self.client.post('/api/treatments/', {'title': 'Nasyam', 'description': 'Oil', 'price': '800.00'}, format='json')
+        self.assertEqual(res.status_code, 201)
+        self.assertEqual(self.visits_today(), 1)
+        cache.clear() # Pin expired
+        self.assertEqual(self.visits_today(), 5)
+
+    def test_exports_read_replica(self):
+        self.user.role = 'admin'
+        self.user.save()
+        patient = Patient(name='Replica Only', mobile='1', age=30, sex='Male', address='-', reg_no='R-1',
+                          first_visit_date=datetime.date(2025, 1, 1))
+        Patient.objects.using('replica').bulk_create([patient])
+        Visit.objects.using('replica').bulk_create([Visit(patient=patient, date=datetime.date(2025, 1, 1), doctor_name='Dr R')])
+        cache.clear()
+
+        res = self.client.get('/api/exports/visits/')
+        self.assertIn('Dr R', b''.join(res.streaming_content).decode())
+
+
+@override_settings(PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'])
+class CachedAuthenticationTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        self.user.set_password('pass')
+        self.user.save()
+        self.client = APIClient()
+
+    def login(self, password='pass'):
+        res = self.client.post('/api/auth/login/', {'email': self.user.email, 'password': password}, format='json')
+        self.assertEqual(res.status_code, 200)
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {res.data['access']}")
+        return res.data['access']
+
+    def test_user_is_loaded_once(self):
+        self.login()
+        first = self.count_queries('get', '/api/dashboard/stats/')
+        self.assertEqual(self.count_queries('get', '/api/dashboard/stats/'), first - 1)
+
+    def test_user_writes_are_seen(self):
+        self.login()
+        self.assertEqual(self.client.get('/api/metrics/').status_code, 403)
+        self.user.role = 'admin'
+        self.user.save()
+        self.assertEqual(self.client.get('/api/metrics/').status_code, 200)
+        self.user.delete()
+        self.assertEqual(self.client.get('/api/metrics/').status_code, 401)
+
+    def test_password_change_revokes_tokens(self):
+        self.login()
+        res = self.client.patch(f'/api/users/{self.user.pk}/', {'password': 'new-pass'}, format='json')
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(self.client.get('/api/dashboard/stats/').status_code, 401)
+        self.login('new-pass')
+        self.assertEqual(self.client.get('/api/dashboard/stats/').status_code, 200)
+
+    def test_password_rehash_at_login_keeps_tokens(self):
+        token = self.login()
+        # A hash check_password() upgrades, and saves, at the next login
+        weak = make_password('pass', salt='short', hasher='md5')
+        User.objects.filter(pk=self.user.pk).update(password=weak)
+        self.login()
+        self.assertNotEqual(User.objects.get(pk=self.user.pk).password, weak)
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {token}')
+        self.assertEqual(self.client.get('/api/dashboard/stats/').status_code, 200)
+
+
+@override_settings(MEDIA_ROOT='/tmp/emr-test-media')
+class AsyncViewTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        token = CustomTokenObtainPairSerializer.get_token(self.user).access_token
+        # DRF views use force_authenticate, the async views the token
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {token}')
+        self.treatment = Treatment.objects.create(title='Nasyam', description='Nasal oil', price=800)
+        self.ramesh = make_patient(1, name='Ramesh Kumar', reg_no='SD-2025-101', first_visit_date=timezone.localdate())
+        self.suresh = make_patient(2, name='Suresh Kumar', mobile='9000022222', reg_no='SD-2025-202')
+        make_full_visit(self.ramesh, self.user, self.treatment)
+        Visit.objects.create(patient=self.ramesh, date=timezone.localdate(), doctor_name='Dr B')
+
+    def assertSameBody(self, sync_url, async_url, params=None):
+        expected = self.client.get(sync_url, params)
+        res = self.client.get(async_url, params)
+        self.assertEqual(res.status_code, 200, res.content)
+        self.assertEqual(res['Content-Type'], 'application/json')
+        self.assertEqual(res.content, expected.content)
+
+    def test_dashboard_matches_sync_view(self):
+        self.assertSameBody('/api/dashboard/stats/', '/api/async/dashboard/stats/')
+        self.assertSameBody('/api/dashboard/stats/', '/api/async/dashboard/stats/', {'days': 30})
+        self.assertEqual(self.client.get('/api/async/dashboard/stats/', {'days': 'x'}).status_code, 400)
+
+    def test_search_matches_sync_view(self):
+        for query in ('kumar', 'sd-2025', '90000', 'ram kum', 'nobody'):
+            self.assertSameBody('/api/patients/', '/api/async/patients/search/', {'search': query})
+        self.assertSameBody('/api/patients/', '/api/async/patients/search/',
+                            {'search': 'kumar', 'pageSize': 1, 'fields': 'name,regNo'})
+
+    def test_patient_visits_match_sync_view(self):
+        url = f'/api/async/patients/{self.ramesh.pk}/visits/'
+        self.assertSameBody('/api/visits/', url, {'patientId': self.ramesh.pk})
+        self.assertSameBody('/api/visits/', url, {'patientId': self.ramesh.pk, 'expand': '*'})
+        self.assertEqual(self.client.get(f'/api/async/patients/{self.suresh.pk}/visits/').json()['results'], [])
+
+    def test_queries_are_timed(self):
+        with CaptureQueriesContext(connection) as ctx:
+            res = self.client.get(f'/api/async/patients/{self.ramesh.pk}/visits/', {'expand': 'treatments'})
+        # The user, visits, treatments and the catalog, run on the executor thread
+        self.assertEqual(len(ctx.captured_queries), 4)
+        self.assertIn(f'desc="{len(ctx.captured_queries)} queries"', res['Server-Timing'])
+
+    def test_authentication_and_methods(self):
+        res = APIClient().get('/api/async/dashboard/stats/')
+        self.assertEqual(res.status_code, 401)
+        self.assertEqual(res['WWW-Authenticate'], 'Bearer realm="api"')
+        self.assertEqual(res.json(), {'detail': 'Authentication credentials were not provided.'})
+
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION='Bearer nonsense')
+        self.assertEqual(client.get('/api/async/dashboard/stats/').json()['code'], 'token_not_valid')
+        self.assertEqual(self.client.post('/api/async/dashboard/stats/').status_code, 405)
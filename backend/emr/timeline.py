@@ -0,0 +1,43 @@
+"""
+Everything the patient page shows, in one payload
+(/api/patients/{id}/timeline/): the patient, their visits newest first with
+treatments, attachments, bills and payments, and their money totals.
+
+Payloads are cached per patient. The key includes the patient's updated_at,
+which every write to their visits, treatments, attachments, bills and
+payments bumps (see emr/signals.py), and the treatment catalog version, so
+any such write makes the next read rebuild the payload instead of having to
+find and delete the old one.
+"""
+import hashlib
+from decimal import Decimal
+
+from .catalog import catalog
+from .serializers import PatientSerializer, VisitSerializer
+
+ZERO = Decimal('0.00')
+
+
+def cache_key(patient, base_url):
+    # The base URL is part of the payload: attachment links are absolute
+    version = f'{patient.updated_at.isoformat()}|{catalog.version()}|{base_url}'
+    return f'emr:timeline:{patient.pk}:{hashlib.sha1(version.encode()).hexdigest()[:16]}'
+
+
+def totals(visits):
+    """Billed, paid and outstanding over the visits' bills, from their stored totals."""
+    bills = [visit.bill for visit in visits if hasattr(visit, 'bill')]
+    billed = sum((bill.grand_total for bill in bills), ZERO)
+    paid = sum((bill.total_paid for bill in bills), ZERO)
+    outstanding = sum((bill.balance for bill in bills), ZERO)
+    # Money as strings, the way the serializers render DecimalFields
+    return {'billed': str(billed), 'paid': str(paid), 'outstanding': str(outstanding), 'bills': len(bills)}
+
+
+def payload(patient, visits, context):
+    """`visits` must be ordered and have the relations VisitSerializer renders prefetched."""
+    return {
+        'patient': PatientSerializer(patient, context=context).data,
+        'visits': VisitSerializer(visits, many=True, context=context).data,
+        'totals': totals(visits),
+    }
@@ -0,0 +1,158 @@
+import hashlib
+import os
+import threading
+
+from django.conf import settings
+from django.db import transaction
+from django.utils.text import get_valid_filename
+
+from .models import AttachmentUpload, VisitAttachment
+from .storage import content_name, content_store
+
+READ_SIZE = 64 * 1024
+
+
+class UploadError(Exception):
+    pass
+
+
+class OffsetMismatch(UploadError):
+    def __init__(self, expected):
+        super().__init__(f"Expected offset {expected}")
+        self.expected = expected
+
+
+# Running SHA-256 per upload, kept by the worker that received the previous
+# chunk. Hash state cannot be persisted, so if the next chunk lands on another
+# worker the digest is recomputed from the partial file on finalize instead.
+_hashers = {}
+_hashers_lock = threading.Lock()
+
+
+def partial_path(upload):
+    return os.path.join(settings.UPLOAD_TEMP_DIR, f'{upload.pk}.part')
+
+
+def start_upload(visit, filename, size, user=None):
+    if size < 0 or size > settings.UPLOAD_MAX_SIZE:
+        raise UploadError(f"Size must be between 0 and {settings.UPLOAD_MAX_SIZE} bytes")
+    upload = AttachmentUpload.objects.create(
+        visit=visit, filename=get_valid_filename(os.path.basename(filename)) or 'upload', size=size, created_by=user
+    )
+    os.makedirs(settings.UPLOAD_TEMP_DIR, exist_ok=True)
+    open(partial_path(upload), 'wb').close()
+    with _hashers_lock:
+        _hashers[upload.pk] = (hashlib.sha256(), 0)
+    return upload
+
+
+def _lock(upload):
+    # Inside transaction.atomic(): holds the upload row until commit and
+    # brings `upload` up to date with it
+    locked = AttachmentUpload.objects.select_for_update().get(pk=upload.pk)
+    upload.offset, upload.sha256, upload.attachment_id = locked.offset, locked.sha256, locked.attachment_id
+    return upload
+
+
+def write_chunk(upload, offset, stream, length):
+    """
+    Copy `length` bytes from `stream` into the partial file at `offset`,
+    READ_SIZE at a time, hashing as they pass. Returns the new offset.
+
+    The upload row stays locked from the offset check until the new offset
+    is saved, so two requests sending the same range are applied one after
+    the other and the second is refused before it writes anything.
+    """
+    if length <= 0 or length > settings.UPLOAD_CHUNK_MAX_SIZE:
+        raise UploadError("Invalid chunk length")
+    with transaction.atomic():
+        _lock(upload)
+        if upload.is_complete:
+            raise UploadError("Upload already finalized")
+        if offset != upload.offset:
+            raise OffsetMismatch(upload.offset)
+        if offset + length > upload.size:
+            raise UploadError("Invalid chunk length")
+
+        with _hashers_lock:
+            hasher, hashed = _hashers.pop(upload.pk, (None, None))
+        if hashed != offset:
+            hasher = None
+
+        written = 0
+        with open(partial_path(upload), 'r+b') as f:
+            f.seek(offset)
+            while written < length:
+                data = stream.read(min(READ_SIZE, length - written))
+                if not data:
+                    break
+                f.write(data)
+                if hasher:
+                    hasher.update(data)
+                written += len(data)
+        if written != length:
+            raise UploadError(f"Connection closed after {written} of {length} bytes")
+
+        AttachmentUpload.objects.filter(pk=upload.pk).update(offset=offset + length)
+        upload.offset = offset + length
+    if hasher:
+        with _hashers_lock:
+            _hashers[upload.pk] = (hasher, upload.offset)
+    return upload.offset
+
+
+def _file_digest(path):
+    hasher = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for data in iter(lambda: f.read(READ_SIZE), b''):
+            hasher.update(data)
+    return hasher.hexdigest()
+
+
+def finalize(upload, expected_sha256=None):
+    """
+    Turn a fully received upload into a VisitAttachment. Runs under a lock
+    on the upload row, so a concurrent or repeated call waits and then gets
+    the attachment the first one made.
+    """
+    with transaction.atomic():
+        _lock(upload)
+        if upload.is_complete:
+            return upload.attachment
+        if upload.offset != upload.size:
+            raise OffsetMismatch(upload.offset)
+
+        path = partial_path(upload)
+        with _hashers_lock:
+            hasher, hashed = _hashers.pop(upload.pk, (None, None))
+        digest = hasher.hexdigest() if hasher and hashed == upload.size else _file_digest(path)
+        if expected_sha256 and expected_sha256.lower() != digest:
+            raise UploadError("Checksum mismatch")
+
+        name = content_name(digest, os.path.splitext(upload.filename)[1].lower()[:10])
+        attachment = VisitAttachment(visit_id=upload.visit_id)
+        if content_store.exists(name):
+            # Same content already stored: just reference it
+            os.remove(path)
+        else:
+            target = content_store.path(name)
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            # Same filesystem: move the partial file into place, no copy
+            os.replace(path, target)
+        attachment.file.name = name
+        attachment.save()
+        upload.sha256 = digest
+        upload.attachment = attachment
+        upload.save(update_fields=['sha256', 'attachment'])
+    return attachment
+
+
+def purge_stale(cutoff):
+    """Drop unfinished uploads started before `cutoff`, with their partial files."""
+    stale = AttachmentUpload.objects.filter(attachment__isnull=True, created_at__lt=cutoff)
+    for upload in stale:
+        try:
+            os.remove(partial_path(upload))
+        except FileNotFoundError:
+            pass
+    return stale.delete()[0]
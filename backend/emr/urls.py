@@ -1,6 +1,7 @@
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
-from .views import CustomTokenObtainPairView, PatientViewSet, VisitViewSet, TreatmentViewSet, DashboardStatsView, UserViewSet
+from . import async_views
+from .views import CustomTokenObtainPairView, PatientViewSet, VisitViewSet, TreatmentViewSet, DashboardStatsView, BatchView, ExportView, ImportView, RevenueReportView, UserViewSet
 
 router = DefaultRouter()
 router.register(r'patients', PatientViewSet)
@@ -11,5 +12,13 @@ router.register(r'users', UserViewSet)
 urlpatterns = [
     path('auth/login/', CustomTokenObtainPairView.as_view(), name='token_obtain_pair'),
     path('dashboard/stats/', DashboardStatsView.as_view(), name='dashboard_stats'),
+    path('batch/', BatchView.as_view(), name='batch'),
+    path('reports/revenue/', RevenueReportView.as_view(), name='revenue_report'),
+    path('exports/<str:name>/', ExportView.as_view(), name='exports'),
+    path('imports/<str:kind>/', ImportView.as_view(), name='imports'),
+    # ASGI fast path (emr/async_views.py)
+    path('async/dashboard/stats/', async_views.dashboard_stats, name='async_dashboard_stats'),
+    path('async/patients/search/', async_views.patient_search, name='async_patient_search'),
+    path('async/patients/<int:pk>/visits/', async_views.patient_visits, name='async_patient_visits'),
     path('', include(router.urls)),
 ]
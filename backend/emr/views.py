@@ -1,17 +1,68 @@
+import datetime
+
 from rest_framework import viewsets, status, generics
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework.decorators import action
-from rest_framework.permissions import IsAuthenticated, AllowAny
-from rest_framework.exceptions import PermissionDenied
+from rest_framework.permissions import IsAuthenticated, AllowAny, SAFE_METHODS
+from rest_framework.exceptions import PermissionDenied, NotFound
 from rest_framework_simplejwt.views import TokenObtainPairView
 from rest_framework_simplejwt.serializers import TokenObtainPairSerializer
-from django.db.models import Count
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Prefetch
+from django.http import HttpResponse, StreamingHttpResponse
+from django.shortcuts import get_object_or_404
 from django.utils import timezone
-from .models import User, Patient, Visit, VisitAttachment, Treatment, Bill, Payment
+from config import routers
+from .models import User, Patient, Visit, VisitAttachment, Treatment, VisitTreatment, Bill, Payment, DailyStats, AttachmentUpload, Job
 from .serializers import UserSerializer, PatientSerializer, VisitSerializer, TreatmentSerializer
+from .pagination import PatientPagination, VisitPagination
+from .search import search_patients
+from .billing import parse_amount, record_payment
+from .catalog import catalog
+from .conditional import ConditionalGetMixin, list_version
+from .sparse import SparseFieldsViewMixin
+from .fastpath import ValuesListMixin
+from . import authentication, batch, dashboard, exports, importer, jobs, receipts, revenue, timeline, uploads
+
+def lookup_pk(value):
+    """The id in the URL; NotFound if it is not one, as get_object() would raise."""
+    try:
+        return int(value)
+    except ValueError:
+        raise NotFound()
+
+
+def prefetch_for_visits(queryset, fields):
+    """Load the relations behind the VisitSerializer `fields` being rendered, and only those."""
+    bill = fields.get('bill')
+    lookups = []
+    if 'attachments' in fields or 'attachmentPreviews' in fields:
+        lookups.append('attachment_files')
+    if 'treatments' in fields:
+        lookups.append('treatments') # Treatment details come from the catalog
+    if bill is not None:
+        queryset = queryset.select_related('bill')
+        if 'payments' in bill.fields:
+            lookups.append(Prefetch('bill__payments', queryset=Payment.objects.select_related('received_by')))
+    return queryset.prefetch_related(*lookups)
+
+class ReplicaReadMixin:
+    """Reads for GET requests go to the read replica, if one is configured (see config/routers.py)."""
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        if request.method in SAFE_METHODS:
+            routers.use_replica(request.user.pk)
 
 class CustomTokenObtainPairSerializer(TokenObtainPairSerializer):
+    @classmethod
+    def get_token(cls, user):
+        token = super().get_token(user)
+        token[authentication.VERSION_CLAIM] = user.token_version
+        return token
+
     def validate(self, attrs):
         data = super().validate(attrs)
         # Add extra responses data
@@ -35,38 +86,115 @@ class CustomTokenObtainPairSerializer(TokenObtainPairSerializer):
 class CustomTokenObtainPairView(TokenObtainPairView):
     serializer_class = CustomTokenObtainPairSerializer
 
-class PatientViewSet(viewsets.ModelViewSet):
+class PatientViewSet(ValuesListMixin, SparseFieldsViewMixin, ConditionalGetMixin, viewsets.ModelViewSet):
     queryset = Patient.objects.all().order_by('-id')
     serializer_class = PatientSerializer
     permission_classes = [IsAuthenticated]
-
-    def create(self, request, *args, **kwargs):
-        try:
-            return super().create(request, *args, **kwargs)
-        except Exception as e:
-            import traceback
-            traceback.print_exc()
-            return Response(f"Server Error: {str(e)}", status=status.HTTP_400_BAD_REQUEST)
+    pagination_class = PatientPagination
 
     def get_queryset(self):
         queryset = super().get_queryset()
-        search = self.request.query_params.get('search', None)
-        if search:
-            queryset = queryset.filter(name__icontains=search) | queryset.filter(mobile__icontains=search) | queryset.filter(reg_no__icontains=search)
+        if self.action in ('list', 'retrieve'):
+            # Only the columns behind the fields being rendered
+            queryset = queryset.only(*self.get_serializer().model_columns())
         return queryset
 
-class VisitViewSet(viewsets.ModelViewSet):
-    queryset = Visit.objects.all().order_by('-date')
+    def list(self, request, *args, **kwargs):
+        return self.conditional_response(request, list_version(Patient), lambda: self._list(request, *args, **kwargs))
+
+    def retrieve(self, request, *args, **kwargs):
+        stamp = Patient.objects.filter(pk=lookup_pk(kwargs['pk'])).values_list('updated_at', flat=True).first()
+        return self.conditional_response(request, (stamp,), lambda: super(PatientViewSet, self).retrieve(request, *args, **kwargs))
+
+    def _list(self, request, *args, **kwargs):
+        query = request.query_params.get('search', None)
+        if not query:
+            return self.values_list_response(request) or super().list(request, *args, **kwargs)
+
+        # Search results are ranked and capped rather than paged, but keep
+        # the page envelope so clients read them the same way.
+        limit = self.paginator.get_page_size(request)
+        patients = search_patients(query, limit=limit)
+        serializer = self.get_serializer(patients, many=True)
+        return Response({'next': None, 'previous': None, 'results': serializer.data})
+
+    @action(detail=True, methods=['get'])
+    def timeline(self, request, pk=None):
+        # The full row costs no more than its updated_at, which versions the payload
+        patient = Patient.objects.filter(pk=lookup_pk(pk)).first()
+        if patient is None:
+            raise NotFound()
+        return self.conditional_response(
+            request, (patient.updated_at, catalog.version()), lambda: Response(self._timeline(request, patient))
+        )
+
+    def _timeline(self, request, patient):
+        key = timeline.cache_key(patient, request.build_absolute_uri('/'))
+        data = cache.get(key)
+        if data is None:
+            visits = prefetch_for_visits(
+                Visit.objects.filter(patient=patient).order_by('-date', '-id'), VisitSerializer().fields
+            )
+            data = timeline.payload(patient, list(visits), {'request': request})
+            cache.set(key, data, settings.PATIENT_TIMELINE_CACHE_SECONDS)
+        return data
+
+class VisitViewSet(ValuesListMixin, SparseFieldsViewMixin, ConditionalGetMixin, viewsets.ModelViewSet):
+    queryset = Visit.objects.all().order_by('-date', '-id')
     serializer_class = VisitSerializer
     permission_classes = [IsAuthenticated]
+    pagination_class = VisitPagination
+
+    # Actions whose response is a VisitSerializer representation; reads may
+    # narrow it with ?fields= / ?expand=, writes always render it in full
+    SERIALIZING_ACTIONS = ('list', 'retrieve', 'create', 'update', 'partial_update')
+    READ_ACTIONS = ('list', 'retrieve')
 
     def get_queryset(self):
         queryset = super().get_queryset()
         patient_id = self.request.query_params.get('patientId', None)
         if patient_id:
             queryset = queryset.filter(patient_id=patient_id)
+
+        # Load everything the serializer will touch up front so a page of
+        # visits costs a fixed number of queries instead of several per row,
+        # and nothing it will not.
+        if self.action in self.SERIALIZING_ACTIONS:
+            serializer = self.get_serializer()
+            if self.action in self.READ_ACTIONS:
+                queryset = queryset.only(*serializer.model_columns())
+            queryset = prefetch_for_visits(queryset, serializer.fields)
+        elif self.action == 'add_payment':
+            queryset = queryset.select_related('bill')
+        elif self.action == 'receipt':
+            queryset = queryset.select_related('bill', 'patient')
         return queryset
 
+    def perform_update(self, serializer):
+        visit = serializer.save()
+        if hasattr(visit, 'bill'):
+            receipts.schedule(visit.bill)
+
+    def list(self, request, *args, **kwargs):
+        patient_id = request.query_params.get('patientId', None)
+        if patient_id:
+            # Any change to one of the patient's visits bumps the patient
+            version = Patient.objects.filter(pk=patient_id).values_list('updated_at').first()
+        else:
+            version = list_version(Visit)
+        # Treatment titles and prices in the representation come from the catalog
+        version = version and (*version, catalog.version())
+        return self.conditional_response(request, version, lambda: self._list(request, *args, **kwargs))
+
+    def _list(self, request, *args, **kwargs):
+        return self.values_list_response(request) or super().list(request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        stamp = Visit.objects.filter(pk=lookup_pk(kwargs['pk'])).values_list('updated_at', flat=True).first()
+        return self.conditional_response(
+            request, (stamp, catalog.version()), lambda: super(VisitViewSet, self).retrieve(request, *args, **kwargs)
+        )
+
     @action(detail=True, methods=['post'])
     def upload_attachment(self, request, pk=None):
         visit = self.get_object()
@@ -76,51 +204,88 @@ class VisitViewSet(viewsets.ModelViewSet):
             return Response({'status': 'success'}, status=status.HTTP_200_OK)
         return Response({'details': 'No file provided'}, status=status.HTTP_400_BAD_REQUEST)
 
+    # Resumable uploads: POST uploads/ {filename, size} to start, PUT raw
+    # bytes to uploads/<id>/ with an Upload-Offset header, GET uploads/<id>/
+    # to find where to resume, then POST uploads/<id>/complete/.
     @action(detail=True, methods=['post'])
-    def add_payment(self, request, pk=None):
+    def uploads(self, request, pk=None):
+        visit = self.get_object()
+        try:
+            size = int(request.data.get('size'))
+        except (TypeError, ValueError):
+            return Response({'error': 'size is required'}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            upload = uploads.start_upload(visit, request.data.get('filename') or 'upload', size, request.user)
+        except uploads.UploadError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        return Response(self._upload_state(upload), status=status.HTTP_201_CREATED)
+
+    @action(detail=True, methods=['get', 'put'], url_path=r'uploads/(?P<upload_id>[0-9a-f-]{36})',
+            parser_classes=[])
+    def upload_chunk(self, request, pk=None, upload_id=None):
+        upload = get_object_or_404(AttachmentUpload, pk=upload_id, visit_id=pk)
+        if request.method == 'GET':
+            return Response(self._upload_state(upload))
+        try:
+            offset = int(request.headers.get('Upload-Offset'))
+            length = int(request.headers.get('Content-Length'))
+        except (TypeError, ValueError):
+            return Response({'error': 'Upload-Offset and Content-Length are required'}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            # Read the raw WSGI input so the chunk is never buffered in memory
+            uploads.write_chunk(upload, offset, request._request, length)
+        except uploads.OffsetMismatch as e:
+            return Response({'error': str(e), 'offset': e.expected}, status=status.HTTP_409_CONFLICT)
+        except uploads.UploadError as e:
+            return Response({'error': str(e), 'offset': upload.offset}, status=status.HTTP_400_BAD_REQUEST)
+        return Response(self._upload_state(upload))
+
+    @action(detail=True, methods=['post'], url_path=r'uploads/(?P<upload_id>[0-9a-f-]{36})/complete')
+    def complete_upload(self, request, pk=None, upload_id=None):
+        upload = get_object_or_404(AttachmentUpload, pk=upload_id, visit_id=pk)
+        try:
+            attachment = uploads.finalize(upload, request.data.get('sha256'))
+        except uploads.OffsetMismatch as e:
+            return Response({'error': str(e), 'offset': e.expected}, status=status.HTTP_409_CONFLICT)
+        except uploads.UploadError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        data = self._upload_state(upload)
+        data['url'] = request.build_absolute_uri(attachment.file.url)
+        return Response(data)
+
+    def _upload_state(self, upload):
+        return {'id': str(upload.pk), 'filename': upload.filename, 'size': upload.size, 'offset': upload.offset,
+                'complete': upload.is_complete, 'sha256': upload.sha256}
+
+    @action(detail=True, methods=['get'])
+    def receipt(self, request, pk=None):
         visit = self.get_object()
-        
-        # Ensure Bill exists
         if not hasattr(visit, 'bill'):
-            bill = Bill.objects.create(visit=visit, grand_total=visit.total_amount)
-        else:
-            bill = visit.bill
-        
-        amount = request.data.get('amount')
+            return Response({'error': 'No bill for this visit'}, status=status.HTTP_404_NOT_FOUND)
+        bill = visit.bill
+        bill.visit = visit
+        stamp = max(bill.updated_at, visit.updated_at, visit.patient.updated_at)
+        version = receipts.receipt_version(bill)
+
+        def respond():
+            # Usually already rendered by the job queued on the last change
+            _, html = receipts.get_or_render(bill)
+            return HttpResponse(html, content_type='text/html; charset=utf-8')
+
+        return self.conditional_response(request, (stamp, version), respond)
+
+    @action(detail=True, methods=['post'])
+    def add_payment(self, request, pk=None):
+        visit = self.get_object()
+
         mode = request.data.get('mode', 'cash')
-        
-        if not amount:
-             return Response({'error': 'Amount is required'}, status=status.HTTP_400_BAD_REQUEST)
-        
         try:
-            amount = float(amount)
-        except ValueError:
-             return Response({'error': 'Invalid amount'}, status=status.HTTP_400_BAD_REQUEST)
+            amount = parse_amount(request.data.get('amount'))
+        except ValueError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
 
-        payment = Payment.objects.create(
-            bill=bill,
-            amount=amount,
-            mode=mode,
-            received_by=request.user
-        )
-        
-        # Update Bill Status and Visit amount_paid CACHE
-        total_paid = sum(p.amount for p in bill.payments.all())
-        bill_total = float(bill.grand_total)
-        
-        if total_paid >= bill_total and bill_total > 0:
-            bill.status = 'paid'
-        elif total_paid > 0:
-            bill.status = 'partially_paid'
-        else:
-            bill.status = 'unpaid'
-        bill.save()
-        
-        # Update Cache fields on Visit for backward compatibility
-        visit.amount_paid = total_paid
-        # visit.is_paid? No, that's for consultation fee usually, but maybe we should update it too?
-        # User said "Mark the bill status as PAID...". We updated Bill status.
-        visit.save()
+        payment = record_payment(visit, amount, mode, request.user)
+        receipts.schedule(visit.bill)
 
         return Response({'status': 'success', 'payment_id': payment.id}, status=status.HTTP_200_OK)
 
@@ -160,34 +325,184 @@ class TreatmentViewSet(viewsets.ModelViewSet):
     serializer_class = TreatmentSerializer
     permission_classes = [IsAuthenticated]
 
-class DashboardStatsView(APIView):
+    # Reads are served from the in-process catalog; writes go to the DB and
+    # invalidate it.
+    def list(self, request, *args, **kwargs):
+        return Response(catalog.serialized())
+
+    def retrieve(self, request, *args, **kwargs):
+        try:
+            data = catalog.representation(int(kwargs['pk']))
+        except ValueError:
+            data = None
+        if data is None:
+            raise NotFound()
+        return Response(data)
+
+class DashboardStatsView(ReplicaReadMixin, APIView):
     permission_classes = [IsAuthenticated]
 
     def get(self, request):
         today = timezone.localdate()
-        
-        # 1. Summary Stats
-        total_patients = Patient.objects.count()
-        visits_today = Visit.objects.filter(date=today).count()
-        new_registrations = Patient.objects.filter(first_visit_date=today).count()
-        pending_reports = Visit.objects.filter(diagnosis='').count()
-
-        stats = [
-            {'name': 'Total Patients', 'value': str(total_patients), 'change': '', 'changeType': 'neutral'},
-            {'name': 'Visits Today', 'value': str(visits_today), 'change': '', 'changeType': 'neutral'},
-            {'name': 'New Registrations', 'value': str(new_registrations), 'change': '', 'changeType': 'neutral'},
-            {'name': 'Pending Reports', 'value': str(pending_reports), 'changeType': 'neutral'},
-        ]
-
-        # 2. Chart Data (Last 7 Days)
-        chart_data = []
-        for i in range(6, -1, -1):
-            day = today - timezone.timedelta(days=i)
-            day_name = day.strftime('%a') # Mon, Tue...
-            count = Visit.objects.filter(date=day).count()
-            chart_data.append({'name': day_name, 'visits': count})
+        try:
+            days = dashboard.parse_days(request.query_params.get('days', 7))
+        except ValueError:
+            return Response({'error': 'Invalid days'}, status=status.HTTP_400_BAD_REQUEST)
+
+        # Everything comes from the DailyStats rollup: one aggregate over all
+        # rows for the running totals and one range read for the chart.
+        totals = DailyStats.objects.aggregate(**dashboard.totals_query())
+        rows = dashboard.window_query(today, days)
+        return Response(dashboard.payload(today, days, totals, rows))
+
+class BatchView(APIView):
+    """Applies a list of operations in one transaction; see emr/batch.py."""
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request):
+        operations = request.data.get('operations') if isinstance(request.data, dict) else None
+        try:
+            results = batch.Batch(request).run(operations)
+        except batch.BatchError as e:
+            return Response(e.as_dict(), status=e.status)
+        return Response({'results': results})
 
+class ImportView(APIView):
+    """Bulk import of patients, visits or treatments from CSV or NDJSON.
+
+    The file is sent as the raw request body or as the `file` field of a
+    multipart form, and is read a line at a time (see emr/importer.py).
+    """
+    permission_classes = [IsAuthenticated]
+    parser_classes = [] # Read the body as a stream, never through request.data
+    MAX_BATCH_SIZE = 5000
+
+    def post(self, request, kind):
+        if request.user.role != 'admin' and not request.user.is_superuser:
+            raise PermissionDenied("Only admins can import records.")
+        if kind not in importer.IMPORTERS:
+            raise NotFound()
+
+        content_type = request.content_type or ''
+        if content_type.startswith('multipart/form-data'):
+            stream = request._request.FILES.get('file')
+            if stream is None:
+                return Response({'error': 'No file provided'}, status=status.HTTP_400_BAD_REQUEST)
+            name = stream.name.lower()
+        else:
+            stream, name = request._request, ''
+        fmt = request.query_params.get('fileType') or (
+            'ndjson' if 'ndjson' in content_type or name.endswith(('.ndjson', '.jsonl')) else 'csv'
+        )
+        try:
+            batch_size = int(request.query_params.get('batchSize', 0)) or None
+        except ValueError:
+            return Response({'error': 'Invalid batchSize'}, status=status.HTTP_400_BAD_REQUEST)
+        if batch_size:
+            batch_size = min(max(batch_size, 1), self.MAX_BATCH_SIZE)
+
+        try:
+            report = importer.import_stream(kind, stream, fmt, batch_size=batch_size)
+        except importer.ImportFormatError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        return Response(report.as_dict())
+
+class ExportView(ReplicaReadMixin, APIView):
+    """Streams every visit or payment in a date range as CSV or NDJSON.
+
+    Rows are read with values_list() in chunks and written as they arrive,
+    so a year of data costs the same memory as a day. ?gzip=1 compresses
+    the stream.
+    """
+    permission_classes = [IsAuthenticated]
+    CONTENT_TYPES = {'csv': 'text/csv', 'ndjson': 'application/x-ndjson'}
+
+    def get(self, request, name):
+        if request.user.role != 'admin' and not request.user.is_superuser:
+            raise PermissionDenied("Only admins can export records.")
+        if name not in exports.EXPORTS:
+            raise NotFound()
+        params = request.query_params
+        try:
+            start = datetime.date.fromisoformat(params['from']) if params.get('from') else None
+            end = datetime.date.fromisoformat(params['to']) if params.get('to') else None
+        except ValueError:
+            return Response({'error': 'Dates must be YYYY-MM-DD'}, status=status.HTTP_400_BAD_REQUEST)
+        fmt = params.get('fileType', 'csv')
+        compress = params.get('gzip') in ('1', 'true')
+        try:
+            # Rows are read after the view returns, so the database is fixed now
+            pieces = exports.stream(
+                name, fmt, compress, using=routers.read_alias(), start=start, end=end, doctor=params.get('doctor')
+            )
+        except exports.ExportError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        filename = '-'.join([name] + [str(d) for d in (start, end) if d]) + f'.{fmt}'
+        if compress:
+            response = StreamingHttpResponse(pieces, content_type='application/gzip')
+            filename += '.gz'
+        else:
+            response = StreamingHttpResponse(pieces, content_type=f'{self.CONTENT_TYPES[fmt]}; charset=utf-8')
+        response['Content-Disposition'] = f'attachment; filename="{filename}"'
+        return response
+
+class RevenueReportView(ReplicaReadMixin, APIView):
+    """
+    Consultation fees, treatment charges, collections by payment mode and
+    outstanding balances between ?from= and ?to= (month to date by default),
+    grouped by ?groupBy=day|week|month|doctor|treatment. See emr/revenue.py.
+    """
+    permission_classes = [IsAuthenticated]
+    MONEY = ('consultationFees', 'treatmentCharges', 'collected', 'outstanding')
+    COUNTS = ('consultations', 'treatments', 'payments', 'outstandingBills')
+
+    def get(self, request):
+        if request.user.role != 'admin' and not request.user.is_superuser:
+            raise PermissionDenied("Only admins can view revenue reports.")
+        today = timezone.localdate()
+        params = request.query_params
+        try:
+            start = datetime.date.fromisoformat(params['from']) if params.get('from') else today.replace(day=1)
+            end = datetime.date.fromisoformat(params['to']) if params.get('to') else today
+        except ValueError:
+            return Response({'error': 'Dates must be YYYY-MM-DD'}, status=status.HTTP_400_BAD_REQUEST)
+        group = params.get('groupBy', 'day')
+        if group not in revenue.GROUPS:
+            return Response({'error': f"groupBy must be one of {', '.join(revenue.GROUPS)}"}, status=status.HTTP_400_BAD_REQUEST)
+
+        rows = revenue.report(start, end, group)
+        self._close_stale_days(today)
+
+        totals = revenue.empty_row(None)
+        for row in rows:
+            for field in self.MONEY + self.COUNTS:
+                totals[field] += row[field]
+            for mode, amount in row['collections'].items():
+                totals['collections'][mode] = totals['collections'].get(mode, revenue.ZERO) + amount
+        if group == 'treatment':
+            for row in rows:
+                treatment = catalog.get(int(row['key']))
+                row['title'] = treatment.title if treatment else None
+        del totals['key']
         return Response({
-            'stats': stats,
-            'chartData': chart_data
+            'from': start.isoformat(), 'to': end.isoformat(), 'groupBy': group,
+            'rows': [self._as_json(row) for row in rows], 'totals': self._as_json(totals),
         })
+
+    def _as_json(self, row):
+        # Money as strings, the way the serializers render DecimalFields
+        row = dict(row)
+        for field in self.MONEY:
+            row[field] = str(row[field])
+        row['collections'] = {mode: str(amount) for mode, amount in row['collections'].items()}
+        return row
+
+    def _close_stale_days(self, today):
+        # Days before today are rolled up by the close_revenue job; queue it
+        # if yesterday is not closed yet and nobody else has.
+        through = revenue.closed_through()
+        if through and through >= today - timezone.timedelta(days=1):
+            return
+        if not Job.objects.filter(name='close_revenue', status__in=('queued', 'running')).exists():
+            jobs.enqueue('close_revenue')
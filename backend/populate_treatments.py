@@ -4,7 +4,7 @@ import django
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "config.settings")
 django.setup()
 
-from emr.models import Treatment
+from emr.importer import import_rows
 
 treatments = [
     {"title": "Udwarthanam", "price": 1500, "description": "Therapeutic dry powder massage for obesity and skin issues."},
@@ -17,15 +17,8 @@ treatments = [
     {"title": "Thalapothichil", "price": 1500, "description": "Head pack with medicinal paste."},
 ]
 
-for t in treatments:
-    obj, created = Treatment.objects.get_or_create(
-        title=t['title'],
-        defaults={'price': t['price'], 'description': t['description']}
-    )
-    if created:
-        print(f"Created {t['title']}")
-    else:
-        obj.price = t['price']
-        obj.description = t['description']
-        obj.save()
-        print(f"Updated {t['title']}")
+# Upserts by title, so running this again only touches changed rows
+report = import_rows('treatments', treatments)
+print(f"Created {report.created}, updated {report.updated}, unchanged {report.unchanged}")
+for error in report.errors:
+    print(f"Row {error['row']}: {error['errors']}")
@@ -4,23 +4,42 @@ import { Patient } from '../../types';
 import { Link } from 'react-router-dom';
 import { Search } from 'lucide-react';
 import { Input } from '../../components/ui/Input';
+import { Button } from '../../components/ui/Button';
 
 export const PatientList: React.FC = () => {
     const [patients, setPatients] = useState<Patient[]>([]);
     const [loading, setLoading] = useState(true);
     const [query, setQuery] = useState('');
+    // Cursor of the next page of the unfiltered list; search results are a single page
+    const [next, setNext] = useState<string | null>(null);
+    const [loadingMore, setLoadingMore] = useState(false);
 
     useEffect(() => {
         const fetchPatients = async () => {
             setLoading(true);
-            const data = await api.patients.search(query);
-            setPatients(data);
+            if (query) {
+                setPatients(await api.patients.search(query));
+                setNext(null);
+            } else {
+                const page = await api.patients.list();
+                setPatients(page.results);
+                setNext(page.next);
+            }
             setLoading(false);
         };
         const debounce = setTimeout(fetchPatients, 300);
         return () => clearTimeout(debounce);
     }, [query]);
 
+    const loadMore = async () => {
+        if (!next) return;
+        setLoadingMore(true);
+        const page = await api.patients.list(next);
+        setPatients(prev => [...prev, ...page.results]);
+        setNext(page.next);
+        setLoadingMore(false);
+    };
+
     return (
         <div className="bg-white rounded-xl shadow-sm border border-gray-100 overflow-hidden">
             <div className="p-6 border-b border-gray-100 flex flex-col sm:flex-row sm:items-center justify-between gap-4">
@@ -70,6 +89,11 @@ export const PatientList: React.FC = () => {
                     </tbody>
                 </table>
             </div>
+            {!loading && next && (
+                <div className="p-4 border-t border-gray-100 flex justify-center">
+                    <Button variant="outline" size="sm" isLoading={loadingMore} onClick={loadMore}>Load more</Button>
+                </div>
+            )}
         </div>
     );
 };
\ No newline at end of file
@@ -1,5 +1,5 @@
 import axios from 'axios';
-import { Patient, Visit, User, Stat, Treatment } from '../types';
+import { Patient, Visit, User, Stat, Treatment, Page } from '../types';
 
 // Use environment variable or default to local Django server
 const API_URL = import.meta.env.VITE_API_URL || 'http://127.0.0.1:8000/api';
@@ -13,6 +13,57 @@ client.interceptors.request.use((config) => {
   return config;
 });
 
+// List endpoints return keyset pages: { next, previous, results }.
+// `next`/`previous` are full URLs carrying an opaque cursor.
+const getPage = async <T,>(url: string): Promise<Page<T>> => {
+  const res = await client.get(url);
+  return res.data;
+};
+
+// Walk every page of a list endpoint. Only use for naturally small lists
+// (e.g. one patient's visits); large lists should be paged by the caller.
+const getAllPages = async <T,>(url: string): Promise<T[]> => {
+  const items: T[] = [];
+  let next: string | null = url;
+  while (next) {
+    const page: Page<T> = await getPage<T>(next);
+    items.push(...page.results);
+    next = page.next;
+  }
+  return items;
+};
+
+const UPLOAD_CHUNK_SIZE = 4 * 1024 * 1024;
+const UPLOAD_RETRIES = 5;
+
+// Resumable upload: start, PUT each chunk at its offset, then complete.
+// After a failed chunk we ask the server where to resume instead of restarting.
+const uploadInChunks = async (visitId: string, file: File, onProgress?: (fraction: number) => void) => {
+  const base = `/visits/${visitId}/uploads/`;
+  const started = await client.post(base, { filename: file.name, size: file.size });
+  const uploadId: string = started.data.id;
+  let offset = 0;
+  let failures = 0;
+
+  while (offset < file.size) {
+    const chunk = file.slice(offset, offset + UPLOAD_CHUNK_SIZE);
+    try {
+      const res = await client.put(`${base}${uploadId}/`, chunk, {
+        headers: { 'Content-Type': 'application/octet-stream', 'Upload-Offset': String(offset) }
+      });
+      offset = res.data.offset;
+      failures = 0;
+      onProgress?.(offset / file.size);
+    } catch (e) {
+      if (++failures > UPLOAD_RETRIES) throw e;
+      await new Promise(resolve => setTimeout(resolve, 1000 * failures));
+      offset = (await client.get(`${base}${uploadId}/`)).data.offset;
+    }
+  }
+
+  await client.post(`${base}${uploadId}/complete/`);
+};
+
 export const api = {
   auth: {
     login: async (email: string, password: string): Promise<User> => {
@@ -35,8 +86,12 @@ export const api = {
   },
   patients: {
     search: async (query: string): Promise<Patient[]> => {
-      const res = await client.get(`/patients/?search=${query}`);
-      return res.data;
+      const page = await getPage<Patient>(`/patients/?search=${encodeURIComponent(query)}`);
+      return page.results;
+    },
+    // Pass `page.next` from a previous call to continue; omit for the first page.
+    list: async (cursorUrl?: string, pageSize?: number): Promise<Page<Patient>> => {
+      return getPage<Patient>(cursorUrl || `/patients/${pageSize ? `?pageSize=${pageSize}` : ''}`);
     },
     getById: async (id: string): Promise<Patient | undefined> => {
       try {
@@ -76,8 +131,11 @@ export const api = {
   },
   visits: {
     getByPatientId: async (patientId: string): Promise<Visit[]> => {
-      const res = await client.get(`/visits/?patientId=${patientId}`);
-      return res.data;
+      // List responses are compact by default; the history view opens full visits from this list
+      return getAllPages<Visit>(`/visits/?patientId=${patientId}&expand=*`);
+    },
+    list: async (cursorUrl?: string, pageSize?: number): Promise<Page<Visit>> => {
+      return getPage<Visit>(cursorUrl || `/visits/${pageSize ? `?pageSize=${pageSize}` : ''}`);
     },
     create: async (data: any): Promise<Visit> => {
       // If just booking status, simple JSON is fine, but we might have files.
@@ -159,13 +217,23 @@ export const api = {
 
       return (await client.patch(`/visits/${id}/`, data)).data;
     },
-    uploadAttachment: async (id: string, file: File): Promise<void> => {
+    uploadAttachment: async (id: string, file: File, onProgress?: (fraction: number) => void): Promise<void> => {
+      // Large scans go through the resumable chunked protocol
+      if (file.size > UPLOAD_CHUNK_SIZE) {
+        await uploadInChunks(id, file, onProgress);
+        return;
+      }
       const formData = new FormData();
       formData.append('file', file);
       await client.post(`/visits/${id}/upload_attachment/`, formData, {
         headers: { 'Content-Type': 'multipart/form-data' }
       });
     },
+    // Printable HTML invoice, rendered and cached by the server per bill version
+    getReceipt: async (id: string): Promise<string> => {
+      const res = await client.get(`/visits/${id}/receipt/`, { responseType: 'text' });
+      return res.data;
+    },
     addPayment: async (id: string, amount: number, mode: string): Promise<any> => {
       const res = await client.post(`/visits/${id}/add_payment/`, { amount, mode });
       return res.data;
@@ -206,8 +274,9 @@ export const api = {
     }
   },
   dashboard: {
-    getStats: async (): Promise<{ stats: Stat[]; chartData: any[] }> => {
-      const res = await client.get('/dashboard/stats/');
+    // `days` widens the chart window (7 by default, e.g. 30 or 90)
+    getStats: async (days?: number): Promise<{ stats: Stat[]; chartData: any[] }> => {
+      const res = await client.get('/dashboard/stats/', { params: days ? { days } : undefined });
       return res.data;
     }
   }
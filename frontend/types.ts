@@ -50,6 +50,12 @@ export interface Bill {
   totalPaid: number;
 }
 
+export interface AttachmentPreview {
+  url: string;
+  thumbnail: string | null; // null when the file is not an image
+  preview: string | null;
+}
+
 export interface Visit {
   id: string;
   patientId: string;
@@ -61,6 +67,7 @@ export interface Visit {
   investigations: string;
   notes?: string;
   attachments?: string[];
+  attachmentPreviews?: AttachmentPreview[];
 
   // New Fields
   status: VisitStatus;
@@ -87,4 +94,11 @@ export interface Stat {
   value: string;
   change?: string;
   changeType?: 'positive' | 'negative' | 'neutral';
-}
\ No newline at end of file
+}
+
+// Keyset paginated list response from the API
+export interface Page<T> {
+  next: string | null;
+  previous: string | null;
+  results: T[];
+}